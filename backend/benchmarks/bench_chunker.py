@@ -0,0 +1,102 @@
+"""
+Chunker Throughput Benchmark
+Compares the section-aware span chunker against the previous fixed-window
+chunker on a synthetic markdown document (5 MB by default).
+
+    python -m benchmarks.bench_chunker [--mb 5] [--chunk-size 1000] [--overlap 200]
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.synthetic import generate_markdown
+from services.markdown_chunker import iter_blocks, iter_chunk_spans
+
+
+def legacy_chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200):
+    """The original PathwayRAG._chunk_text, kept here as the baseline"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end]
+        if end < len(text):
+            last_period = chunk.rfind('.')
+            last_newline = chunk.rfind('\n')
+            break_point = max(last_period, last_newline)
+            if break_point > chunk_size * 0.5:
+                chunk = chunk[:break_point + 1]
+                end = start + break_point + 1
+        chunks.append(chunk.strip())
+        start = end - overlap
+    return [c for c in chunks if c]
+
+
+def _tables(text):
+    return [(s, e) for s, e, kind, _, _ in iter_blocks(text) if kind == "table"]
+
+
+def _split_tables(tables, spans):
+    """Tables whose text is not fully contained in a single span"""
+    split = 0
+    for ts, te in tables:
+        if not any(s <= ts and te <= e for s, e in spans):
+            split += 1
+    return split
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=5.0)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = generate_markdown(int(args.mb * 1024 * 1024))
+    mb = len(text) / (1024 * 1024)
+
+    def best_of(fn):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - t0)
+        return min(times), result
+
+    legacy_s, legacy_chunks = best_of(lambda: legacy_chunk_text(text, args.chunk_size, args.overlap))
+    spans_s, spans = best_of(lambda: list(iter_chunk_spans(text, args.chunk_size, args.overlap)))
+
+    # Legacy chunks are stripped copies; locate them to count split tables
+    legacy_spans = []
+    cursor = 0
+    for chunk in legacy_chunks:
+        pos = text.find(chunk, max(0, cursor - args.chunk_size))
+        if pos >= 0:
+            legacy_spans.append((pos, pos + len(chunk)))
+            cursor = pos + len(chunk)
+
+    tables = _tables(text)
+    report = {
+        "document_mb": round(mb, 2),
+        "tables": len(tables),
+        "legacy": {
+            "seconds": round(legacy_s, 4),
+            "mb_per_s": round(mb / legacy_s, 1),
+            "chunks": len(legacy_chunks),
+            "tables_split": _split_tables(tables, legacy_spans),
+        },
+        "section_aware": {
+            "seconds": round(spans_s, 4),
+            "mb_per_s": round(mb / spans_s, 1),
+            "chunks": len(spans),
+            "tables_split": _split_tables(tables, [(s, e) for s, e, _ in spans]),
+            "sections": len({path for _, _, path in spans}),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Embedding Backend Benchmark
+Compares the PyTorch sentence-transformers model with the exported ONNX model
+(fp32 and dynamic int8) on load time, indexing throughput (chunks/sec and
+docs/sec), single-query latency and peak RSS. Each backend runs in its own
+process so imports and RSS don't leak between them. ONNX vectors are checked
+against the PyTorch vectors for the same texts (min/mean cosine).
+
+    python -m benchmarks.bench_embeddings [--backends torch,onnx,onnx-int8,hashing]
+        [--docs 10] [--doc-kb 100] [--queries 100] [--out embeddings.json]
+
+Export the ONNX model first: python -m services.onnx_embedder export --quantize
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ["torch", "onnx", "onnx-int8", "hashing"]
+QUERIES = [
+    "What is the debt-to-equity ratio?",
+    "customer concentration risk",
+    "change of control consent assignment",
+    "pending litigation regulatory",
+    "working capital liquidity facility",
+]
+
+
+def _load(backend: str):
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer("all-MiniLM-L6-v2")
+    if backend in ("onnx", "onnx-int8"):
+        from services import onnx_embedder
+        # Bypass the tolerance gate so drifting variants are still measured (and reported)
+        return onnx_embedder.OnnxEmbedder(onnx_embedder.ONNX_DIR, quantized=backend == "onnx-int8")
+    if backend == "hashing":
+        from benchmarks.synthetic import HashingEncoder
+        return HashingEncoder()
+    raise ValueError(f"Unknown backend {backend}")
+
+
+def worker(args) -> dict:
+    """Measure one backend in this process"""
+    import numpy as np
+
+    from benchmarks.report import peak_rss_mb, summarize
+    from benchmarks.synthetic import generate_markdown
+    from services.markdown_chunker import chunk_text
+    from services.onnx_embedder import COMPAT_SAMPLES
+
+    docs = [chunk_text(generate_markdown(args.doc_kb * 1024, seed=i)) for i in range(args.docs)]
+    baseline_rss = peak_rss_mb()
+
+    t0 = time.perf_counter()
+    model = _load(args.worker)
+    load_s = time.perf_counter() - t0
+    load_rss = peak_rss_mb()
+
+    model.encode(QUERIES, convert_to_numpy=True)  # warm-up
+
+    chunks = sum(len(d) for d in docs)
+    t0 = time.perf_counter()
+    for doc_chunks in docs:
+        model.encode(doc_chunks, convert_to_numpy=True, batch_size=32)
+    index_s = time.perf_counter() - t0
+
+    latencies = []
+    for i in range(args.queries):
+        t0 = time.perf_counter()
+        model.encode(QUERIES[i % len(QUERIES)], convert_to_numpy=True)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    np.save(args.vectors_out, np.asarray(model.encode(COMPAT_SAMPLES, convert_to_numpy=True), dtype=np.float32))
+    return {
+        "load_s": round(load_s, 3),
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / index_s, 1),
+        "docs_per_s": round(len(docs) / index_s, 3),
+        "query": summarize(latencies),
+        "rss_mb": {"baseline": baseline_rss, "after_load": load_rss, "peak": peak_rss_mb()},
+    }
+
+
+def _run_backend(backend: str, args, vectors_path: str) -> dict:
+    cmd = [
+        sys.executable, "-m", "benchmarks.bench_embeddings", "--worker", backend, "--vectors-out", vectors_path,
+        "--docs", str(args.docs), "--doc-kb", str(args.doc_kb), "--queries", str(args.queries),
+    ]
+    proc = subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        error = (proc.stderr or proc.stdout).strip().splitlines()
+        return {"error": error[-1] if error else f"exit code {proc.returncode}"}
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--doc-kb", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args)))
+        return
+
+    import numpy as np
+
+    from benchmarks.report import environment, write_report
+    from services.onnx_embedder import COMPAT_TOLERANCE
+
+    workdir = tempfile.mkdtemp(prefix="bench-embeddings-")
+    results, vectors = {}, {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        path = os.path.join(workdir, f"{backend}.npy")
+        print(f"⏱️ {backend} ...", file=sys.stderr)
+        results[backend] = _run_backend(backend, args, path)
+        if os.path.exists(path):
+            vectors[backend] = np.load(path)
+
+    # Vectors must stay comparable with indexes built by the PyTorch model
+    if "torch" in vectors:
+        reference = vectors["torch"]
+        for backend in ("onnx", "onnx-int8"):
+            if backend in vectors and vectors[backend].shape == reference.shape:
+                cosines = (reference * vectors[backend]).sum(axis=1) / (
+                    np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors[backend], axis=1)
+                )
+                results[backend]["vs_torch"] = {
+                    "min_cosine": round(float(cosines.min()), 5),
+                    "mean_cosine": round(float(cosines.mean()), 5),
+                    "compatible": bool(cosines.min() >= COMPAT_TOLERANCE),
+                }
+
+    write_report({
+        "benchmark": "embeddings",
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "worker", "vectors_out")},
+        "tolerance": COMPAT_TOLERANCE,
+        "backends": results,
+    }, os.path.abspath(args.out) if args.out else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Structured Extraction Benchmark
+Extracts the 39-field schema from synthetic filings of growing size through
+the local stubs, once with the single whole-document /extract call and once
+split across sections (services.sectioned_extraction). Stub latency grows
+with the markdown sent (--extract-ms + --extract-ms-per-kb * KB), so the
+comparison reflects payload size as well as call count and concurrency.
+
+    python -m benchmarks.bench_extract [--doc-kb 60,300,1000] [--extract-ms 400]
+        [--extract-ms-per-kb 8] [--concurrency 4] [--out extract.json]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from benchmarks import stubs
+from benchmarks.report import environment, write_report
+from benchmarks.synthetic import generate_markdown
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--doc-kb", default="60,300,1000")
+    parser.add_argument("--extract-ms", type=float, default=400)
+    parser.add_argument("--extract-ms-per-kb", type=float, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    config = stubs.StubConfig(extract_ms=args.extract_ms, jitter=0.0, extract_ms_per_kb=args.extract_ms_per_kb)
+    base_url, stub_process = stubs.start_in_subprocess(config)
+    os.environ["LANDINGAI_BASE_URL"] = base_url + stubs.LANDINGAI_PATH
+    os.environ["LANDINGAI_EXTRACT_CONCURRENCY"] = str(args.concurrency)
+    os.environ["EXTRACT_SECTIONED_MIN_CHARS"] = "0"  # measure the split path at every size
+    from services import sectioned_extraction
+    from services.extraction_schema import COMPREHENSIVE_SCHEMA
+
+    results = []
+    try:
+        for kb in [int(k) for k in args.doc_kb.split(",")]:
+            markdown = generate_markdown(kb * 1024, seed=kb)
+            row = {"doc_kb": kb}
+            for mode in ("single", "sections"):
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = sectioned_extraction.extract(markdown, COMPREHENSIVE_SCHEMA, mode=mode)
+                stats = response["metadata"]
+                row[mode] = {
+                    "wall_ms": round((time.perf_counter() - t0) * 1000, 1),
+                    "calls": stats["calls"],
+                    "payload_kb": round(stats["payload_bytes"] / 1024, 1),
+                    "max_call_kb": round(stats.get("max_call_bytes", stats["payload_bytes"]) / 1024, 1),
+                    "fields_filled": sum(1 for v in response["extraction"].values() if v not in (None, "")),
+                    "conflicts": len(response.get("conflicts", {})),
+                }
+            row["speedup"] = round(row["single"]["wall_ms"] / row["sections"]["wall_ms"], 2)
+            results.append(row)
+    finally:
+        stub_process.terminate()
+
+    write_report({
+        "benchmark": "extract",
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }, os.path.abspath(args.out) if args.out else None)
+
+
+if __name__ == "__main__":
+    main()
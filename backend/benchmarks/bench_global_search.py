@@ -0,0 +1,91 @@
+"""
+Cross-Dataroom Search Latency Benchmark
+Builds N synthetic datarooms in one PathwayRAG instance and measures
+search_global latency with serial vs thread-pool shard scans.
+
+    python -m benchmarks.bench_global_search [--datarooms 100] [--docs 3] [--doc-kb 200]
+"""
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import generate_markdown, HashingEncoder
+from services import pathway_rag
+
+QUERIES = [
+    "change of control consent assignment",
+    "customer concentration risk",
+    "credit agreement covenant leverage",
+    "pending litigation regulatory",
+    "working capital liquidity facility",
+]
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def build(rag, datarooms, docs, doc_kb):
+    t0 = time.perf_counter()
+    for t in range(datarooms):
+        for d in range(docs):
+            markdown = generate_markdown(doc_kb * 1024, seed=t * 1000 + d)
+            rag.index_document(f"task-{t}", f"doc-{t}-{d}", markdown, {}, {"filename": f"filing-{d}.pdf"})
+    return time.perf_counter() - t0
+
+
+def measure(rag, rounds):
+    latencies = []
+    for _ in range(rounds):
+        for q in QUERIES:
+            t0 = time.perf_counter()
+            rag.search_global(q, top_k=20)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datarooms", type=int, default=100)
+    parser.add_argument("--docs", type=int, default=3)
+    parser.add_argument("--doc-kb", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    # Use the real model when installed, otherwise a hashing encoder of the same shape
+    rag = pathway_rag.PathwayRAG()
+    if rag.embedding_model is None:
+        rag.embedding_model = HashingEncoder()
+        pathway_rag.EMBEDDINGS_AVAILABLE = True
+
+    build_s = build(rag, args.datarooms, args.docs, args.doc_kb)
+    total_rows = sum(idx.live_rows for idx in rag.tasks.values())
+
+    rag.search_threads = 1
+    rag._shard_pool = ThreadPoolExecutor(max_workers=1)
+    serial = measure(rag, args.rounds)
+    rag.search_threads = args.threads
+    rag._shard_pool = ThreadPoolExecutor(max_workers=args.threads)
+    parallel = measure(rag, args.rounds)
+
+    print(json.dumps({
+        "datarooms": args.datarooms,
+        "chunks": total_rows,
+        "encoder": type(rag.embedding_model).__name__,
+        "index_build_s": round(build_s, 1),
+        "serial": serial,
+        f"parallel_{args.threads}_threads": parallel,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
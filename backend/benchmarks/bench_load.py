@@ -0,0 +1,336 @@
+"""
+HTTP Load-Test Scenarios
+Starts the stub services and an instrumented uvicorn server
+(benchmarks/load_server.py), then runs a weighted mix of uploads, chat
+questions (with status polling), chat history reads, memo reads and memo
+exports with closed-loop virtual users at increasing concurrency. The
+read-only scenarios (history, status, result, tasks, memo) on their own
+measure how many requests/s the request path's database access sustains.
+
+For each level it records throughput, latency per endpoint and the server's
+saturation probes. It then reports where throughput stops scaling and which
+resource saturated first: event loop, threadpool, SQLite, embedding model
+or CPU.
+
+    python -m benchmarks.bench_load [--levels 1,2,4,8,16,32] [--duration 20]
+        [--mix upload=1,ask=2,history=4,memo=2,export=1] [--out load.json]
+    python -m benchmarks.bench_load --mix history=2,status=2,result=1,tasks=1 --levels 1,8,32,64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+import httpx
+
+from benchmarks import stubs
+from benchmarks.report import environment, summarize, write_report
+from benchmarks.synthetic import generate_markdown
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "upload=1,ask=2,history=4,memo=2,export=1"
+SCENARIOS = {"upload", "ask", "history", "status", "result", "tasks", "memo", "export"}
+QUESTIONS = [
+    "What is the revenue trend and how has leverage changed?",
+    "Are there any change of control provisions in the material contracts?",
+    "Summarize the key liquidity and customer concentration risks.",
+]
+
+# A resource counts as saturated once its score reaches 1.0
+SATURATION_RULES = {
+    "event_loop": lambda d: d["event_loop"]["lag_p99_ms"] / 100,
+    "threadpool": lambda d: max(d["threadpool"]["at_capacity_fraction"] * 2, 1.0 if d["threadpool"]["waiting_max"] else 0.0),
+    "sqlite": lambda d: max(
+        1.0 if d["sqlite"]["locked_errors"] else 0.0,
+        d["sqlite"]["pool_wait_p95_ms"] / 100,
+        d["sqlite"]["write_p95_ms"] / 100,
+        d["sqlite"]["checked_out_max"] / d["sqlite"]["pool_capacity"] if d["sqlite"]["pool_capacity"] else 0.0,
+    ),
+    "embedding": lambda d: d["embedding"]["busy_fraction"] / 0.5,
+    "cpu": lambda d: d["cpu"]["utilization"] / (0.9 * (d["cpu"]["cores"] or 1)),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - SCENARIOS
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s) in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, endpoint: str, elapsed_ms: float, ok: bool):
+        self.samples.setdefault(endpoint, []).append(elapsed_ms)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    async def call(self, endpoint: str, request):
+        t0 = time.perf_counter()
+        try:
+            resp = await request
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            resp, ok = None, False
+        self.add(endpoint, (time.perf_counter() - t0) * 1000, ok)
+        return resp if ok else None
+
+
+# ----------------------
+# Scenarios
+# ----------------------
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, task_ids, chat_ids, payloads, poll_interval: float):
+        self.client = client
+        self.task_ids = task_ids
+        self.chat_ids = chat_ids        # {task_id: answered chat seeded into it}
+        self.payloads = payloads
+        self.poll_interval = poll_interval
+        self.uploads = 0
+
+    async def upload(self, rec: Recorder, rng: random.Random):
+        self.uploads += 1
+        payload = self.payloads[self.uploads % len(self.payloads)]
+        await rec.call("upload", self.client.post(
+            f"/tasks/{rng.choice(self.task_ids)}/documents/",
+            files={"file": (f"load-{self.uploads}.pdf", payload, "application/pdf")},
+        ))
+
+    async def ask(self, rec: Recorder, rng: random.Random):
+        task_id = rng.choice(self.task_ids)
+        t0 = time.perf_counter()
+        resp = await rec.call("chat_post", self.client.post(f"/tasks/{task_id}/chat/", json={"message": rng.choice(QUESTIONS)}))
+        if resp is None:
+            return
+        chat_id = resp.json()["chat_id"]
+        status = "pending"
+        while status not in ("done", "failed") and time.perf_counter() - t0 < 120:
+            await asyncio.sleep(self.poll_interval)
+            polled = await rec.call("chat_status", self.client.get(f"/tasks/{task_id}/chat/{chat_id}/status"))
+            status = polled.json().get("status") if polled is not None else status
+        rec.add("chat_e2e", (time.perf_counter() - t0) * 1000, status == "done")
+
+    async def history(self, rec: Recorder, rng: random.Random):
+        await rec.call("chat_history", self.client.get(f"/tasks/{rng.choice(self.task_ids)}/chat/"))
+
+    async def status(self, rec: Recorder, rng: random.Random):
+        task_id = rng.choice(self.task_ids)
+        await rec.call("chat_status", self.client.get(f"/tasks/{task_id}/chat/{self.chat_ids[task_id]}/status"))
+
+    async def result(self, rec: Recorder, rng: random.Random):
+        task_id = rng.choice(self.task_ids)
+        await rec.call("chat_result", self.client.get(f"/tasks/{task_id}/chat/{self.chat_ids[task_id]}"))
+
+    async def tasks(self, rec: Recorder, rng: random.Random):
+        await rec.call("tasks", self.client.get("/tasks/"))
+
+    async def memo(self, rec: Recorder, rng: random.Random):
+        await rec.call("memo", self.client.get(f"/tasks/{rng.choice(self.task_ids)}/memo/"))
+
+    async def export(self, rec: Recorder, rng: random.Random):
+        await rec.call("memo_export", self.client.post(f"/tasks/{rng.choice(self.task_ids)}/memo/export"))
+
+
+async def _virtual_user(workload: Workload, mix: dict, rec: Recorder, deadline: float, seed: int):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        await getattr(workload, rng.choices(names, weights)[0])(rec, rng)
+
+
+async def run_level(workload: Workload, mix: dict, concurrency: int, duration: float, seed: int) -> dict:
+    client = workload.client
+    await client.post("/__diagnostics/reset")
+    rec = Recorder()
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+    await asyncio.gather(*(_virtual_user(workload, mix, rec, deadline, seed * 1000 + i) for i in range(concurrency)))
+    wall = time.perf_counter() - t0
+    diagnostics = (await client.get("/__diagnostics")).json()
+
+    # chat_e2e spans several requests, so keep it out of the request count
+    request_endpoints = [e for e in rec.samples if e != "chat_e2e"]
+    requests_done = sum(len(rec.samples[e]) for e in request_endpoints)
+    errors = sum(rec.errors.get(e, 0) for e in request_endpoints)
+    all_latencies = [ms for e in request_endpoints for ms in rec.samples[e]]
+    return {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 2),
+        "requests": requests_done,
+        "errors": errors,
+        "rps": round((requests_done - errors) / wall, 2),
+        "latency": summarize(all_latencies, errors),
+        "endpoints": {e: summarize(s, rec.errors.get(e, 0)) for e, s in sorted(rec.samples.items())},
+        "diagnostics": diagnostics,
+        "saturation_scores": {name: round(rule(diagnostics), 2) for name, rule in SATURATION_RULES.items()},
+    }
+
+
+def analyze(levels: list) -> dict:
+    """Throughput knee and the first resource to saturate"""
+    knee = None
+    best_rps = 0.0
+    for level in levels:
+        # Concurrency went up but throughput grew by less than 10%
+        if best_rps and level["rps"] < best_rps * 1.1:
+            knee = level["concurrency"]
+            break
+        best_rps = max(best_rps, level["rps"])
+
+    first = None
+    for level in levels:
+        saturated = {name: score for name, score in level["saturation_scores"].items() if score >= 1.0}
+        if saturated:
+            name = max(saturated, key=saturated.get)
+            first = {"resource": name, "concurrency": level["concurrency"], "score": saturated[name], "also_saturated": sorted(set(saturated) - {name})}
+            break
+
+    return {
+        "peak_rps": best_rps,
+        "throughput_knee_concurrency": knee,
+        "first_saturated": first,
+    }
+
+
+async def _seed(client: httpx.AsyncClient, datarooms: int, payloads: list):
+    """Datarooms with one document and one answered question each, so reads have data"""
+    task_ids, chat_ids = [], {}
+    for t in range(datarooms):
+        task_id = (await client.post("/tasks/", json={"name": f"Load Dataroom {t}"})).json()["id"]
+        await client.post(f"/tasks/{task_id}/documents/", files={"file": ("seed.pdf", payloads[t % len(payloads)], "application/pdf")})
+        chat_id = (await client.post(f"/tasks/{task_id}/chat/", json={"message": QUESTIONS[0]})).json()["chat_id"]
+        for _ in range(600):
+            status = (await client.get(f"/tasks/{task_id}/chat/{chat_id}/status")).json()["status"]
+            if status in ("done", "failed"):
+                break
+            await asyncio.sleep(0.1)
+        task_ids.append(task_id)
+        chat_ids[task_id] = chat_id
+    return task_ids, chat_ids
+
+
+async def drive(base_url: str, args, mix: dict) -> dict:
+    payloads = [
+        generate_markdown(args.doc_kb * 1024, seed=args.seed + i, company=f"Company {i}", period=f"Q{i % 4 + 1} 2024").encode()
+        for i in range(16)
+    ]
+    limits = httpx.Limits(max_connections=max(args.levels) * 2 + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        task_ids, chat_ids = await _seed(client, args.datarooms, payloads)
+        workload = Workload(client, task_ids, chat_ids, payloads, args.poll_interval)
+        levels = []
+        for concurrency in args.levels:
+            level = await run_level(workload, mix, concurrency, args.duration, args.seed)
+            levels.append(level)
+            scores = ", ".join(f"{k}={v}" for k, v in level["saturation_scores"].items())
+            print(f"📈 c={concurrency}: {level['rps']} req/s, p95 {level['latency'].get('p95_ms', 0)} ms, errors {level['errors']} [{scores}]", file=sys.stderr)
+        encoder = (await client.get("/__diagnostics")).json().get("encoder")
+    return {"encoder": encoder, "levels": levels, "analysis": analyze(levels)}
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights")
+    parser.add_argument("--datarooms", type=int, default=4)
+    parser.add_argument("--doc-kb", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="chat status polling interval (s)")
+    parser.add_argument("--parse-ms", type=float, default=stubs.StubConfig.parse_ms)
+    parser.add_argument("--extract-ms", type=float, default=stubs.StubConfig.extract_ms)
+    parser.add_argument("--llm-ms", type=float, default=stubs.StubConfig.llm_ms)
+    parser.add_argument("--error-rate", type=float, default=stubs.StubConfig.error_rate)
+    parser.add_argument("--encoder", choices=["auto", "none"], default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database, uploads and server log")
+    args = parser.parse_args()
+    args.levels = [int(c) for c in args.levels.split(",")]
+    mix = _parse_mix(args.mix)
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    stub_config = stubs.StubConfig(
+        parse_ms=args.parse_ms, extract_ms=args.extract_ms, llm_ms=args.llm_ms,
+        error_rate=args.error_rate, seed=args.seed,
+    )
+    stub_url, stub_process = stubs.start_in_subprocess(stub_config)
+
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "LANDINGAI_BASE_URL": f"{stub_url}{stubs.LANDINGAI_PATH}",
+        "OPENROUTER_BASE_URL": f"{stub_url}{stubs.OPENROUTER_PATH}",
+        "LANDINGAI_API_KEY": "stub",
+        "OPENROUTER_API_KEY": "stub",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        "SQL_ECHO": "0",
+        "DECOMPOSITION_CACHE_PATH": os.path.join(workdir, "decomposition_cache.json"),
+    }
+    log_path = os.path.join(workdir, "server.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.load_server", "--port", str(port), "--encoder", args.encoder],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        _wait_ready(base_url, server)
+        result = asyncio.run(drive(base_url, args, mix))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        stub_process.terminate()
+        if args.keep:
+            print(f"📁 Kept load-test data and server log in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report({
+        "benchmark": "load",
+        "environment": environment(),
+        "config": {**{k: v for k, v in vars(args).items() if k not in ("out", "keep")}, "mix": mix, "stubs": asdict(stub_config)},
+        **result,
+    }, out_path)
+
+
+if __name__ == "__main__":
+    main()
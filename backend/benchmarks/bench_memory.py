@@ -0,0 +1,117 @@
+"""
+RAG Memory Budget Benchmark
+Cycles through many synthetic datarooms (index one document, search it,
+occasionally revisit an older dataroom) under a PathwayRAG memory budget and
+samples process RSS. With a budget, RSS should plateau once the budget is
+reached; with --budget-mb 0 it grows with every dataroom.
+
+    python -m benchmarks.bench_memory [--datarooms 1000] [--doc-kb 60] [--budget-mb 64]
+        [--revisit-every 10] [--check] [--out memory.json]
+
+--check exits non-zero when RSS keeps growing after the warm-up phase.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.report import current_rss_mb, environment, peak_rss_mb, summarize, write_report
+from benchmarks.synthetic import generate_markdown, HashingEncoder
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datarooms", type=int, default=1000)
+    parser.add_argument("--doc-kb", type=int, default=60)
+    parser.add_argument("--budget-mb", type=float, default=64, help="0 = unbounded (baseline)")
+    parser.add_argument("--revisit-every", type=int, default=10, help="search an older dataroom every N datarooms")
+    parser.add_argument("--pinned", type=int, default=3, help="pin the first N datarooms")
+    parser.add_argument("--warmup", type=float, default=0.25, help="fraction of the run before RSS must plateau")
+    parser.add_argument("--tolerance-mb", type=float, default=48, help="allowed RSS growth after warm-up")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    cold_dir = tempfile.mkdtemp(prefix="bench-memory-")
+    os.environ["RAG_MEMORY_BUDGET_MB"] = str(args.budget_mb)
+    os.environ["RAG_COLD_DIR"] = cold_dir
+
+    from services import pathway_rag
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = pathway_rag.PathwayRAG()
+    if rag.embedding_model is None:
+        rag.embedding_model = HashingEncoder()
+        pathway_rag.EMBEDDINGS_AVAILABLE = True
+
+    rng = random.Random(args.seed)
+    markdown = [generate_markdown(args.doc_kb * 1024, seed=i) for i in range(16)]  # reused, so text generation isn't measured
+    samples, search_ms, revisit_ms = [], [], []
+    start_rss = current_rss_mb()
+    t_start = time.perf_counter()
+    try:
+        for i in range(args.datarooms):
+            task_id = f"dataroom-{i:05d}"
+            with contextlib.redirect_stdout(io.StringIO()):
+                rag.index_document(task_id, f"doc-{i}", markdown[i % len(markdown)], {"Revenue": i}, {"filename": f"filing-{i}.pdf"})
+            if i < args.pinned:
+                rag.pin(task_id)
+
+            t0 = time.perf_counter()
+            rag.search(task_id, "customer concentration revenue", 5)
+            search_ms.append((time.perf_counter() - t0) * 1000)
+
+            if args.revisit_every and i and i % args.revisit_every == 0:
+                old = f"dataroom-{rng.randrange(i):05d}"
+                t0 = time.perf_counter()
+                hits = rag.search(old, "credit agreement covenant", 5)
+                revisit_ms.append((time.perf_counter() - t0) * 1000)
+                assert hits, f"revisited dataroom {old} returned no results"
+
+            if i % 25 == 0 or i == args.datarooms - 1:
+                stats = rag.memory_stats()
+                samples.append({
+                    "datarooms": i + 1,
+                    "rss_mb": current_rss_mb(),
+                    "resident_tasks": stats["resident_tasks"],
+                    "resident_mb": round(stats["resident_bytes"] / (1024 * 1024), 1),
+                    "cold_tasks": stats["cold_tasks"],
+                })
+        elapsed = time.perf_counter() - t_start
+        stats = rag.memory_stats()
+    finally:
+        shutil.rmtree(cold_dir, ignore_errors=True)
+
+    warm = [s for s in samples if s["datarooms"] >= args.datarooms * args.warmup]
+    growth = round(max(s["rss_mb"] for s in warm) - warm[0]["rss_mb"], 1) if warm else 0.0
+    bounded = growth <= args.tolerance_mb
+
+    write_report({
+        "benchmark": "memory",
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "elapsed_s": round(elapsed, 1),
+        "rss_mb": {"start": start_rss, "end": samples[-1]["rss_mb"], "peak": peak_rss_mb(), "growth_after_warmup": growth},
+        "bounded": bounded,
+        "evictions": stats["evictions"],
+        "reloads": stats["reloads"],
+        "pinned_resident": set(stats["pinned"]) <= {t["task_id"] for t in stats["tasks"]},
+        "search_new": summarize(search_ms),
+        "search_revisit": summarize(revisit_ms),
+        "samples": samples,
+    }, os.path.abspath(args.out) if args.out else None)
+
+    if args.check and not bounded:
+        print(f"❌ RSS grew {growth} MB after warm-up (tolerance {args.tolerance_mb} MB)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
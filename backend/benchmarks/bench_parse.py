@@ -0,0 +1,100 @@
+"""
+Large PDF Parse Benchmark
+Generates N-page PDFs and parses them through landing_ai.parse_pdf against
+the local stubs, whose parse latency grows with the page count
+(--parse-ms + --parse-ms-per-page * pages). Compares one request for the
+whole file with page ranges parsed concurrently, and checks that the
+stitched page table maps every page's marker back to the right page.
+
+    python -m benchmarks.bench_parse [--pages 10,50,200] [--pages-per-range 20]
+        [--concurrency 4] [--parse-ms 300] [--parse-ms-per-page 40] [--out parse.json]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import stubs
+from benchmarks.report import environment, write_report
+
+
+def make_pdf(path: str, pages: int):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(path, pagesize=letter)
+    for page in range(1, pages + 1):
+        text = pdf.beginText(72, 720)
+        text.textLine(f"PAGE-MARKER-{page:05d}")
+        for line in range(30):
+            text.textLine(f"Section {page}.{line}: revenue, covenants and working capital discussion.")
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+
+
+def page_accuracy(parsed: dict, pages: int) -> float:
+    from services.markdown_chunker import page_offsets_index, page_range
+
+    markdown, page_offsets = parsed["markdown"], parsed.get("page_offsets")
+    offsets = page_offsets_index(page_offsets)
+    correct = 0
+    for page in range(1, pages + 1):
+        pos = markdown.find(f"PAGE-MARKER-{page:05d}")
+        correct += pos >= 0 and page_range(pos, pos + 1, page_offsets, offsets)[0] == page
+    return round(correct / pages, 4)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", default="10,50,200")
+    parser.add_argument("--pages-per-range", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--parse-ms", type=float, default=300)
+    parser.add_argument("--parse-ms-per-page", type=float, default=40)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    config = stubs.StubConfig(parse_ms=args.parse_ms, jitter=0.0, parse_ms_per_page=args.parse_ms_per_page)
+    base_url, stub_process = stubs.start_in_subprocess(config)
+    os.environ["LANDINGAI_BASE_URL"] = base_url + stubs.LANDINGAI_PATH
+    os.environ["LANDINGAI_PARSE_CONCURRENCY"] = str(args.concurrency)
+    from services import landing_ai
+
+    workdir = tempfile.mkdtemp(prefix="bench-parse-")
+    results = []
+    try:
+        for pages in [int(p) for p in args.pages.split(",")]:
+            path = os.path.join(workdir, f"filing-{pages}.pdf")
+            make_pdf(path, pages)
+            row = {"pages": pages, "size_kb": round(os.path.getsize(path) / 1024, 1)}
+            for mode, pages_per_range in (("single_request", 10 ** 9), ("page_ranges", args.pages_per_range)):
+                landing_ai.PAGES_PER_RANGE = pages_per_range
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    parsed = landing_ai.parse_pdf(path, filename=os.path.basename(path))
+                row[mode] = {
+                    "wall_s": round(time.perf_counter() - t0, 3),
+                    "ranges": len((parsed.get("metadata") or {}).get("page_ranges") or [[1, pages]]),
+                    "page_accuracy": page_accuracy(parsed, pages),
+                }
+            row["speedup"] = round(row["single_request"]["wall_s"] / row["page_ranges"]["wall_s"], 2)
+            results.append(row)
+    finally:
+        stub_process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report({
+        "benchmark": "parse",
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }, os.path.abspath(args.out) if args.out else None)
+
+
+if __name__ == "__main__":
+    main()
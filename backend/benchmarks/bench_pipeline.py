@@ -0,0 +1,219 @@
+"""
+End-to-End Pipeline Benchmark (offline)
+Drives a synthetic dataroom through the real FastAPI routes — upload, ADE
+parse/extract, indexing, trends and run_agent_pipeline — with LandingAI and
+OpenRouter replaced by local stub servers (benchmarks/stubs.py). Records
+throughput, per-stage latency percentiles and peak RSS as a JSON report.
+
+    python -m benchmarks.bench_pipeline [--datarooms 3] [--docs 4] [--doc-kb 200]
+        [--questions 3] [--parse-ms 300] [--extract-ms 400] [--llm-ms 250]
+        [--error-rate 0.0] [--out report.json]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+import requests
+
+from benchmarks import stubs
+from benchmarks.report import StageTimer, environment, peak_rss_mb, summarize, write_report
+from benchmarks.synthetic import generate_markdown, HashingEncoder
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "What is the revenue trend and how has leverage changed?",
+    "Are there any change of control provisions in the material contracts?",
+    "Summarize the key liquidity and customer concentration risks.",
+    "How does EBITDA margin compare across periods?",
+]
+
+
+def _period(index: int) -> str:
+    return f"Q{index % 4 + 1} {2022 + index // 4}"
+
+
+def run(args, base_url: str) -> dict:
+    """Run the workload against the app. Env must already point at the stubs."""
+    from fastapi.testclient import TestClient
+
+    import main as app_main
+    from services import landing_ai, gemini_client, pathway_rag, trends, query_decomposer
+
+    timer = StageTimer()
+    timer.instrument(landing_ai, "parse_pdf", "ade_parse")
+    timer.instrument(landing_ai, "extract_from_markdown", "ade_extract")
+    timer.instrument(pathway_rag, "index_document", "rag_index")
+    timer.instrument(trends, "record_document_period", "trend_record")
+    timer.instrument(query_decomposer, "decompose")
+    timer.instrument(pathway_rag, "get_rag_context", "rag_retrieve")
+    timer.instrument(gemini_client, "ask_gemini", "llm")
+
+    # Use the real model when installed, otherwise a hashing encoder of the same shape
+    rag = pathway_rag.get_instance()
+    if rag.embedding_model is None and args.encoder == "auto":
+        rag.embedding_model = HashingEncoder()
+        pathway_rag.EMBEDDINGS_AVAILABLE = True
+    encoder = type(rag.embedding_model).__name__ if rag.embedding_model is not None else "none"
+
+    upload_ms, upload_errors, chat_ms, chat_errors = [], 0, [], 0
+    context_ready_ms, overlap_saved_ms = [], []
+    ingested_bytes = 0
+
+    with TestClient(app_main.app, raise_server_exceptions=False) as client:
+        task_ids = []
+        for t in range(args.datarooms):
+            task_ids.append(client.post("/tasks/", json={"name": f"Bench Dataroom {t}"}).json()["id"])
+
+        # 1️⃣ Ingest
+        ingest_start = time.perf_counter()
+        for t, task_id in enumerate(task_ids):
+            for d in range(args.docs):
+                markdown = generate_markdown(
+                    args.doc_kb * 1024, seed=args.seed + t * 1000 + d,
+                    company=f"Company {t}", period=_period(d),
+                )
+                payload = markdown.encode("utf-8")
+                t0 = time.perf_counter()
+                resp = client.post(
+                    f"/tasks/{task_id}/documents/",
+                    files={"file": (f"filing-{d}.pdf", payload, "application/pdf")},
+                )
+                upload_ms.append((time.perf_counter() - t0) * 1000)
+                if resp.status_code != 200 or "error" in resp.json():
+                    upload_errors += 1
+                else:
+                    ingested_bytes += len(payload)
+        ingest_s = time.perf_counter() - ingest_start
+
+        # 2️⃣ Ask (the pipeline runs on the scheduler; poll until it settles)
+        chat_start = time.perf_counter()
+        for task_id in task_ids:
+            for q in range(args.questions):
+                t0 = time.perf_counter()
+                resp = client.post(f"/tasks/{task_id}/chat/", json={"message": QUESTIONS[q % len(QUESTIONS)]})
+                chat_ms.append((time.perf_counter() - t0) * 1000)
+                if resp.status_code != 200:
+                    chat_errors += 1
+                    continue
+                chat_id = resp.json()["chat_id"]
+                _wait_for_chat(client, task_id, chat_id)
+                chat_ms[-1] = (time.perf_counter() - t0) * 1000
+                result = client.get(f"/tasks/{task_id}/chat/{chat_id}").json()
+                if result.get("status") != "done":
+                    chat_errors += 1
+                timings = result.get("reasoning_log", {}).get("timings") or {}
+                if "context_ready_ms" in timings:
+                    context_ready_ms.append(timings["context_ready_ms"])
+                    overlap_saved_ms.append(timings["overlap_saved_ms"])
+        chat_s = time.perf_counter() - chat_start
+
+    stages = timer.report()
+    stages["upload"] = summarize(upload_ms, upload_errors)
+    stages["chat"] = summarize(chat_ms, chat_errors)
+    stages["rag_context_ready"] = summarize(context_ready_ms)
+    stages["rag_overlap_saved"] = summarize(overlap_saved_ms)
+
+    try:
+        stub_stats = requests.get(f"{base_url}/stats", timeout=5).json()["endpoints"]
+    except Exception:
+        stub_stats = {}
+
+    docs = args.datarooms * args.docs
+    questions = args.datarooms * args.questions
+    return {
+        "encoder": encoder,
+        "throughput": {
+            "docs_per_s": round((docs - upload_errors) / ingest_s, 3) if ingest_s else 0,
+            "ingest_mb_per_s": round(ingested_bytes / ingest_s / 1e6, 3) if ingest_s else 0,
+            "questions_per_s": round((questions - chat_errors) / chat_s, 3) if chat_s else 0,
+            "ingest_wall_s": round(ingest_s, 2),
+            "chat_wall_s": round(chat_s, 2),
+        },
+        "stages": stages,
+        "stub_requests": stub_stats,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _wait_for_chat(client, task_id: str, chat_id: str, timeout_s: float = 300):
+    deadline = time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        status = client.get(f"/tasks/{task_id}/chat/{chat_id}/status").json().get("status")
+        if status in ("done", "failed"):
+            return status
+        time.sleep(0.02)
+    return "timeout"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datarooms", type=int, default=3)
+    parser.add_argument("--docs", type=int, default=4, help="documents per dataroom")
+    parser.add_argument("--doc-kb", type=int, default=200, help="markdown size per document")
+    parser.add_argument("--questions", type=int, default=3, help="chat questions per dataroom")
+    parser.add_argument("--parse-ms", type=float, default=stubs.StubConfig.parse_ms)
+    parser.add_argument("--extract-ms", type=float, default=stubs.StubConfig.extract_ms)
+    parser.add_argument("--llm-ms", type=float, default=stubs.StubConfig.llm_ms)
+    parser.add_argument("--jitter", type=float, default=stubs.StubConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=stubs.StubConfig.error_rate)
+    parser.add_argument("--encoder", choices=["auto", "none"], default="auto",
+                        help="auto: real model if installed, else hashing encoder; none: keyword-only")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database and uploads")
+    parser.add_argument("--verbose", action="store_true", help="show backend logs")
+    args = parser.parse_args()
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    stub_config = stubs.StubConfig(
+        parse_ms=args.parse_ms, extract_ms=args.extract_ms, llm_ms=args.llm_ms,
+        jitter=args.jitter, error_rate=args.error_rate, seed=args.seed,
+    )
+    base_url, stub_process = stubs.start_in_subprocess(stub_config)
+
+    # Services read their endpoints at import time, so configure before importing the app
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.environ.update({
+        "LANDINGAI_BASE_URL": f"{base_url}{stubs.LANDINGAI_PATH}",
+        "OPENROUTER_BASE_URL": f"{base_url}{stubs.OPENROUTER_PATH}",
+        "LANDINGAI_API_KEY": "stub",
+        "OPENROUTER_API_KEY": "stub",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "SQL_ECHO": "0",
+        "DECOMPOSITION_CACHE_PATH": os.path.join(workdir, "decomposition_cache.json"),
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # uploads land in ./uploads
+
+    # Backend logs are noisy (full ADE payloads); keep stdout for the report
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    try:
+        with quiet:
+            result = run(args, base_url)
+    finally:
+        os.chdir(cwd)
+        stub_process.terminate()
+        if args.keep:
+            print(f"📁 Kept benchmark data in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report({
+        "benchmark": "pipeline",
+        "environment": environment(),
+        "config": {**{k: v for k, v in vars(args).items() if k not in ("out", "keep", "verbose")}, "stubs": asdict(stub_config)},
+        **result,
+    }, out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Single-Dataroom Search Benchmark
+Measures TaskIndex.search latency as the chunk count grows: the previous
+score-everything-and-sort scorer, two-stage retrieval with weighted fusion,
+and two-stage retrieval with reciprocal rank fusion. Recall@k of the
+two-stage weighted search is measured against exhaustive weighted scoring.
+
+    python -m benchmarks.bench_search [--chunks 2000,10000,40000] [--candidates 100]
+        [--top-k 5] [--rounds 20]
+"""
+
+import argparse
+import json
+import statistics
+import time
+from typing import List
+
+import numpy as np
+
+from benchmarks.synthetic import generate_markdown, HashingEncoder
+from services.markdown_chunker import chunk_text
+from services.task_index import TaskIndex, tokenize
+
+QUERIES = [
+    "change of control consent assignment",
+    "customer concentration risk",
+    "credit agreement covenant leverage",
+    "pending litigation regulatory",
+    "working capital liquidity facility",
+    "revenue growth gross margin",
+]
+
+
+def legacy_search(index: TaskIndex, query_terms: set, query_vec, top_k: int):
+    """The original TaskIndex.search (full keyword array + full argsort), kept as the baseline"""
+    with index.lock:
+        counts = np.zeros(index.size, dtype=np.float32)
+        for term in query_terms:
+            posting = index.postings.get(term)
+            if posting:
+                counts[np.fromiter(posting, dtype=np.int64, count=len(posting))] += 1.0
+        keyword = counts / len(query_terms)
+        semantic = index.semantic_scores(query_vec)
+        scores = semantic * 0.7 + keyword * 0.3
+        scores = np.where(index.alive[:index.size], scores, -np.inf)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [(int(i), float(scores[i]), float(semantic[i]), float(keyword[i])) for i in order if np.isfinite(scores[i])]
+
+
+def build(encoder, target_chunks: int, doc_kb: int = 200) -> TaskIndex:
+    index = TaskIndex()
+    doc = 0
+    while index.size < target_chunks:
+        texts = chunk_text(generate_markdown(doc_kb * 1024, seed=doc))[:target_chunks - index.size]
+        rows = [{"text": t, "chunk_index": i} for i, t in enumerate(texts)]
+        index.add_document(f"doc-{doc}", rows, encoder.encode(texts, convert_to_numpy=True), {"filename": f"filing-{doc}.pdf"})
+        doc += 1
+    return index
+
+
+def _stats(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 3),
+        "mean_ms": round(statistics.mean(ordered), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", default="2000,10000,40000")
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer("all-MiniLM-L6-v2")
+    except Exception:
+        encoder = HashingEncoder()
+    queries = [(tokenize(q), encoder.encode(q, convert_to_numpy=True)) for q in QUERIES]
+
+    results = []
+    for target in [int(c) for c in args.chunks.split(",")]:
+        t0 = time.perf_counter()
+        index = build(encoder, target)
+        build_s = time.perf_counter() - t0
+
+        def measure(search):
+            latencies = []
+            for _ in range(args.rounds):
+                for terms, vec in queries:
+                    t = time.perf_counter()
+                    search(terms, vec)
+                    latencies.append((time.perf_counter() - t) * 1000)
+            return _stats(latencies)
+
+        k, n = args.top_k, args.candidates
+        recall = []
+        for terms, vec in queries:
+            exact = {hit[0] for hit in index.search(terms, vec, k, "weighted", 0)}
+            pruned = {hit[0] for hit in index.search(terms, vec, k, "weighted", n)}
+            recall.append(len(exact & pruned) / max(1, len(exact)))
+
+        results.append({
+            "chunks": index.live_rows,
+            "build_s": round(build_s, 1),
+            "legacy_full_sort": measure(lambda t, v: legacy_search(index, t, v, k)),
+            "two_stage_weighted": measure(lambda t, v: index.search(t, v, k, "weighted", n)),
+            "two_stage_rrf": measure(lambda t, v: index.search(t, v, k, "rrf", n)),
+            "exhaustive_weighted": measure(lambda t, v: index.search(t, v, k, "weighted", 0)),
+            f"recall_at_{k}": round(statistics.mean(recall), 3),
+        })
+
+    print(json.dumps({
+        "encoder": type(encoder).__name__,
+        "candidates": args.candidates,
+        "top_k": args.top_k,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Instrumented Server for Load Tests
+Runs the unmodified FastAPI app under uvicorn with saturation probes attached:
+event-loop lag, threadpool occupancy, SQLite pool/statement/lock counters,
+embedding model busy time and process CPU. Snapshots are served from
+GET /__diagnostics and cleared with POST /__diagnostics/reset.
+
+Expects LANDINGAI_BASE_URL / OPENROUTER_BASE_URL / DATABASE_URL in the env
+(see benchmarks/bench_load.py, which launches it).
+
+    python -m benchmarks.load_server --port 8800
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+import anyio.to_thread
+import uvicorn
+from sqlalchemy import event
+
+from benchmarks.report import percentile
+from benchmarks.synthetic import HashingEncoder
+
+PROBE_INTERVAL_S = 0.05
+
+
+def _p(samples, pct):
+    return round(percentile(samples, pct), 2) if samples else 0.0
+
+
+class Diagnostics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.wall_start = time.perf_counter()
+            self.cpu_start = sum(os.times()[:2])
+            self.loop_lag_ms = []
+            self.threadpool = []        # (borrowed, total, waiting)
+            self.db_checked_out = []
+            self.db_pool_wait_ms = []
+            self.db_read_ms = []
+            self.db_write_ms = []
+            self.db_locked_errors = 0
+            self.embed_busy_s = 0.0
+            self.embed_calls = 0
+            self.embed_inflight = 0
+            self.embed_inflight_max = 0
+
+    def snapshot(self, pool_capacity: int) -> dict:
+        with self.lock:
+            wall = max(time.perf_counter() - self.wall_start, 1e-9)
+            threads_total = self.threadpool[-1][1] if self.threadpool else 0
+            at_capacity = sum(1 for borrowed, total, _ in self.threadpool if borrowed >= total)
+            waiting = [w for _, _, w in self.threadpool]
+            return {
+                "wall_s": round(wall, 2),
+                "cpu": {
+                    "utilization": round((sum(os.times()[:2]) - self.cpu_start) / wall, 3),
+                    "cores": os.cpu_count(),
+                },
+                "event_loop": {
+                    "samples": len(self.loop_lag_ms),
+                    "lag_p50_ms": _p(self.loop_lag_ms, 50),
+                    "lag_p99_ms": _p(self.loop_lag_ms, 99),
+                    "lag_max_ms": round(max(self.loop_lag_ms), 2) if self.loop_lag_ms else 0.0,
+                    "blocked_fraction": round(sum(self.loop_lag_ms) / 1000 / wall, 3),
+                },
+                "threadpool": {
+                    "size": threads_total,
+                    "busy_max": max((b for b, _, _ in self.threadpool), default=0),
+                    "at_capacity_fraction": round(at_capacity / len(self.threadpool), 3) if self.threadpool else 0.0,
+                    "waiting_max": max(waiting, default=0),
+                },
+                "sqlite": {
+                    "pool_capacity": pool_capacity,
+                    "checked_out_max": max(self.db_checked_out, default=0),
+                    "pool_wait_p95_ms": _p(self.db_pool_wait_ms, 95),
+                    "read_p95_ms": _p(self.db_read_ms, 95),
+                    "write_p95_ms": _p(self.db_write_ms, 95),
+                    "write_max_ms": round(max(self.db_write_ms), 2) if self.db_write_ms else 0.0,
+                    "statements": len(self.db_read_ms) + len(self.db_write_ms),
+                    "locked_errors": self.db_locked_errors,
+                },
+                "embedding": {
+                    "calls": self.embed_calls,
+                    "busy_fraction": round(self.embed_busy_s / wall, 3),
+                    "inflight_max": self.embed_inflight_max,
+                },
+            }
+
+
+diag = Diagnostics()
+
+
+# ----------------------
+# Probes
+# ----------------------
+def _instrument_db(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = (time.perf_counter() - conn.info["_t0"].pop()) * 1000
+        is_write = statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE")
+        with diag.lock:
+            (diag.db_write_ms if is_write else diag.db_read_ms).append(elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if "database is locked" in str(context.original_exception):
+            with diag.lock:
+                diag.db_locked_errors += 1
+
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        t0 = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            with diag.lock:
+                diag.db_pool_wait_ms.append((time.perf_counter() - t0) * 1000)
+
+    pool.connect = timed_connect
+
+
+def _instrument_embeddings(rag):
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            with diag.lock:
+                diag.embed_calls += 1
+                diag.embed_inflight += 1
+                diag.embed_inflight_max = max(diag.embed_inflight_max, diag.embed_inflight)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with diag.lock:
+                    diag.embed_inflight -= 1
+                    diag.embed_busy_s += time.perf_counter() - t0
+        return wrapper
+
+    rag._generate_embedding = timed(rag._generate_embedding)
+    rag._generate_embeddings = timed(rag._generate_embeddings)
+
+
+async def _loop_probe(engines):
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL_S)
+        lag_ms = max(0.0, (loop.time() - t0 - PROBE_INTERVAL_S) * 1000)
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        stats = limiter.statistics()
+        with diag.lock:
+            diag.loop_lag_ms.append(lag_ms)
+            diag.threadpool.append((stats.borrowed_tokens, int(limiter.total_tokens), stats.tasks_waiting))
+            diag.db_checked_out.append(sum(e.pool.checkedout() for e in engines))
+
+
+def build_app(encoder: str = "auto"):
+    import main as app_main
+    from database import engine, async_engine
+    from services import pathway_rag
+
+    app = app_main.app
+    # Request handlers use the async engine, the background pipeline the sync one
+    engines = [engine, async_engine.sync_engine]
+    for e in engines:
+        _instrument_db(e)
+
+    rag = pathway_rag.get_instance()
+    if rag.embedding_model is None and encoder == "auto":
+        rag.embedding_model = HashingEncoder()
+        pathway_rag.EMBEDDINGS_AVAILABLE = True
+    _instrument_embeddings(rag)
+
+    pool_capacity = sum(e.pool.size() + max(e.pool._max_overflow, 0) for e in engines if hasattr(e.pool, "size"))
+
+    @app.on_event("startup")
+    async def _start_probe():
+        asyncio.get_running_loop().create_task(_loop_probe(engines))
+
+    @app.get("/__diagnostics")
+    async def diagnostics():
+        snapshot = diag.snapshot(pool_capacity)
+        snapshot["encoder"] = type(rag.embedding_model).__name__ if rag.embedding_model is not None else "none"
+        return snapshot
+
+    @app.post("/__diagnostics/reset")
+    async def reset_diagnostics():
+        diag.reset()
+        return {"status": "reset"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--encoder", choices=["auto", "none"], default="auto")
+    args = parser.parse_args()
+    uvicorn.run(build_app(args.encoder), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark Reporting Helpers
+Latency percentiles, stage timers, peak RSS and run metadata shared by the
+benchmarks that write JSON reports meant to be diffed between releases.
+"""
+
+import functools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples_ms: List[float], errors: int = 0) -> Dict[str, float]:
+    if not samples_ms:
+        return {"count": 0, "errors": errors}
+    return {
+        "count": len(samples_ms),
+        "errors": errors,
+        "p50_ms": round(percentile(samples_ms, 50), 2),
+        "p95_ms": round(percentile(samples_ms, 95), 2),
+        "p99_ms": round(percentile(samples_ms, 99), 2),
+        "mean_ms": round(statistics.mean(samples_ms), 2),
+        "max_ms": round(max(samples_ms), 2),
+        "total_s": round(sum(samples_ms) / 1000, 3),
+    }
+
+
+class StageTimer:
+    """Collects per-stage wall-clock samples from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, stage: str, elapsed_ms: float, failed: bool = False):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed_ms)
+            if failed:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.record(stage, (time.perf_counter() - t0) * 1000, failed)
+        return timed
+
+    def instrument(self, module, name: str, stage: str = None):
+        """Replace module.name with a timed wrapper (callers must look it up through the module)"""
+        setattr(module, name, self.wrap(stage or name, getattr(module, name)))
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {stage: summarize(samples, self.errors.get(stage, 0)) for stage, samples in self.samples.items()}
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb() -> float:
+    """Resident set size right now (Linux /proc; falls back to peak RSS elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def environment() -> Dict[str, str]:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        revision = ""
+    return {
+        "git_revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_report(report: dict, path: str = None):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"✅ Report written to {path}")
+    else:
+        print(text)
@@ -0,0 +1,285 @@
+"""
+Local LandingAI / OpenRouter Stubs
+A threaded HTTP server that answers the ADE /parse and /extract endpoints and
+the OpenRouter chat completions endpoint with deterministic fake payloads,
+after a configurable latency and with a configurable error rate.
+
+Point the backend at it with:
+    LANDINGAI_BASE_URL=http://127.0.0.1:<port>/v1/ade
+    OPENROUTER_BASE_URL=http://127.0.0.1:<port>/api/v1/chat/completions
+
+    python -m benchmarks.stubs [--port 8765] [--parse-ms 300] [--error-rate 0.0]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from benchmarks.synthetic import generate_markdown
+
+LANDINGAI_PATH = "/v1/ade"
+OPENROUTER_PATH = "/api/v1/chat/completions"
+
+_PERIOD_RE = re.compile(r"fiscal period ((?:Q[1-4]|FY) \d{4})")
+_COMPANY_RE = re.compile(r"^# (.+?) Form", re.MULTILINE)
+
+
+@dataclass
+class StubConfig:
+    parse_ms: float = 300.0
+    extract_ms: float = 400.0
+    llm_ms: float = 250.0
+    jitter: float = 0.2          # +/- fraction of the base latency
+    error_rate: float = 0.0      # fraction of requests answered with 503
+    answer_words: int = 180
+    seed: int = 0
+    parse_ms_per_page: float = 0.0   # added to parse_ms for each page of a real PDF
+    extract_ms_per_kb: float = 0.0   # added to extract_ms for each KB of markdown sent
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def hit(self, endpoint: str, failed: bool):
+        with self.lock:
+            entry = self.counts.setdefault(endpoint, {"requests": 0, "errors": 0})
+            entry["requests"] += 1
+            entry["errors"] += int(failed)
+
+
+# ----------------------
+# Fake payloads
+# ----------------------
+def _multipart_file(body: bytes, content_type: str) -> bytes:
+    """Bytes of the first file part of a multipart/form-data body"""
+    match = re.search(r"boundary=([^;]+)", content_type)
+    if not match:
+        return b""
+    boundary = b"--" + match.group(1).strip('"').encode()
+    for part in body.split(boundary):
+        head, sep, payload = part.partition(b"\r\n\r\n")
+        if sep and b"filename=" in head:
+            return payload[:-2] if payload.endswith(b"\r\n") else payload
+    return b""
+
+
+def _pdf_pages(document: bytes) -> list:
+    """Text of each page of a real PDF, or [] when it isn't one"""
+    if not document.startswith(b"%PDF"):
+        return []
+    try:
+        from pypdf import PdfReader
+        return [page.extract_text() or "" for page in PdfReader(io.BytesIO(document)).pages]
+    except Exception:
+        return []
+
+
+def fake_parse(document: bytes) -> dict:
+    # Real PDFs come back page by page with ADE-style groundings (0-based pages)
+    pages = _pdf_pages(document)
+    if pages:
+        chunks = [
+            {
+                "id": hashlib.blake2b(f"{i}:{text}".encode(), digest_size=8).hexdigest(),
+                "type": "text",
+                "markdown": text.strip() or f"(page {i + 1})",
+                "grounding": {"page": i, "box": {"left": 0.0, "top": 0.0, "right": 1.0, "bottom": 1.0}},
+            }
+            for i, text in enumerate(pages)
+        ]
+        markdown = "\n\n".join(f"<a id='{c['id']}'></a>\n\n{c['markdown']}" for c in chunks)
+        return {"markdown": markdown, "chunks": chunks, "metadata": {"page_count": len(pages)}}
+
+    # Benchmarks upload markdown disguised as PDFs; anything else gets a generated filing
+    try:
+        markdown = document.decode("utf-8")
+        if markdown.startswith("%PDF"):
+            raise ValueError
+    except ValueError:
+        seed = int.from_bytes(hashlib.blake2b(document, digest_size=4).digest(), "little")
+        markdown = generate_markdown(max(len(document), 20_000), seed=seed)
+    return {"markdown": markdown, "chunks": [], "metadata": {"page_count": max(1, len(markdown) // 3000)}}
+
+
+def fake_extract(markdown: str, schema: dict = None) -> dict:
+    rng = random.Random(hashlib.blake2b(markdown.encode(), digest_size=8).digest())
+    period = _PERIOD_RE.search(markdown)
+    company = _COMPANY_RE.search(markdown)
+    revenue = rng.uniform(50, 900)
+    debt = revenue * rng.uniform(0.2, 1.8)
+    equity = revenue * rng.uniform(0.3, 1.5)
+    ebitda = revenue * rng.uniform(0.05, 0.35)
+    response = {
+        "extraction": {
+            "Company": company.group(1) if company else "Acme Holdings",
+            "FiscalPeriod": period.group(1) if period else "FY 2024",
+            "Revenue": f"${revenue:,.1f}M",
+            "TotalDebt": f"${debt:,.1f}M",
+            "Equity": f"${equity:,.1f}M",
+            "CashFlow": f"${revenue * rng.uniform(-0.05, 0.25):,.1f}M",
+            "NetIncome": f"${revenue * rng.uniform(-0.1, 0.2):,.1f}M",
+            "EBITDA": f"${ebitda:,.1f}M",
+            "OperatingIncome": f"${ebitda * 0.8:,.1f}M",
+            "GrossProfit": f"${revenue * rng.uniform(0.3, 0.6):,.1f}M",
+            "Industry": "Industrial Technology",
+        },
+        "extraction_metadata": {},
+    }
+    # Like ADE, only the requested fields come back (null when not found)
+    if schema and schema.get("properties"):
+        response["extraction"] = {f: response["extraction"].get(f) for f in schema["properties"]}
+    return response
+
+
+def fake_completion(messages: list, answer_words: int) -> dict:
+    prompt = messages[-1].get("content", "") if messages else ""
+    rng = random.Random(hashlib.blake2b(prompt.encode(), digest_size=8).digest())
+    if "JSON array" in prompt:
+        content = json.dumps([
+            "What is the revenue trend across the reported periods?",
+            "How leveraged is the company and is leverage rising?",
+            "Are there change of control or assignment provisions in material contracts?",
+            "What customer concentration or regulatory risks are disclosed?",
+        ][: rng.randint(3, 4)])
+    else:
+        words = re.findall(r"[a-z]{4,}", prompt.lower()) or ["analysis"]
+        content = " ".join(rng.choice(words) for _ in range(answer_words)).capitalize() + "."
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4},
+    }
+
+
+# ----------------------
+# Server
+# ----------------------
+def _make_handler(config: StubConfig, stats: _Stats):
+    rng = random.Random(config.seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with stats.lock:
+                    self._send(200, {"config": asdict(config), "endpoints": stats.counts})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path == f"{LANDINGAI_PATH}/parse":
+                endpoint, base_ms = "parse", config.parse_ms
+            elif self.path == f"{LANDINGAI_PATH}/extract":
+                endpoint, base_ms = "extract", config.extract_ms
+            elif self.path == OPENROUTER_PATH:
+                endpoint, base_ms = "llm", config.llm_ms
+            else:
+                self._send(404, {"error": f"unknown path {self.path}"})
+                return
+
+            parsed = None
+            if endpoint == "parse":
+                parsed = fake_parse(_multipart_file(body, self.headers.get("Content-Type", "")))
+                if parsed["chunks"]:
+                    base_ms += config.parse_ms_per_page * parsed["metadata"]["page_count"]
+            elif endpoint == "extract":
+                form = parse_qs(body.decode("utf-8"))
+                markdown = form.get("markdown", [""])[0]
+                base_ms += config.extract_ms_per_kb * len(markdown) / 1024
+
+            with rng_lock:
+                delay = base_ms * (1 + rng.uniform(-config.jitter, config.jitter))
+                failed = rng.random() < config.error_rate
+            time.sleep(max(0.0, delay) / 1000)
+            stats.hit(endpoint, failed)
+            if failed:
+                self._send(503, {"error": "stub: injected failure"})
+                return
+
+            if endpoint == "parse":
+                self._send(200, parsed)
+            elif endpoint == "extract":
+                self._send(200, fake_extract(markdown, json.loads(form.get("schema", ["{}"])[0])))
+            else:
+                self._send(200, fake_completion(json.loads(body or b"{}").get("messages", []), config.answer_words))
+
+    return Handler
+
+
+def make_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _make_handler(config, _Stats()))
+    server.daemon_threads = True
+    return server
+
+
+def _serve(config: StubConfig, host: str, port: int, ready):
+    server = make_server(config, host, port)
+    ready.send(server.server_address[1])
+    ready.close()
+    server.serve_forever()
+
+
+def start_in_subprocess(config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+    """
+    Run the stubs in a separate process (so they don't count towards the
+    benchmarked process's CPU or RSS). Returns (base_url, process).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_serve, args=(config, host, port, child), daemon=True)
+    process.start()
+    child.close()
+    if not parent.poll(30):
+        process.terminate()
+        raise RuntimeError("Stub server did not start within 30s")
+    return f"http://{host}:{parent.recv()}", process
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--parse-ms", type=float, default=StubConfig.parse_ms)
+    parser.add_argument("--extract-ms", type=float, default=StubConfig.extract_ms)
+    parser.add_argument("--llm-ms", type=float, default=StubConfig.llm_ms)
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--parse-ms-per-page", type=float, default=StubConfig.parse_ms_per_page)
+    parser.add_argument("--extract-ms-per-kb", type=float, default=StubConfig.extract_ms_per_kb)
+    args = parser.parse_args()
+
+    config = StubConfig(args.parse_ms, args.extract_ms, args.llm_ms, args.jitter, args.error_rate,
+                        parse_ms_per_page=args.parse_ms_per_page, extract_ms_per_kb=args.extract_ms_per_kb)
+    server = make_server(config, args.host, args.port)
+    print(f"✅ Stubs listening on http://{args.host}:{server.server_address[1]}")
+    print(f"   LANDINGAI_BASE_URL=http://{args.host}:{server.server_address[1]}{LANDINGAI_PATH}")
+    print(f"   OPENROUTER_BASE_URL=http://{args.host}:{server.server_address[1]}{OPENROUTER_PATH}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Synthetic Dataroom Generator
+Produces LandingAI-style markdown (headings, prose, pipe and HTML tables) of a
+controllable size for benchmarks. Output is deterministic for a given seed.
+"""
+
+import random
+
+_WORDS = (
+    "revenue growth margin liquidity covenant leverage customer contract supplier "
+    "risk regulatory litigation ebitda cash flow capital expenditure acquisition "
+    "subsidiary indemnification termination change of control assignment consent "
+    "impairment goodwill deferred tax working capital inventory receivable payable "
+    "facility credit agreement interest rate hedge foreign currency segment region"
+).split()
+
+_SECTIONS = [
+    "Item 1. Business",
+    "Item 1A. Risk Factors",
+    "Item 7. Management's Discussion and Analysis",
+    "Item 7A. Quantitative and Qualitative Disclosures About Market Risk",
+    "Item 8. Financial Statements",
+    "Material Contracts",
+]
+_SUBSECTIONS = [
+    "Overview", "Results of Operations", "Liquidity and Capital Resources",
+    "Customer Concentration", "Change of Control", "Indebtedness", "Segment Information",
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(8, 22))
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+
+
+def _pipe_table(rng: random.Random) -> str:
+    rows = ["| Line item | FY2023 | FY2024 |", "|---|---|---|"]
+    for _ in range(rng.randint(4, 12)):
+        rows.append(f"| {rng.choice(_WORDS).title()} | {rng.randint(1, 999):,}.{rng.randint(0, 9)} | {rng.randint(1, 999):,}.{rng.randint(0, 9)} |")
+    return "\n".join(rows)
+
+
+def _html_table(rng: random.Random) -> str:
+    cells = "".join(
+        f"<tr><td>{rng.choice(_WORDS).title()}</td><td>{rng.randint(1, 9999):,}</td><td>{rng.randint(1, 9999):,}</td></tr>"
+        for _ in range(rng.randint(4, 10))
+    )
+    return f"<table><tr><th>Item</th><th>Q3</th><th>Q4</th></tr>{cells}</table>"
+
+
+def generate_markdown(target_bytes: int, seed: int = 0, company: str = "Acme Holdings", period: str = "Q3 2024") -> str:
+    """Generate a filing-like markdown document of roughly target_bytes characters."""
+    rng = random.Random(seed)
+    parts = [f"# {company} Form 10-Q", f"For the fiscal period {period}."]
+    size = sum(len(p) + 2 for p in parts)
+
+    while size < target_bytes:
+        for block in _section(rng):
+            parts.append(block)
+            size += len(block) + 2
+            if size >= target_bytes:
+                break
+
+    return "\n\n".join(parts)
+
+
+def _section(rng: random.Random):
+    yield f"## {rng.choice(_SECTIONS)}"
+    for _ in range(rng.randint(1, 3)):
+        yield f"### {rng.choice(_SUBSECTIONS)}"
+        for _ in range(rng.randint(2, 6)):
+            roll = rng.random()
+            if roll < 0.15:
+                yield _pipe_table(rng)
+            elif roll < 0.25:
+                yield _html_table(rng)
+            else:
+                yield f"<a id='{rng.getrandbits(32):08x}'></a>\n\n{_paragraph(rng)}"
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for the sentence-transformers model (same encode()
+    signature, 384 dims) so index/search benchmarks run without torch.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=32, **kwargs):
+        import numpy as np
+
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        out = np.zeros((len(batch), self.dim), dtype=np.float32)
+        for i, text in enumerate(batch):
+            for word in text.lower().split():
+                out[i, hash(word) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out = np.divide(out, norms, out=out, where=norms > 0)
+        return out[0] if single else out
@@ -1,16 +1,102 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import create_async_engine
 import os
 
 # Get absolute path for database
 DB_DIR = os.path.join(os.path.dirname(__file__), "db")
 os.makedirs(DB_DIR, exist_ok=True)
 DB_PATH = os.path.join(DB_DIR, "app.db")
-DATABASE_URL = f"sqlite:///{DB_PATH}"
-engine = create_engine(DATABASE_URL, echo=True)
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+engine = create_engine(DATABASE_URL, echo=os.getenv("SQL_ECHO", "1") == "1")
+
+
+# Sync driver (or bare dialect) -> asyncio driver for the same database
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "mariadb": "mariadb+aiomysql",
+    "mariadb+pymysql": "mariadb+aiomysql",
+}
+_ASYNC_ONLY = {"sqlite+aiosqlite", "postgresql+asyncpg", "postgresql+psycopg", "mysql+aiomysql", "mysql+asyncmy", "mariadb+aiomysql"}
+
+
+def _async_url(url: str) -> str:
+    """The same database through an asyncio driver (aiosqlite for SQLite, asyncpg, aiomysql)"""
+    scheme, sep, rest = url.partition("://")
+    if scheme in _ASYNC_ONLY:
+        return url
+    if not sep or scheme not in _ASYNC_DRIVERS:
+        raise RuntimeError(
+            f"No asyncio driver known for DATABASE_URL scheme '{scheme}'; "
+            "set ASYNC_DATABASE_URL to the same database with an async driver"
+        )
+    return f"{_ASYNC_DRIVERS[scheme]}://{rest}"
+
+
+# Request handlers read through this engine without holding a threadpool slot;
+# the background pipeline (scheduler workers) keeps using the sync engine above
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+# Each aiosqlite connection owns a thread and every statement is a round trip to it:
+# a fixed pool (overflow connections would be opened and closed per request), and no
+# reset-on-return rollback, since AsyncSession already ends its own transaction
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "4"))
+_async_pool = {}
+if ASYNC_DATABASE_URL.startswith("sqlite+aiosqlite:///") and ASYNC_DATABASE_URL != "sqlite+aiosqlite:///:memory:":
+    _async_pool = {"pool_size": ASYNC_POOL_SIZE, "max_overflow": 0, "pool_reset_on_return": None}
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=os.getenv("SQL_ECHO", "1") == "1", **_async_pool)
+
+# Data fixes to run once when a column is added to an existing table
+_BACKFILLS = {
+    ("chatmessage", "updated_at"): "UPDATE chatmessage SET updated_at = created_at",
+    ("task", "pinned"): "UPDATE task SET pinned = 0",
+}
+
+
+def _upgrade_existing_tables():
+    """create_all only creates missing tables; add newer columns and indexes to existing ones"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                conn.exec_driver_sql(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                )
+                backfill = _BACKFILLS.get((table.name, column.name))
+                if backfill:
+                    conn.exec_driver_sql(backfill)
+                print(f"🧩 Added column {table.name}.{column.name}")
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    _upgrade_existing_tables()
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    # Attributes stay loaded after commit: an expired one would need a lazy (blocking) reload
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def close_async_engine():
+    await async_engine.dispose()
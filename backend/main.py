@@ -3,15 +3,32 @@ from dotenv import load_dotenv
 
 # Load env before services
 load_dotenv()
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from database import init_db, engine
-from sqlmodel import Session
-from routes import tasks, documents, chat, memo
+from fastapi.responses import JSONResponse
+from database import init_db, engine, close_async_engine
+from sqlmodel import Session, select
+from models import Task
+from routes import tasks, documents, chat, memo, trends, search, usage, profiles
+from services import upload_store, pathway_rag, scheduler, reindexer, conversation_context
 # from services import pathway_client  # Not needed at startup
 
 app = FastAPI(title="CFO Copilot Backend")
 
+# Room for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+# Reject oversized uploads from Content-Length before the body is read
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    length = request.headers.get("content-length")
+    if request.method in ("POST", "PUT") and length and length.isdigit() \
+            and int(length) > upload_store.MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        limit_mb = upload_store.MAX_UPLOAD_BYTES // (1024 * 1024)
+        return JSONResponse({"error": f"File exceeds the {limit_mb} MB upload limit"}, status_code=413)
+    return await call_next(request)
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -23,13 +40,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Last-Updated", "Retry-After"],
 )
 
 @app.on_event("startup")
 def on_startup():
     init_db()
-    # with Session(engine) as session:
-    #     pathway_client.rebuild_indexes_from_db(session)
+    # Active deals keep their search indexes resident
+    with Session(engine) as session:
+        for task in session.exec(select(Task).where(Task.pinned == True)).all():  # noqa: E712
+            pathway_rag.get_instance().pinned.add(task.id)
+    # Rebuild indexes that did not survive the restart or were built with another model / chunking
+    if reindexer.ON_STARTUP:
+        reindexer.start("startup")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_async_engine()
 
 # Health check endpoint for Render
 @app.get("/")
@@ -40,8 +67,53 @@ def health_check():
 def health():
     return {"status": "healthy"}
 
+@app.get("/embeddings/stats")
+def embeddings_stats():
+    return pathway_rag.embedding_stats()
+
+@app.get("/rag/memory")
+def rag_memory():
+    return pathway_rag.memory_stats()
+
+@app.get("/rag/reindex")
+def rag_reindex_status():
+    return reindexer.status()
+
+@app.post("/rag/reindex")
+def rag_reindex(payload: dict = None):
+    """
+    Rebuild stale or missing indexes in the background ({"force": true} rebuilds all,
+    "task_ids" limits the run). "chunk_size" / "chunk_overlap" change the chunking first,
+    which makes every index stale. Searches use the old indexes until each swap.
+    """
+    payload = payload or {}
+    if payload.get("chunk_size") or payload.get("chunk_overlap") is not None:
+        size, overlap = payload.get("chunk_size"), payload.get("chunk_overlap")
+        rag = pathway_rag.get_instance()
+        if (size is not None and (not isinstance(size, int) or size < 100)) or \
+                (overlap is not None and (not isinstance(overlap, int) or not 0 <= overlap < (size or rag.chunk_size))):
+            return JSONResponse({"error": "chunk_size must be an integer >= 100 and 0 <= chunk_overlap < chunk_size"}, status_code=400)
+        rag.set_chunking(size, overlap)
+    return reindexer.start("manual", payload.get("task_ids"), bool(payload.get("force")))
+
+@app.get("/chat/flights")
+def chat_flights():
+    return chat.chat_flights.stats()
+
+@app.get("/chat/working-sets")
+def chat_working_sets():
+    return conversation_context.stats()
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return scheduler.stats()
+
 # Routes
 app.include_router(tasks.router, prefix="/tasks", tags=["Tasks"])
 app.include_router(documents.router, prefix="/tasks/{task_id}/documents", tags=["Documents"])
 app.include_router(chat.router, prefix="/tasks/{task_id}/chat", tags=["Chat"])
 app.include_router(memo.router, prefix="/tasks/{task_id}/memo", tags=["Memo"])
+app.include_router(trends.router, prefix="/tasks/{task_id}/trends", tags=["Trends"])
+app.include_router(search.router, prefix="/search", tags=["Search"])
+app.include_router(usage.router, prefix="/usage", tags=["Usage"])
+app.include_router(profiles.router, prefix="/profiles", tags=["Profiles"])
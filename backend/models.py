@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime
 import uuid
@@ -10,6 +11,7 @@ class Task(SQLModel, table=True):
     id: str = Field(default_factory=gen_id, primary_key=True)
     name: str
     risk_level: str = "unknown"
+    pinned: bool = False  # keep the RAG index resident (active deal)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Document(SQLModel, table=True):
@@ -19,6 +21,8 @@ class Document(SQLModel, table=True):
     path: str
     markdown: Optional[str] = None      # <-- new
     extraction_json: Optional[str] = None  # <-- new
+    sha256: Optional[str] = Field(default=None, index=True)  # content hash of the stored file
+    size_bytes: Optional[int] = None
     meta_json: Optional[str] = None
     ingested: bool = False
     red_flags: Optional[str] = None
@@ -26,6 +30,12 @@ class Document(SQLModel, table=True):
 
 
 class ChatMessage(SQLModel, table=True):
+    # Keyset pagination on (created_at, id) and incremental sync on updated_at, per task
+    __table_args__ = (
+        Index("ix_chatmessage_task_created", "task_id", "created_at", "id"),
+        Index("ix_chatmessage_task_updated", "task_id", "updated_at"),
+    )
+
     id: str = Field(default_factory=gen_id, primary_key=True)
     task_id: str = Field(foreign_key="task.id")
     role: str
@@ -34,6 +44,7 @@ class ChatMessage(SQLModel, table=True):
     reasoning_log: Optional[str] = None
     citations: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)  # bump on every change
 
 class Memo(SQLModel, table=True):
     id: str = Field(default_factory=gen_id, primary_key=True)
@@ -41,3 +52,47 @@ class Memo(SQLModel, table=True):
     summary: Optional[str] = None
     metrics: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class FinancialPeriod(SQLModel, table=True):
+    # One row per (task, source document, fiscal period); see services/trends.py
+    id: str = Field(default_factory=gen_id, primary_key=True)
+    task_id: str = Field(foreign_key="task.id", index=True)
+    doc_id: str = Field(foreign_key="document.id", index=True)
+    period: str                      # "2024-Q3" or "2023-FY"
+    fiscal_year: int
+    fiscal_quarter: int = 0          # 0 = full fiscal year
+    revenue: Optional[float] = None
+    debt: Optional[float] = None
+    equity: Optional[float] = None
+    cash_flow: Optional[float] = None
+    net_income: Optional[float] = None
+    ebitda: Optional[float] = None
+    operating_income: Optional[float] = None
+    gross_profit: Optional[float] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class UsageRecord(SQLModel, table=True):
+    # Cost/resource ledger written by services/usage.py; aggregated per task, chat and day
+    __table_args__ = (
+        Index("ix_usagerecord_task_created", "task_id", "created_at"),
+        Index("ix_usagerecord_created_resource", "created_at", "resource"),
+    )
+
+    id: str = Field(default_factory=gen_id, primary_key=True)
+    task_id: Optional[str] = Field(default=None, foreign_key="task.id")
+    chat_id: Optional[str] = Field(default=None, index=True)
+    doc_id: Optional[str] = Field(default=None, index=True)
+    stage: str = ""                  # pipeline stage, e.g. "chat.searching_documents" or "ingest.extract"
+    resource: str                    # llm | ade_parse | ade_extract | embedding | index | upload | stage
+    model: Optional[str] = None
+    calls: int = 1
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    bytes_in: int = 0                # sent to the service / received from the client
+    bytes_out: int = 0               # returned by the service / added to the index
+    items: int = 0                   # texts embedded, pages parsed, rows indexed, ...
+    cpu_ms: float = 0.0              # CPU time of the recording thread
+    wall_ms: float = 0.0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, BackgroundTasks
-from sqlmodel import Session, select
-import json, uuid
-
-from database import get_session
+from fastapi import APIRouter, Depends, Header, Response
+from fastapi.responses import JSONResponse
+from sqlmodel import Session, select, func, or_, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import defer
+from datetime import datetime
+from typing import Optional
+import base64, hashlib, json, re, uuid
+
+from database import get_session, get_async_session
 from models import ChatMessage, Memo, Document
-from services import gemini_client, finance_logic
+from services import gemini_client, finance_logic, trends, dataroom_events, scheduler, usage, profiler
 from services.multi_query_rag import multi_query_rag
+from services.single_flight import SingleFlight
 
 router = APIRouter()
 
@@ -17,29 +23,135 @@ def update_status(chat_id, status, progress, message):
     chat_status[chat_id] = {"status": status, "progress": progress, "message": message}
 
 
+# --- Single-flight: identical questions asked while one is running share its run ---
+chat_flights = SingleFlight()
+_QUESTION_TRIM_RE = re.compile(r"^[\s\"'“”]+|[\s\"'“”?!.]+$")
+
+
+def _flight_key(task_id: str, user_message: str, conversation_id: str = None):
+    """
+    (task_id, conversation, normalized question, dataroom version): a new upload
+    starts a fresh run, and a follow-up is only shared within its conversation
+    """
+    question = " ".join(_QUESTION_TRIM_RE.sub("", user_message or "").lower().split())
+    return task_id, conversation_id, question, dataroom_events.get_version(task_id)
+
+
+def _replay_status(chat_id, status):
+    update_status(chat_id, *status)
+
+
+# ----------------------
+# Chat history helpers
+# ----------------------
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(chat: ChatMessage) -> str:
+    raw = f"{chat.created_at.isoformat()}|{chat.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    created_at, chat_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+    return datetime.fromisoformat(created_at), chat_id
+
+
+async def _history_etag(session: AsyncSession, task_id: str, *params):
+    """(etag, last_updated): the ETag changes whenever a message is added, updated or removed, or the query changes"""
+    count, last_updated = (await session.exec(
+        select(func.count(ChatMessage.id), func.max(func.coalesce(ChatMessage.updated_at, ChatMessage.created_at)))
+        .where(ChatMessage.task_id == task_id)
+    )).one()
+    digest = hashlib.blake2b(repr((task_id, count, str(last_updated), params)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"', last_updated
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _serialize_chat(chat: ChatMessage, include_details: bool) -> dict:
+    item = {
+        "chat_id": chat.id,
+        "role": chat.role,
+        "response": chat.content,
+        "status": chat.status,
+        "created_at": chat.created_at.isoformat(),
+        "updated_at": (chat.updated_at or chat.created_at).isoformat(),
+    }
+    if include_details:
+        item["reasoning_log"] = json.loads(chat.reasoning_log or '{"sub_queries": [], "insights": []}')
+        item["citations"] = json.loads(chat.citations or "[]")
+    return item
+
+
 # ----------------------
 # Get All Chats for Task
 # ----------------------
 @router.get("/")
-def get_all_chats(task_id: str, session: Session = Depends(get_session)):
-    chats = session.exec(
-        select(ChatMessage)
-        .where(ChatMessage.task_id == task_id)
-        .order_by(ChatMessage.created_at)
-    ).all()
-    
-    return [
-        {
-            "chat_id": chat.id,
-            "role": chat.role,
-            "response": chat.content,
-            "reasoning_log": json.loads(chat.reasoning_log or '{"sub_queries": [], "insights": []}'),
-            "citations": json.loads(chat.citations or "[]"),
-            "status": chat.status,
-            "created_at": chat.created_at.isoformat(),
-        }
-        for chat in chats
-    ]
+async def get_all_chats(
+    task_id: str,
+    response: Response,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    since: Optional[datetime] = None,
+    include_details: bool = True,
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Chat history, oldest first.
+    - limit: return only the latest `limit` messages (X-Next-Cursor pages further back)
+    - before: cursor from X-Next-Cursor; messages older than it
+    - since: only messages created or updated after this time (use X-Last-Updated
+      from the previous response for incremental sync)
+    - include_details=false omits reasoning_log and citations
+    Responds 304 when If-None-Match matches the current ETag.
+    """
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    etag, last_updated = await _history_etag(session, task_id, limit, before, since, include_details)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if last_updated is not None:
+        response.headers["X-Last-Updated"] = last_updated.isoformat() if isinstance(last_updated, datetime) else str(last_updated)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=dict(response.headers))
+
+    query = select(ChatMessage).where(ChatMessage.task_id == task_id)
+    if not include_details:
+        query = query.options(defer(ChatMessage.reasoning_log), defer(ChatMessage.citations))
+    if since is not None:
+        query = query.where(func.coalesce(ChatMessage.updated_at, ChatMessage.created_at) > since)
+    if before:
+        try:
+            cursor_created, cursor_id = _decode_cursor(before)
+        except Exception:
+            return {"error": "Invalid cursor"}
+        query = query.where(or_(
+            ChatMessage.created_at < cursor_created,
+            and_(ChatMessage.created_at == cursor_created, ChatMessage.id < cursor_id),
+        ))
+
+    if limit is None:
+        chats = (await session.exec(query.order_by(ChatMessage.created_at, ChatMessage.id))).all()
+    else:
+        # Newest page first via the (task_id, created_at, id) index, then flip to chronological
+        chats = (await session.exec(
+            query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1)
+        )).all()
+        if len(chats) > limit:
+            chats = chats[:limit]
+            response.headers["X-Next-Cursor"] = _encode_cursor(chats[-1])
+        chats.reverse()
+
+    return [_serialize_chat(chat, include_details) for chat in chats]
 
 
 # ----------------------
@@ -49,10 +161,14 @@ def get_all_chats(task_id: str, session: Session = Depends(get_session)):
 def create_chat(
     task_id: str,
     payload: dict,
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
+    x_profile: Optional[str] = Header(default=None),
 ):
     user_message = payload.get("message", "")
+    # Follow-ups in the same conversation reuse its turns and retrieved chunks; without one each question stands alone
+    conversation_id = payload.get("conversation_id")
+    if conversation_id is not None and not isinstance(conversation_id, str):
+        return JSONResponse({"error": "conversation_id must be a string"}, status_code=400)
     chat_id = str(uuid.uuid4())
 
     # Store initial chat record
@@ -66,18 +182,37 @@ def create_chat(
     session.add(chat_msg)
     session.commit()
 
-    # Background processing - DON'T pass the request session
+    # Same question already running for this dataroom: follow that run (it fills this row too)
+    flight, is_leader = chat_flights.join(_flight_key(task_id, user_message, conversation_id), chat_id, on_join=_replay_status)
+    if not is_leader:
+        print(f"🔗 Chat {chat_id} coalesced with in-flight chat {flight.leader}")
+        return {"chat_id": chat_id, "status": "pending", "coalesced_with": flight.leader}
+
+    # Background processing on the interactive scheduler class - DON'T pass the request session
     # The background task will create its own session
-    background_tasks.add_task(run_agent_pipeline, chat_id, task_id, user_message)
+    try:
+        # X-Profile (or an armed / sampled profile) records a stack-sampling profile under the chat_id
+        job = profiler.job(run_agent_pipeline, chat_id, "chat", task_id, profiler.requested(x_profile))
+        scheduler.submit(scheduler.INTERACTIVE, task_id, job, chat_id, task_id, user_message, flight, conversation_id)
+    except scheduler.Saturated as e:
+        # Nothing will answer this flight: drop the request and fail anyone who attached meanwhile
+        members = chat_flights.finish(flight)
+        chat_flights.publish(flight, update_status, "failed", 100, str(e))
+        chat_status.pop(chat_id, None)
+        session.delete(chat_msg)
+        session.commit()
+        if len(members) > 1:
+            print(f"⚠️ Chat {chat_id} rejected with {len(members) - 1} coalesced followers")
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
 
-    return {"chat_id": chat_id, "status": "pending"}
+    return {"chat_id": chat_id, "status": "pending", "coalesced_with": None}
 
 
 # ----------------------
 # Poll Chat Status
 # ----------------------
 @router.get("/{chat_id}/status")
-def get_chat_status(chat_id: str):
+async def get_chat_status(chat_id: str):
     return chat_status.get(chat_id, {"status": "unknown", "progress": 0})
 
 
@@ -85,8 +220,8 @@ def get_chat_status(chat_id: str):
 # Get Chat Result
 # ----------------------
 @router.get("/{chat_id}")
-def get_chat_result(chat_id: str, session: Session = Depends(get_session)):
-    chat = session.get(ChatMessage, chat_id)
+async def get_chat_result(chat_id: str, session: AsyncSession = Depends(get_async_session)):
+    chat = await session.get(ChatMessage, chat_id)
     if not chat:
         return {"error": "Chat not found"}
 
@@ -103,22 +238,41 @@ def get_chat_result(chat_id: str, session: Session = Depends(get_session)):
 # ----------------------
 # Background CFO Agent
 # ----------------------
-def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
+def run_agent_pipeline(chat_id: str, task_id: str, user_message: str, flight=None, conversation_id: str = None):
+    """
+    Answer the question once for every chat attached to the flight: status
+    updates go to all of them and each member's ChatMessage row gets the result.
+    """
     # Create a fresh database session for the background task
     from database import engine
     from sqlmodel import Session
     
     session = Session(engine)
+    if flight is None:
+        flight, _ = chat_flights.join(_flight_key(task_id, user_message, conversation_id), chat_id)
+
+    # Usage (tokens, ADE, embeddings, stage times) is billed to the leader's chat
+    ledger = usage.begin(task_id, chat_id=chat_id)
+
+    def publish(status, progress, message):
+        if status not in ("done", "failed"):
+            usage.mark(f"chat.{status}")
+        chat_flights.publish(flight, update_status, status, progress, message)
     
     try:
-        update_status(chat_id, "loading_data", 10, "Fetching financial data from ADE")
+        publish("loading_data", 10, "Fetching financial data from ADE")
 
         # 1️⃣ Fetch all ADE JSONs from DB for this task
         docs = session.exec(select(Document).where(Document.task_id == task_id)).all()
         if not docs:
-            update_status(chat_id, "failed", 100, "No document found for this task.")
+            chat_flights.finish(flight)
+            publish("failed", 100, "No document found for this task.")
             return
 
+        # Merge oldest period first so the latest filing's values win
+        period_keys = trends.document_period_keys(session, task_id)
+        docs = sorted(docs, key=lambda d: (period_keys.get(d.id, (0, 0)), d.created_at))
+
         structured_data = {}
         for d in docs:
             try:
@@ -131,29 +285,39 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
 
         print(f"🧾 Structured data sent to CFO agent: {structured_data}")
 
-        update_status(chat_id, "computing_metrics", 40, "Processing data through Pathway pipeline")
+        publish("computing_metrics", 40, "Processing data through Pathway pipeline")
 
         # 2️⃣ Compute Pathway-based metrics
         analysis = finance_logic.analyze_financials(structured_data)
         metrics = analysis.get("summary", {})
         insights = analysis.get("insights", [])
 
-        update_status(chat_id, "searching_documents", 60, "Searching indexed documents with multi-query RAG")
+        # 📈 Period-over-period trends (cached per task)
+        try:
+            trends_text = trends.format_trends_for_prompt(trends.get_trends(session, task_id))
+        except Exception as e:
+            print(f"⚠️ Trend computation failed (non-critical): {e}")
+            trends_text = ""
+
+        publish("searching_documents", 60, "Searching indexed documents with multi-query RAG")
 
         # 🔍 3️⃣ Multi-Query RAG: Decompose query → retrieve per sub-query → synthesize
         try:
             rag_result = multi_query_rag(
-                query=user_message,
+                user_question=user_message,
                 task_id=task_id,
                 structured_data=structured_data,
                 metrics=metrics,
-                insights=insights
+                insights=insights,
+                trends=trends_text,
+                conversation_id=conversation_id
             )
             
             summary = rag_result["answer"]
             sub_queries = rag_result.get("sub_queries", [])
             citations = rag_result.get("citations", [])
             rag_reasoning = rag_result.get("reasoning", "")
+            timings = rag_result.get("timings", {})
             
             print(f"✅ Multi-query RAG: {len(sub_queries)} sub-queries, {len(citations)} citations")
             print(f"📌 Sub-queries: {sub_queries}")
@@ -173,7 +337,7 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
                 sub_queries = [user_message]  # Ultimate fallback
             
             citations = []
-            update_status(chat_id, "summarizing", 70, "Generating CFO summary via Gemini")
+            publish("summarizing", 70, "Generating CFO summary via Gemini")
             
             prompt = [
                 {
@@ -192,14 +356,16 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
                         f"User question: {user_message}\n\n"
                         f"Structured data: {json.dumps(structured_data, indent=2)}\n\n"
                         f"Computed metrics: {json.dumps(metrics, indent=2)}\n\n"
-                        f"Insights: {json.dumps(insights, indent=2)}"
+                        f"Insights: {json.dumps(insights, indent=2)}\n\n"
+                        f"Period-over-period trends: {trends_text or 'Not available'}"
                     ),
                 },
             ]
             summary = gemini_client.ask_gemini(prompt)
             rag_reasoning = ""
+            timings = {}
 
-        update_status(chat_id, "saving_results", 90, "Saving CFO agent results")
+        publish("saving_results", 90, "Saving CFO agent results")
 
         # 🔍 If no citations from RAG, add document-level citations as fallback
         if not citations and docs:
@@ -214,14 +380,11 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
             ]
 
         # 5️⃣ Save to DB with citations and sub-queries
-        chat_msg = session.get(ChatMessage, chat_id)
-        chat_msg.role = "agent"
-        chat_msg.content = summary
-        
         # Build reasoning log with sub-queries and insights
         reasoning_data = {
             "sub_queries": sub_queries,
-            "insights": []
+            "insights": [],
+            "timings": timings
         }
         
         # Filter out empty insights and generic "no metrics" messages
@@ -244,10 +407,20 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
         if has_financial_content:
             reasoning_data["insights"] = valid_insights
         
-        chat_msg.reasoning_log = json.dumps(reasoning_data)
-        chat_msg.citations = json.dumps(citations)  # 🆕 Save RAG citations with sub_query tracking
-        chat_msg.status = "done"
-        session.add(chat_msg)
+        # Close the flight: later identical questions start a new run, everyone attached gets this answer
+        members = chat_flights.finish(flight)
+        for member_id in members:
+            chat_msg = session.get(ChatMessage, member_id)
+            if chat_msg is None:
+                continue
+            chat_msg.role = "agent"
+            chat_msg.content = summary
+            chat_msg.reasoning_log = json.dumps(reasoning_data)
+            chat_msg.citations = json.dumps(citations)  # 🆕 Save RAG citations with sub_query tracking
+            chat_msg.status = "done"
+            chat_msg.updated_at = datetime.utcnow()
+            session.add(chat_msg)
+            usage.record("chat", chat_id=member_id, items=len(members))
 
         # 6️⃣ Create / update memo summary
         existing_memo = session.exec(select(Memo).where(Memo.task_id == task_id)).first()
@@ -267,13 +440,17 @@ def run_agent_pipeline(chat_id: str, task_id: str, user_message: str):
             session.add(new_memo)
 
         session.commit()
-        update_status(chat_id, "done", 100, "Analysis complete ✅")
+        publish("done", 100, "Analysis complete ✅")
+        if len(members) > 1:
+            print(f"🔗 Chat {chat_id} answered {len(members)} identical requests")
 
     except Exception as e:
-        update_status(chat_id, "failed", 100, f"Agent pipeline failed: {e}")
+        chat_flights.finish(flight)
+        publish("failed", 100, f"Agent pipeline failed: {e}")
         print(f"❌ Agent pipeline failed: {e}")
         import traceback
         traceback.print_exc()
     finally:
         # Always close the session
         session.close()
+        usage.end(ledger)
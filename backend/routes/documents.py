@@ -1,51 +1,84 @@
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Depends, Header
+from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
-import os, json, shutil
+from sqlmodel.ext.asyncio.session import AsyncSession
+import os, json, uuid
+from typing import Optional
 
-from database import get_session
-from models import Document
-from services import landing_ai, pathway_client, finance_logic, pathway_rag
+from database import engine, get_session, get_async_session
+from models import Document, Memo
+from services import landing_ai, pathway_client, finance_logic, pathway_rag, trends, dataroom_events, upload_store, sectioned_extraction, scheduler, usage, profiler, reindexer
 from services.extraction_schema import COMPREHENSIVE_SCHEMA, categorize_extraction
 
 router = APIRouter()
-UPLOAD_DIR = "./uploads"
 
 
 # -----------------------
-# Upload a document (POST)
+# Ingestion helpers
 # -----------------------
-@router.post("/")
-async def upload_document(
-    task_id: str,
-    file: UploadFile = File(...),
-    session: Session = Depends(get_session)
-):
-    # 1️⃣ Save file locally
-    task_dir = os.path.join(UPLOAD_DIR, task_id)
-    os.makedirs(task_dir, exist_ok=True)
-    file_path = os.path.join(task_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # 2️⃣ ADE parse → markdown
-    parsed = landing_ai.parse_pdf(file_path)
-    markdown = parsed.get("markdown", "")
-
-    # 3️⃣ ADE extract → structured JSON (using comprehensive 39-field schema)
-    extraction = landing_ai.extract_from_markdown(markdown, COMPREHENSIVE_SCHEMA)
-    extraction_json = extraction.get("extraction", {})
-    
-    # Categorize the extraction by domain (financial, company, deal, risk, operational)
-    categorized_data = categorize_extraction(extraction_json)
-    
-    import json
-    print("\n🚀 Raw ADE Response:", json.dumps(extraction, indent=2))
-    print("🧩 ADE Extraction JSON:", json.dumps(extraction_json, indent=2))
-    print("📊 Categorized Data:", json.dumps(categorized_data, indent=2))
+def _too_large(e: upload_store.UploadTooLarge) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=413)
+
+
+def _busy(e: scheduler.Saturated) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+
+def _with_profile(result: dict, job_id: str) -> dict:
+    """Point the response at the job's profile when one was recorded"""
+    if isinstance(result, dict) and profiler.get_profiler().meta(job_id) is not None:
+        result["profile"] = f"/profiles/{job_id}"
+    return result
+
+
+# Parse/extract results kept in Document.meta_json (and reused with the markdown)
+_PARSE_META_KEYS = ("page_count", "page_offsets", "extraction_provenance", "extraction_conflicts", "extraction_stats")
+
+
+def _parse_and_extract(file_path: str, filename: str = None, session: Session = None, sha256: str = None) -> dict:
+    # ♻️ Identical bytes were parsed before: reuse that markdown and extraction
+    previous = None
+    meta = {}
+    if session is not None and sha256:
+        previous = session.exec(
+            select(Document).where(Document.sha256 == sha256, Document.markdown != None)  # noqa: E711
+        ).first()
+
+    if previous is not None:
+        usage.mark("ingest.reuse")
+        markdown = previous.markdown or ""
+        extraction_json = json.loads(previous.extraction_json or "{}")
+        previous_meta = json.loads(previous.meta_json or "{}")
+        meta = {k: previous_meta[k] for k in _PARSE_META_KEYS if k in previous_meta}
+        print(f"♻️ Reusing ADE parse of {previous.filename} ({sha256[:12]}) for {filename}")
+    else:
+        # 2️⃣ ADE parse → markdown (file streamed from disk)
+        usage.mark("ingest.parse")
+        parsed = landing_ai.parse_pdf(file_path, filename=filename)
+        markdown = parsed.get("markdown", "")
+        # 3️⃣ ADE extract → structured JSON (39-field schema, split across the relevant sections)
+        usage.mark("ingest.extract")
+        extraction = sectioned_extraction.extract(markdown, COMPREHENSIVE_SCHEMA, parsed.get("page_offsets"))
+        extraction_json = extraction.get("extraction", {})
+        meta = {
+            "page_count": parsed.get("page_count"),
+            "page_offsets": parsed.get("page_offsets"),
+            "extraction_provenance": extraction.get("provenance", {}),
+            "extraction_conflicts": extraction.get("conflicts", {}),
+            "extraction_stats": extraction.get("metadata", {}),
+        }
+
+        # Categorize the extraction by domain (financial, company, deal, risk, operational)
+        categorized_data = categorize_extraction(extraction_json)
+
+        print("\n🚀 Raw ADE Response:", json.dumps(extraction, indent=2))
+        print("🧩 ADE Extraction JSON:", json.dumps(extraction_json, indent=2))
+        print("📊 Categorized Data:", json.dumps(categorized_data, indent=2))
 
     # ---------------------------------------------------
     # 🧩 4️⃣ Pathway pipeline: compute financial metrics
     # ---------------------------------------------------
+    usage.mark("ingest.metrics")
     metrics = pathway_client.process_ade_data(extraction_json)
 
     # ---------------------------------------------------
@@ -53,66 +86,287 @@ async def upload_document(
     # ---------------------------------------------------
     analysis = finance_logic.analyze_financials(extraction_json)
 
-    # ---------------------------------------------------
-    # 💾 6️⃣ Save all metadata to DB
-    # ---------------------------------------------------
-    doc = Document(
-        task_id=task_id,
-        filename=file.filename,
-        path=file_path,
-        markdown=markdown,
-        extraction_json=json.dumps(extraction_json),
-        meta_json=json.dumps({"parsed": True}),
-        ingested=True,
-        red_flags=json.dumps(analysis["insights"])  # update key name
-    )
-    session.add(doc)
-    session.commit()
-    session.refresh(doc)
+    return {
+        "markdown": markdown,
+        "extraction_json": extraction_json,
+        "metrics": metrics,
+        "analysis": analysis,
+        "reused_from": previous.id if previous is not None else None,
+        "meta": meta,
+    }
+
 
+def _index_and_record(session: Session, task_id: str, doc: Document, markdown: str, extraction_json: dict):
     # ---------------------------------------------------
-    # 🔍 7️⃣ Index document for RAG (Hybrid Indexing)
+    # 🔍 Index document for RAG (Hybrid Indexing)
     # ---------------------------------------------------
+    usage.mark("ingest.index")
     try:
         pathway_rag.index_document(
             task_id=task_id,
             doc_id=doc.id,
             markdown=markdown,
             extraction_json=extraction_json,
-            metadata={
-                "filename": file.filename,
-                "doc_id": doc.id,
-                "file_path": file_path
-            }
+            metadata=reindexer.index_metadata(doc)
         )
-        print(f"✅ Document {file.filename} indexed for RAG")
+        print(f"✅ Document {doc.filename} indexed for RAG")
     except Exception as e:
         print(f"⚠️ RAG indexing failed (non-critical): {e}")
 
-    # ---------------------------------------------------
-    # ✅ 8️⃣ Return a rich response
-    # ---------------------------------------------------
+    # Anything cached from the previous dataroom contents is now stale
+    dataroom_events.notify_changed(task_id)
+
+    # 📈 Add this document's period to the task's financial time series
+    usage.mark("ingest.trends")
+    try:
+        trends.record_document_period(session, task_id, doc, extraction_json, markdown)
+    except Exception as e:
+        print(f"⚠️ Trend recording failed (non-critical): {e}")
+
+
+def _refresh_memo_metrics(session: Session, task_id: str):
+    """Recompute the memo's core metrics from the documents that remain"""
+    memo = session.exec(select(Memo).where(Memo.task_id == task_id)).first()
+    if not memo:
+        return
+
+    structured_data = {}
+    for d in session.exec(select(Document).where(Document.task_id == task_id)).all():
+        try:
+            structured_data.update({k.lower(): v for k, v in json.loads(d.extraction_json or "{}").items()})
+        except Exception:
+            continue
+    metrics = finance_logic.analyze_financials(structured_data).get("summary", {}) if structured_data else {}
+    memo.metrics = json.dumps({
+        "debt_to_equity": metrics.get("debt_to_equity"),
+        "debt_to_revenue": metrics.get("debt_to_revenue"),
+        "cash_flow": metrics.get("cash_flow"),
+    })
+    session.add(memo)
+    session.commit()
+
+
+def _remove_file(session: Session, path: str, keep_doc_id: str = None):
+    """Delete an uploaded file unless another document still points at it"""
+    if not path or not os.path.exists(path):
+        return
+    others = session.exec(
+        select(Document).where(Document.path == path, Document.id != keep_doc_id)
+    ).first()
+    if others is None:
+        os.remove(path)
+
+
+def _ingest_upload(task_id: str, file_path: str, filename: str, sha256: str, size_bytes: int) -> dict:
+    """Parse, extract, save and index a stored upload (runs on a scheduler worker)"""
+    with Session(engine) as session, usage.scope(task_id) as ledger:
+        usage.record("upload", bytes_in=size_bytes)
+        # 2️⃣-5️⃣ Parse, extract, compute metrics and insights
+        result = _parse_and_extract(file_path, filename, session, sha256)
+        markdown = result["markdown"]
+        extraction_json = result["extraction_json"]
+        analysis = result["analysis"]
+
+        # ---------------------------------------------------
+        # 💾 6️⃣ Save all metadata to DB
+        # ---------------------------------------------------
+        usage.mark("ingest.save")
+        doc = Document(
+            task_id=task_id,
+            filename=filename,
+            path=file_path,
+            sha256=sha256,
+            size_bytes=size_bytes,
+            markdown=markdown,
+            extraction_json=json.dumps(extraction_json),
+            meta_json=json.dumps({"parsed": True, "reused_parse_from": result["reused_from"], **result["meta"]}),
+            ingested=True,
+            red_flags=json.dumps(analysis["insights"])  # update key name
+        )
+        session.add(doc)
+        session.commit()
+        session.refresh(doc)
+        ledger.doc_id = doc.id
+
+        # 🔍 7️⃣ Index for RAG, invalidate caches, record the fiscal period
+        _index_and_record(session, task_id, doc, markdown, extraction_json)
+
+        # ---------------------------------------------------
+        # ✅ 8️⃣ Return a rich response
+        # ---------------------------------------------------
+        return {
+            "id": doc.id,
+            "task_id": task_id,
+            "filename": doc.filename,
+            "sha256": sha256,
+            "size_bytes": size_bytes,
+            "ingested": True,
+            "metrics": result["metrics"],
+            "analysis": analysis,
+            "extraction": extraction_json,
+            "extraction_provenance": result["meta"].get("extraction_provenance", {})
+        }
+
+
+# -----------------------
+# Upload a document (POST)
+# -----------------------
+@router.post("/")
+async def upload_document(
+    task_id: str,
+    file: UploadFile = File(...),
+    x_profile: Optional[str] = Header(default=None),
+):
+    # 1️⃣ Stream to content-addressed storage (hash + size in the same pass)
+    try:
+        file_path, sha256, size_bytes = await upload_store.save_upload(file)
+    except upload_store.UploadTooLarge as e:
+        return _too_large(e)
+
+    # 2️⃣-8️⃣ Parse, extract, save and index on the bulk scheduler (429 when it is saturated)
+    job_id = f"upload-{uuid.uuid4().hex[:16]}"
+    job = profiler.job(_ingest_upload, job_id, "upload", task_id, profiler.requested(x_profile))
+    try:
+        return _with_profile(await scheduler.run(scheduler.BULK, task_id, job, task_id, file_path, file.filename, sha256, size_bytes), job_id)
+    except scheduler.Saturated as e:
+        # The blob stays: it is content-addressed, so the retry lands on the same file
+        return _busy(e)
+
+
+def _replace_upload(task_id: str, doc_id: str, file_path: str, filename: str, sha256: str, size_bytes: int) -> dict:
+    """Swap a document's content for a stored upload (runs on a scheduler worker)"""
+    with Session(engine) as session, usage.scope(task_id, doc_id=doc_id):
+        doc = session.get(Document, doc_id)
+        if not doc or doc.task_id != task_id:
+            return {"error": "Document not found"}
+        usage.record("upload", bytes_in=size_bytes)
+        old_path = doc.path
+        result = _parse_and_extract(file_path, filename, session, sha256)
+        markdown = result["markdown"]
+        extraction_json = result["extraction_json"]
+        analysis = result["analysis"]
+
+        # Swap the stored content in place so the document keeps its id
+        usage.mark("ingest.save")
+        trends.delete_document_periods(session, doc.id)
+        doc.filename = filename
+        doc.path = file_path
+        doc.sha256 = sha256
+        doc.size_bytes = size_bytes
+        doc.markdown = markdown
+        doc.extraction_json = json.dumps(extraction_json)
+        doc.meta_json = json.dumps({"parsed": True, "replaced": True, "reused_parse_from": result["reused_from"], **result["meta"]})
+        doc.ingested = True
+        doc.red_flags = json.dumps(analysis["insights"])
+        session.add(doc)
+        session.commit()
+        session.refresh(doc)
+
+        # Re-indexing the same doc_id tombstones the old rows and appends the new ones
+        _index_and_record(session, task_id, doc, markdown, extraction_json)
+        _refresh_memo_metrics(session, task_id)
+        if old_path != file_path:
+            _remove_file(session, old_path)
+
+        return {
+            "id": doc.id,
+            "task_id": task_id,
+            "filename": doc.filename,
+            "sha256": sha256,
+            "size_bytes": size_bytes,
+            "ingested": True,
+            "replaced": True,
+            "metrics": result["metrics"],
+            "analysis": analysis,
+            "extraction": extraction_json,
+            "extraction_provenance": result["meta"].get("extraction_provenance", {})
+        }
+
+
+# -----------------------------
+# Replace a document (PUT)
+# -----------------------------
+@router.put("/{doc_id}")
+async def replace_document(
+    task_id: str,
+    doc_id: str,
+    file: UploadFile = File(...),
+    session: AsyncSession = Depends(get_async_session),
+    x_profile: Optional[str] = Header(default=None),
+):
+    doc = await session.get(Document, doc_id)
+    if not doc or doc.task_id != task_id:
+        return {"error": "Document not found"}
+    # Give the connection back to the pool for the (long) ingest wait below
+    await session.close()
+
+    try:
+        file_path, sha256, size_bytes = await upload_store.save_upload(file)
+    except upload_store.UploadTooLarge as e:
+        return _too_large(e)
+    job_id = f"replace-{uuid.uuid4().hex[:16]}"
+    job = profiler.job(_replace_upload, job_id, "upload", task_id, profiler.requested(x_profile))
+    try:
+        return _with_profile(await scheduler.run(scheduler.BULK, task_id, job, task_id, doc_id, file_path, file.filename, sha256, size_bytes), job_id)
+    except scheduler.Saturated as e:
+        # The blob stays: it is content-addressed, so the retry lands on the same file
+        return _busy(e)
+
+
+# -----------------------------
+# Delete a document (DELETE)
+# -----------------------------
+@router.delete("/{doc_id}")
+def delete_document(task_id: str, doc_id: str, session: Session = Depends(get_session)):
+    doc = session.get(Document, doc_id)
+    if not doc or doc.task_id != task_id:
+        return {"error": "Document not found"}
+
+    removed_chunks = pathway_rag.remove_document(task_id, doc_id)
+
+    path = doc.path
+    trends.delete_document_periods(session, doc_id)
+    session.delete(doc)
+    session.commit()
+    _remove_file(session, path)
+
+    dataroom_events.notify_changed(task_id)
+    trends.refresh_trends(session, task_id)
+    _refresh_memo_metrics(session, task_id)
+
     return {
-        "id": doc.id,
+        "id": doc_id,
         "task_id": task_id,
-        "filename": doc.filename,
-        "ingested": True,
-        "metrics": metrics,
-        "analysis": analysis,
-        "extraction": extraction_json
+        "deleted": True,
+        "removed_chunks": removed_chunks
     }
 
 
+# ---------------------------
+# Near-duplicate report (GET)
+# ---------------------------
+@router.get("/dedupe")
+def dedupe_report(task_id: str, session: Session = Depends(get_session)):
+    stats = pathway_rag.dedupe_stats(task_id)
+    filenames = dict(session.exec(
+        select(Document.id, Document.filename).where(Document.task_id == task_id)
+    ).all())
+    for doc_id, doc_stats in stats["per_document"].items():
+        doc_stats["filename"] = filenames.get(doc_id, "unknown")
+    return {"task_id": task_id, **stats}
+
+
 # ---------------------
 # List documents (GET)
 # ---------------------
 @router.get("/")
-async def list_documents(task_id: str, session: Session = Depends(get_session)):
-    docs = session.exec(select(Document).where(Document.task_id == task_id)).all()
+async def list_documents(task_id: str, session: AsyncSession = Depends(get_async_session)):
+    docs = (await session.exec(select(Document).where(Document.task_id == task_id))).all()
     return [
         {
             "id": d.id,
             "filename": d.filename,
+            "size_bytes": d.size_bytes,
             "ingested": d.ingested,
             "red_flags": json.loads(d.red_flags or "[]"),
             "created_at": str(d.created_at)
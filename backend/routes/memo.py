@@ -1,17 +1,21 @@
-from fastapi import APIRouter, Depends
-from sqlmodel import Session, select
-import json, os
-from database import get_session
+from fastapi import APIRouter, Depends, Header, Response
+from fastapi.responses import FileResponse, JSONResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Optional
+import asyncio
+import json
+from database import get_async_session
 from models import Memo
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from services import memo_export
 
 router = APIRouter()
 
+MAX_EXPORT_WAIT_S = 30
+
 @router.get("/")
-def get_memo(task_id: str, session: Session = Depends(get_session)):
-    memo = session.exec(select(Memo).where(Memo.task_id == task_id)).first()
+async def get_memo(task_id: str, session: AsyncSession = Depends(get_async_session)):
+    memo = (await session.exec(select(Memo).where(Memo.task_id == task_id))).first()
     if memo:
         return {
             "task_id": task_id,
@@ -26,40 +30,62 @@ def get_memo(task_id: str, session: Session = Depends(get_session)):
     }
 
 
+def _export_response(task_id: str, digest: str, status: str) -> dict:
+    download_url = f"/tasks/{task_id}/memo/export/{digest}"
+    return {
+        "task_id": task_id,
+        "status": status,
+        "hash": digest,
+        "download_url": download_url,
+        "file_url": download_url,
+    }
+
+
 @router.post("/export")
-def export_memo(task_id: str, session: Session = Depends(get_session)):
-    memo = session.exec(select(Memo).where(Memo.task_id == task_id)).first()
+async def export_memo(task_id: str, response: Response, wait: float = 0, session: AsyncSession = Depends(get_async_session)):
+    """
+    Render the memo to PDF in the background (or reuse the artifact for an
+    unchanged memo). Pass wait=<seconds> to wait until it is ready; the wait
+    is awaited on the event loop, not in a threadpool thread.
+    """
+    memo = (await session.exec(select(Memo).where(Memo.task_id == task_id))).first()
     if not memo:
         return {"error": "No memo available"}
 
-    export_dir = "./exports"
-    os.makedirs(export_dir, exist_ok=True)
-    file_path = os.path.join(export_dir, f"{task_id}_memo.pdf")
+    job = memo_export.request_export(task_id, memo.summary, memo.metrics)
+    if job["status"] == "pending" and wait > 0:
+        await session.close()
+        try:
+            # Shielded: timing out must not cancel the render other requests may be waiting on
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job["future"])), timeout=min(wait, MAX_EXPORT_WAIT_S))
+            job["status"] = "ready"
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            return {"error": f"Memo export failed: {e}"}
 
-    # Build PDF
-    doc = SimpleDocTemplate(file_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
+    if job["status"] == "pending":
+        response.status_code = 202
+        response.headers["Retry-After"] = "1"
+    return _export_response(task_id, job["hash"], job["status"])
 
-    story.append(Paragraph("Due Diligence Memo", styles["Title"]))
-    story.append(Spacer(1, 20))
 
-    story.append(Paragraph(f"<b>Task ID:</b> {task_id}", styles["Normal"]))
-    story.append(Spacer(1, 12))
+@router.get("/export/{digest}")
+def download_memo(task_id: str, digest: str, if_none_match: Optional[str] = Header(default=None)):
+    status = memo_export.export_status(task_id, digest)
+    if status["status"] == "pending":
+        return JSONResponse(
+            _export_response(task_id, digest, "pending"), status_code=202, headers={"Retry-After": "1"}
+        )
+    if status["status"] == "failed":
+        return JSONResponse({"error": f"Memo export failed: {status['error']}"}, status_code=500)
+    if status["status"] == "missing":
+        return JSONResponse({"error": "Export not found"}, status_code=404)
 
-    story.append(Paragraph("<b>Executive Summary:</b>", styles["Heading2"]))
-    story.append(Paragraph(memo.summary or "No summary available", styles["Normal"]))
-    story.append(Spacer(1, 20))
+    # Artifacts are content-addressed, so a given URL never changes
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match and f'"{digest}"' in if_none_match:
+        return Response(status_code=304, headers=headers)
 
-    story.append(Paragraph("<b>Key Metrics:</b>", styles["Heading2"]))
-    metrics = json.loads(memo.metrics or "{}")
-    for k, v in metrics.items():
-        story.append(Paragraph(f"- {k}: {v}", styles["Normal"]))
-    story.append(Spacer(1, 20))
-
-    doc.build(story)
-
-    return {
-        "task_id": task_id,
-        "file_url": file_path
-    }
+    memo_export.touch(status["path"])
+    return FileResponse(status["path"], media_type="application/pdf", filename=f"memo_{task_id}.pdf", headers=headers)
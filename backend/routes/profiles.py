@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Optional
+
+from services import profiler
+
+router = APIRouter()
+
+
+def _forbidden() -> JSONResponse:
+    return JSONResponse({"error": "X-Profile-Token does not match PROFILER_TOKEN"}, status_code=403)
+
+
+# ----------------------------
+# List profiles and limits (GET)
+# ----------------------------
+@router.get("/")
+def list_profiles(
+    kind: Optional[str] = None,
+    task_id: Optional[str] = None,
+    limit: int = 50,
+    x_profile_token: Optional[str] = Header(default=None),
+):
+    if not profiler.authorized(x_profile_token):
+        return _forbidden()
+    return {
+        "profiler": profiler.stats(),
+        "profiles": profiler.get_profiler().list(kind, task_id, max(1, min(limit, 500))),
+    }
+
+
+# ----------------------------
+# Profile the next matching jobs (POST)
+# ----------------------------
+@router.post("/arm")
+def arm_profiles(payload: dict, x_profile_token: Optional[str] = Header(default=None)):
+    """
+    {"count": 1, "kind": "chat" | "upload" | "search", "task_id": "..."}: the next
+    matching jobs are profiled (still subject to the concurrency and rate limits)
+    """
+    if not profiler.authorized(x_profile_token):
+        return _forbidden()
+    count = payload.get("count", 1)
+    if not isinstance(count, int):
+        return JSONResponse({"error": "count must be an integer"}, status_code=400)
+    return profiler.arm(count, payload.get("kind"), payload.get("task_id"))
+
+
+# ----------------------------
+# One profile: folded stacks (GET)
+# ----------------------------
+@router.get("/{key}")
+def get_profile(key: str, state: Optional[str] = None, x_profile_token: Optional[str] = Header(default=None)):
+    """
+    Folded stacks ("state;thread;frame;...;frame count"), ready for flamegraph.pl,
+    speedscope or inferno. state=on-cpu or state=waiting keeps only those samples.
+    """
+    if not profiler.authorized(x_profile_token):
+        return _forbidden()
+    if state not in (None, profiler.ON_CPU, profiler.WAITING):
+        return JSONResponse({"error": f"state must be {profiler.ON_CPU} or {profiler.WAITING}"}, status_code=400)
+    folded = profiler.get_profiler().folded(key, state)
+    if folded is None:
+        return JSONResponse({"error": "Profile not found"}, status_code=404)
+    return PlainTextResponse(folded)
+
+
+@router.get("/{key}/meta")
+def get_profile_meta(key: str, x_profile_token: Optional[str] = Header(default=None)):
+    if not profiler.authorized(x_profile_token):
+        return _forbidden()
+    meta = profiler.get_profiler().meta(key)
+    if meta is None:
+        return JSONResponse({"error": "Profile not found"}, status_code=404)
+    return meta
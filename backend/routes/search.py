@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, Header
+from sqlmodel import Session, select
+from typing import Optional
+import uuid
+
+from database import get_session
+from models import Task
+from services import pathway_rag, profiler
+from services.markdown_chunker import page_label, section_label
+
+router = APIRouter()
+
+
+# ----------------------------
+# Cross-Dataroom Search (GET)
+# ----------------------------
+@router.get("/")
+def global_search(
+    q: str,
+    task_ids: Optional[str] = None,
+    top_k: int = 20,
+    session: Session = Depends(get_session),
+    x_profile: Optional[str] = Header(default=None),
+):
+    """
+    Search every indexed dataroom (or a comma-separated task_ids filter) in one pass.
+    Results are grouped by task, best-scoring task first.
+    """
+    wanted = [t.strip() for t in task_ids.split(",") if t.strip()] if task_ids else None
+    job_id = f"search-{uuid.uuid4().hex[:16]}"
+    with profiler.profiling(job_id, "search", requested=profiler.requested(x_profile)) as profile:
+        results = pathway_rag.search_global(q, wanted, max(1, min(top_k, 200)))
+
+    groups = {}  # {task_id: group}
+    for r in results:
+        group = groups.setdefault(r["task_id"], {
+            "task_id": r["task_id"],
+            "best_score": r["score"],
+            "hits": [],
+        })
+        section = section_label(r.get("section_path"))
+        group["hits"].append({
+            "doc_id": r["doc_id"],
+            "text": r["text"],
+            "score": r["score"],
+            "score_type": r["score_type"],
+            "citation": {
+                "document": r["filename"],
+                "page": page_label(r.get("page_start"), r.get("page_end")) or section or f"Chunk {r['chunk_index']}",
+                "section": section,
+                "chunk_index": r["chunk_index"],
+                "char_span": [r.get("start"), r.get("end")],
+            },
+            # Other places the same (deduplicated) text appears
+            "also_found_in": [
+                {
+                    "document": loc["filename"],
+                    "page": page_label(loc.get("page_start"), loc.get("page_end")),
+                    "section": section_label(loc.get("section_path")),
+                    "chunk_index": loc["chunk_index"],
+                }
+                for loc in r.get("locations", [])[1:]
+            ],
+        })
+
+    if groups:
+        names = dict(session.exec(select(Task.id, Task.name).where(Task.id.in_(list(groups)))).all())
+        for task_id, group in groups.items():
+            group["task_name"] = names.get(task_id, "unknown")
+
+    response = {
+        "query": q,
+        "num_results": len(results),
+        "results": sorted(groups.values(), key=lambda g: g["best_score"], reverse=True),
+    }
+    if profile is not None:
+        response["profile"] = f"/profiles/{job_id}"
+    return response
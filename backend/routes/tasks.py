@@ -1,17 +1,43 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models import Task
-from database import get_session
+from database import get_session, get_async_session
+from services import pathway_rag
 
 router = APIRouter()
 
 @router.post("/")
-def create_task(task: Task, session: Session = Depends(get_session)):
+async def create_task(task: Task, session: AsyncSession = Depends(get_async_session)):
     session.add(task)
-    session.commit()
-    session.refresh(task)
+    await session.commit()
+    await session.refresh(task)
     return task
 
 @router.get("/")
-def list_tasks(session: Session = Depends(get_session)):
-    return session.exec(select(Task)).all()
+async def list_tasks(session: AsyncSession = Depends(get_async_session)):
+    return (await session.exec(select(Task))).all()
+
+
+def _set_pinned(task_id: str, pinned: bool, session: Session):
+    task = session.get(Task, task_id)
+    if not task:
+        return JSONResponse({"error": "Task not found"}, status_code=404)
+    task.pinned = pinned
+    session.add(task)
+    session.commit()
+    if pinned:
+        pathway_rag.pin(task_id)
+    else:
+        pathway_rag.unpin(task_id)
+    return {"task_id": task_id, "pinned": pinned}
+
+@router.post("/{task_id}/pin")
+def pin_task(task_id: str, session: Session = Depends(get_session)):
+    """Keep this dataroom's search index in memory (active deal)"""
+    return _set_pinned(task_id, True, session)
+
+@router.delete("/{task_id}/pin")
+def unpin_task(task_id: str, session: Session = Depends(get_session)):
+    return _set_pinned(task_id, False, session)
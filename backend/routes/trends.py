@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from sqlmodel import Session
+
+from database import get_session
+from services import trends
+
+router = APIRouter()
+
+
+# ----------------------
+# Period-over-Period Trends
+# ----------------------
+@router.get("/")
+def get_trends(task_id: str, session: Session = Depends(get_session)):
+    return trends.get_trends(session, task_id)
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from sqlmodel import Session, select
+from typing import Optional
+
+from database import get_session
+from models import Task, Document
+from services import usage
+
+router = APIRouter()
+
+SORT_KEYS = ("estimated_usd",) + usage.QUANTITIES
+
+
+def _ranked(rows, by: str, limit: int):
+    return sorted(rows, key=lambda r: r.get(by, 0), reverse=True)[:max(1, min(limit, 500))]
+
+
+def _bad_sort(by: str) -> Optional[JSONResponse]:
+    if by in SORT_KEYS:
+        return None
+    return JSONResponse({"error": f"Unknown sort key {by!r}; use one of {', '.join(SORT_KEYS)}"}, status_code=400)
+
+
+# ----------------------------
+# Heavy hitters across tasks (GET)
+# ----------------------------
+@router.get("/")
+def usage_by_task(days: int = 30, by: str = "estimated_usd", limit: int = 20, session: Session = Depends(get_session)):
+    """Tasks ranked by cost (or any summed quantity) over the last `days` days"""
+    error = _bad_sort(by)
+    if error:
+        return error
+    rows = usage.costed(session, ["task_id"], days=days)
+    ranked = _ranked(rows, by, limit)
+    if ranked:
+        names = dict(session.exec(select(Task.id, Task.name).where(Task.id.in_([r["task_id"] for r in ranked]))).all())
+        for row in ranked:
+            row["task_name"] = names.get(row["task_id"], "unknown")
+    return {"days": days, "by": by, "totals": usage.totals(rows), "tasks": ranked}
+
+
+# ----------------------------
+# Daily totals (GET)
+# ----------------------------
+@router.get("/daily")
+def usage_daily(task_id: Optional[str] = None, days: int = 30, session: Session = Depends(get_session)):
+    rows = usage.costed(session, ["day"], task_id=task_id, days=days)
+    return {"task_id": task_id, "days": days, "totals": usage.totals(rows), "daily": rows}
+
+
+# ----------------------------
+# One task: resources, stages, top chats and documents (GET)
+# ----------------------------
+@router.get("/tasks/{task_id}")
+def usage_for_task(task_id: str, days: int = 30, by: str = "estimated_usd", limit: int = 10, session: Session = Depends(get_session)):
+    error = _bad_sort(by)
+    if error:
+        return error
+    resources = usage.by_resource(session, task_id=task_id, days=days)
+    chats = _ranked(usage.costed(session, ["chat_id"], task_id=task_id, days=days), by, limit)
+    docs = _ranked(usage.costed(session, ["doc_id"], task_id=task_id, days=days), by, limit)
+    if docs:
+        filenames = dict(session.exec(select(Document.id, Document.filename).where(Document.id.in_([d["doc_id"] for d in docs]))).all())
+        for row in docs:
+            row["filename"] = filenames.get(row["doc_id"], "deleted")
+    return {
+        "task_id": task_id,
+        "days": days,
+        "totals": usage.totals(resources),
+        "by_resource": resources,
+        # Wall / CPU time of each pipeline stage (chat.* and ingest.*) on its own thread
+        "by_stage": usage.aggregate(session, ["stage"], task_id=task_id, days=days, resources=["stage"]),
+        "top_chats": chats,
+        "top_documents": docs,
+    }
+
+
+# ----------------------------
+# One chat (GET)
+# ----------------------------
+@router.get("/chats/{chat_id}")
+def usage_for_chat(chat_id: str, session: Session = Depends(get_session)):
+    resources = usage.by_resource(session, chat_id=chat_id)
+    if not resources:
+        return JSONResponse({"error": "No usage recorded for this chat"}, status_code=404)
+    return {
+        "chat_id": chat_id,
+        "totals": usage.totals(resources),
+        "by_resource": resources,
+        "by_stage": usage.aggregate(session, ["stage"], chat_id=chat_id, resources=["stage"]),
+    }
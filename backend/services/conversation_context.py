@@ -0,0 +1,296 @@
+"""
+Conversation Working Set
+Keeps the chunks (and their embeddings) retrieved for the last few turns of a
+conversation (one chat thread, identified by the client's conversation_id), so a follow-up like "and how does that compare to last
+quarter?" is scored against what the conversation already pulled in before
+running a full index search. Only follow-ups consult the set, only sub-queries
+it clearly covers skip the index, and everything retrieved is added back. A
+sample of working-set answers is checked against the index's own top-k
+(CONVERSATION_VERIFY_RATE); when they disagree the index result is used.
+
+Bounded per conversation (CONVERSATION_MAX_CHUNKS chunks, least recently
+used evicted, CONVERSATION_MAX_TURNS turns) and across conversations
+(CONVERSATION_MAX_SETS, least recently used dropped; idle ones expire after
+CONVERSATION_TTL_S). A dataroom change or index rebuild clears the task's
+chunks, since they may come from a removed or replaced document or carry the
+old index's chunk numbering; each chunk also records the index params it was
+retrieved under and is dropped once those change.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import dataroom_events
+from services.query_decomposer import normalize_question
+
+MAX_CHUNKS = int(os.getenv("CONVERSATION_MAX_CHUNKS", "48"))
+MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "4"))
+MAX_SETS = int(os.getenv("CONVERSATION_MAX_SETS", "128"))
+TTL_S = float(os.getenv("CONVERSATION_TTL_S", "1800"))
+
+# A query is covered when at least COVER_MIN_HITS of its TOP_K best chunks are relevant on their own:
+# they share at least COVER_MIN_TERMS of its terms (all of them for shorter queries) and score this well
+TOP_K = 5
+COVER_MIN_HITS = int(os.getenv("CONVERSATION_COVER_MIN_HITS", "3"))
+COVER_MIN_TERMS = 2
+COVER_HYBRID = float(os.getenv("CONVERSATION_COVER_HYBRID", "0.55"))   # 0.7 * cosine + 0.3 * term overlap
+COVER_KEYWORD = float(os.getenv("CONVERSATION_COVER_KEYWORD", "0.6"))  # term overlap when there are no embeddings
+SEMANTIC_WEIGHT = 0.7
+
+# Share of working-set answers also checked against the index; below this precision the index result wins.
+# The sample is a hash of (conversation, question), so a given follow-up is always checked or never is
+VERIFY_RATE = float(os.getenv("CONVERSATION_VERIFY_RATE", "0.1"))
+VERIFY_MIN_PRECISION = float(os.getenv("CONVERSATION_VERIFY_MIN_PRECISION", "0.6"))
+
+# Prior turns go into the prompt as the question plus the start of the answer
+ANSWER_PREVIEW_CHARS = 400
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "compare", "compared", "does", "do", "for", "from",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "their", "them", "these", "they", "this",
+    "those", "to", "vs", "was", "were", "what", "when", "which", "with",
+}
+_FOLLOW_UP_RE = re.compile(
+    r"^(and|but|also|so|then|what about|how about|compared?|versus|vs)\b|\b(that|this|it|those|these|they|same|previous|prior)\b"
+)
+FOLLOW_UP_MAX_WORDS = 14
+
+
+def _terms(text: str) -> set:
+    return {t for t in normalize_question(text).split() if t not in _STOPWORDS and len(t) > 1}
+
+
+def _chunk_key(source: Dict[str, Any]) -> Tuple[Any, Any]:
+    return source.get("doc_id"), source.get("chunk_index")
+
+
+def _unit(vec) -> Optional[np.ndarray]:
+    if vec is None:
+        return None
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+
+class WorkingSet:
+    def __init__(self, task_id: str, conversation_id: str):
+        self.task_id = task_id
+        self.conversation_id = conversation_id
+        self.chunks: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()  # least recently used first
+        self.turns: deque = deque(maxlen=MAX_TURNS)
+        self.topic = None                  # last question that was not itself a follow-up
+        self.last_used = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.verified = 0
+        self.verify_precision = 0.0        # summed over verified hits
+        self.overridden = 0
+        self.lock = threading.Lock()
+
+    # ----------------------
+    # Lookup
+    # ----------------------
+    def contextualize(self, question: str) -> str:
+        """A short follow-up that leans on earlier turns is searched together with the question it follows up on"""
+        if not self.topic or len(question.split()) > FOLLOW_UP_MAX_WORDS:
+            return question
+        if not _FOLLOW_UP_RE.search(normalize_question(question)):
+            return question
+        return f"{self.topic} {question}"
+
+    def lookup(self, query: str, query_vec=None, params: dict = None) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        (rag_result, hits) from the working set: a get_rag_context-shaped result
+        when the query is covered, otherwise None and how many good chunks there were.
+        Chunks retrieved under other index params (embedding model, chunking) are dropped first.
+        """
+        terms = _terms(query)
+        query_vec = _unit(query_vec)
+        with self.lock:
+            for key in [k for k, entry in self.chunks.items() if entry["params"] != params]:
+                del self.chunks[key]
+            if not self.chunks or not terms:
+                return None, 0
+            min_terms = min(COVER_MIN_TERMS, len(terms))
+            scored = []
+            for key, entry in self.chunks.items():
+                matched = len(terms & entry["terms"])
+                keyword = matched / len(terms)
+                if query_vec is not None and entry["embedding"] is not None:
+                    score, threshold = SEMANTIC_WEIGHT * float(query_vec @ entry["embedding"]) + (1 - SEMANTIC_WEIGHT) * keyword, COVER_HYBRID
+                else:
+                    score, threshold = keyword, COVER_KEYWORD
+                scored.append((score, score >= threshold and matched >= min_terms, key))
+            scored.sort(key=lambda s: s[0], reverse=True)
+            top = scored[:TOP_K]
+            good = [s for s in top if s[1]]
+            if len(good) < COVER_MIN_HITS:
+                self.misses += 1
+                return None, len(good)
+            self.hits += 1
+            sources = []
+            for score, _, key in good:
+                self.chunks.move_to_end(key)
+                sources.append(dict(self.chunks[key]["source"], score=round(score, 4), score_type="working_set"))
+        context = "\n\n".join(f"[Source {i}] {s['text']}" for i, s in enumerate(sources, 1))
+        return {"context": context, "sources": sources}, len(good)
+
+    def should_verify(self, query: str) -> bool:
+        """Whether this query's working-set answer is in the checked sample (deterministic)"""
+        if VERIFY_RATE <= 0:
+            return False
+        key = f"{self.conversation_id}\n{normalize_question(query)}".encode("utf-8")
+        bucket = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") / 2 ** 64
+        return bucket < VERIFY_RATE
+
+    def verify(self, result: Dict[str, Any], index_result: Dict[str, Any]) -> bool:
+        """Check a working-set answer against the index's top-k for the same query; False when they disagree"""
+        index_keys = {_chunk_key(s) for s in (index_result or {}).get("sources", [])}
+        sources = result["sources"]
+        precision = sum(1 for s in sources if _chunk_key(s) in index_keys) / len(sources)
+        agreed = precision >= VERIFY_MIN_PRECISION
+        with self.lock:
+            self.verified += 1
+            self.verify_precision += precision
+            if not agreed:
+                self.overridden += 1
+        return agreed
+
+    # ----------------------
+    # Update
+    # ----------------------
+    def add(self, sources: List[Dict[str, Any]], params: dict = None):
+        """Add retrieved chunks (with their embeddings when the index has them), evicting the least recently used"""
+        with self.lock:
+            for source in sources:
+                if not source.get("text"):
+                    continue
+                key = _chunk_key(source)
+                if key in self.chunks and self.chunks[key]["params"] == params:
+                    self.chunks.move_to_end(key)
+                    continue
+                self.chunks.pop(key, None)
+                self.chunks[key] = {
+                    "source": {k: v for k, v in source.items() if k not in ("embedding", "score", "score_type")},
+                    "embedding": _unit(source.get("embedding")),
+                    "terms": _terms(source["text"]),
+                    "params": params,
+                }
+            while len(self.chunks) > MAX_CHUNKS:
+                self.chunks.popitem(last=False)
+                self.evicted += 1
+
+    def record_turn(self, question: str, answer: str, sub_queries: List[str], follow_up: bool = False):
+        with self.lock:
+            self.turns.append({"question": question, "answer": answer or "", "sub_queries": list(sub_queries)})
+            if not follow_up:
+                self.topic = question
+            self.last_used = time.time()
+
+    def clear_chunks(self):
+        with self.lock:
+            self.chunks.clear()
+
+    # ----------------------
+    # Prompt
+    # ----------------------
+    def prompt_history(self) -> str:
+        """Earlier turns, compactly: each question and the start of its answer"""
+        with self.lock:
+            turns = list(self.turns)
+        lines = []
+        for i, turn in enumerate(turns, 1):
+            answer = " ".join(turn["answer"].split())
+            if len(answer) > ANSWER_PREVIEW_CHARS:
+                answer = answer[:ANSWER_PREVIEW_CHARS].rsplit(" ", 1)[0] + " ..."
+            lines.append(f"Q{i}: {turn['question']}\nA{i}: {answer}")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "task_id": self.task_id,
+                "conversation_id": self.conversation_id,
+                "chunks": len(self.chunks),
+                "turns": len(self.turns),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "verified": self.verified,
+                "verify_precision_sum": round(self.verify_precision, 3),
+                "overridden": self.overridden,
+                "idle_s": round(time.time() - self.last_used, 1),
+            }
+
+
+class WorkingSets:
+    def __init__(self, max_sets: int = MAX_SETS, ttl_s: float = TTL_S):
+        self.max_sets = max_sets
+        self.ttl_s = ttl_s
+        self._sets: "OrderedDict[Tuple[str, str], WorkingSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def get(self, task_id: str, conversation_id: str) -> WorkingSet:
+        key = (task_id, conversation_id)
+        now = time.time()
+        with self._lock:
+            for stale_key in [k for k, ws in self._sets.items() if now - ws.last_used > self.ttl_s]:
+                del self._sets[stale_key]
+                self.dropped += 1
+            ws = self._sets.get(key)
+            if ws is None:
+                ws = self._sets[key] = WorkingSet(*key)
+            self._sets.move_to_end(key)
+            ws.last_used = now
+            while len(self._sets) > self.max_sets:
+                self._sets.popitem(last=False)
+                self.dropped += 1
+            return ws
+
+    def invalidate(self, task_id: str):
+        with self._lock:
+            sets = [ws for (tid, _), ws in self._sets.items() if tid == task_id]
+        for ws in sets:
+            ws.clear_chunks()
+
+    def stats(self) -> dict:
+        with self._lock:
+            sets = list(self._sets.values())
+        per_set = [ws.stats() for ws in sets]
+        verified = sum(s["verified"] for s in per_set)
+        return {
+            "conversations": len(per_set),
+            "max_conversations": self.max_sets,
+            "max_chunks": MAX_CHUNKS,
+            "chunks": sum(s["chunks"] for s in per_set),
+            "hits": sum(s["hits"] for s in per_set),
+            "misses": sum(s["misses"] for s in per_set),
+            # Share of checked working-set chunks that were also in the index's own top-k
+            "verified": verified,
+            "verify_precision": round(sum(s["verify_precision_sum"] for s in per_set) / verified, 3) if verified else None,
+            "overridden": sum(s["overridden"] for s in per_set),
+            "dropped": self.dropped,
+            "sets": per_set[-20:],
+        }
+
+
+working_sets = WorkingSets()
+# Chunks may come from a document that was just replaced or removed, or from an index since rebuilt
+dataroom_events.on_change(working_sets.invalidate)
+
+
+def get(task_id: str, conversation_id: str) -> WorkingSet:
+    return working_sets.get(task_id, conversation_id)
+
+
+def stats() -> dict:
+    return working_sets.stats()
@@ -0,0 +1,40 @@
+"""
+Dataroom Change Notifications
+Tracks a per-task dataroom version that is bumped whenever the task's documents
+change (upload, replace, delete), and lets caches register invalidation hooks
+so anything derived from those documents is dropped with them.
+"""
+
+import threading
+from typing import Callable, Dict, List
+
+_versions: Dict[str, int] = {}  # {task_id: version}
+_listeners: List[Callable[[str], None]] = []
+_lock = threading.Lock()
+
+
+def get_version(task_id: str) -> int:
+    with _lock:
+        return _versions.get(task_id, 0)
+
+
+def on_change(callback: Callable[[str], None]) -> Callable[[str], None]:
+    """Register callback(task_id) to run whenever a task's documents change"""
+    with _lock:
+        _listeners.append(callback)
+    return callback
+
+
+def notify_changed(task_id: str) -> int:
+    """Bump the task's dataroom version and run all invalidation hooks. Returns the new version."""
+    with _lock:
+        version = _versions.get(task_id, 0) + 1
+        _versions[task_id] = version
+        listeners = list(_listeners)
+
+    for callback in listeners:
+        try:
+            callback(task_id)
+        except Exception as e:
+            print(f"⚠️ Invalidation hook {getattr(callback, '__name__', callback)} failed for task {task_id}: {e}")
+    return version
@@ -0,0 +1,390 @@
+"""
+Shared Embedding Service
+One local process owns the sentence-transformers model and serves every API
+worker over a Unix socket. Requests from all workers are batched dynamically
+(up to EMBEDDING_MAX_BATCH texts, waiting at most EMBEDDING_MAX_WAIT_MS for a
+batch to fill), and short query requests are served ahead of bulk document
+indexing so uploads don't starve chat.
+
+Run standalone:   python -m services.embedding_service
+Use from the API: EMBEDDING_BACKEND=service (the first worker starts the
+                  service if it isn't running and EMBEDDING_SERVICE_SPAWN=1)
+"""
+
+import fcntl
+import itertools
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from typing import Any, List, Optional
+
+import numpy as np
+
+# The socket lives in a per-user 0700 directory; connections carry pickles, so they are
+# authenticated with EMBEDDING_SERVICE_AUTHKEY or, by default, a random key kept next to the socket (0600)
+SOCKET_DIR = os.path.join(tempfile.gettempdir(), f"diligent-embeddings-{os.getuid()}")
+ADDRESS = os.getenv("EMBEDDING_SERVICE_SOCKET", os.path.join(SOCKET_DIR, "embeddings.sock"))
+AUTHKEY = os.getenv("EMBEDDING_SERVICE_AUTHKEY")
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+RUNTIME = os.getenv("EMBEDDING_SERVICE_RUNTIME", "torch").lower()  # torch | onnx
+MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+QUERY_MAX_TEXTS = 4          # requests this small are treated as interactive queries
+SPAWN = os.getenv("EMBEDDING_SERVICE_SPAWN", "1") == "1"
+START_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_START_TIMEOUT", "120"))
+
+BATCH_BUCKETS = [1, 4, 8, 16, 32, 64, 128, 256]
+
+
+# ----------------------
+# Socket directory and key
+# ----------------------
+def _private_dir(address: str):
+    """Create the socket's directory owner-only; refuse the default one if others can get in"""
+    directory = os.path.dirname(os.path.abspath(address))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if directory == SOCKET_DIR and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise RuntimeError(f"{directory} must be owned by this user with mode 0700")
+
+
+def _authkey(address: str) -> bytes:
+    """EMBEDDING_SERVICE_AUTHKEY, or the key shared by every process using this socket (created once)"""
+    if AUTHKEY:
+        return AUTHKEY.encode()
+    _private_dir(address)
+    key_path = f"{address}.key"
+    if not os.path.exists(key_path):
+        # Written aside and linked in, so a racing worker never reads a half-written key
+        tmp_path = f"{key_path}.{os.getpid()}"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(key_path) as f:
+        return f.read().strip().encode()
+
+
+def model_id(model) -> str:
+    """Name of the vectors a loaded model produces (ONNX variants include their quantization)"""
+    return getattr(model, "model_id", None) or MODEL_NAME
+
+
+# ----------------------
+# Dynamic batcher (service side)
+# ----------------------
+class _Job:
+    def __init__(self, n_segments: int):
+        self.parts: List[Optional[np.ndarray]] = [None] * n_segments
+        self.remaining = n_segments
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+
+
+class _Segment:
+    __slots__ = ("job", "index", "texts")
+
+    def __init__(self, job: _Job, index: int, texts: List[str]):
+        self.job = job
+        self.index = index
+        self.texts = texts
+
+
+class BatchingEncoder:
+    """
+    Merges concurrent encode requests into model batches.
+    Large requests are split into MAX_BATCH segments so queries can slip in
+    between them; queries (<= QUERY_MAX_TEXTS texts) have priority.
+    """
+
+    def __init__(self, model, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.model = model
+        self.model_id = model_id(model)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending_texts = 0
+        self._batches = 0
+        self._texts = 0
+        self._requests = 0
+        self._histogram = [0] * len(BATCH_BUCKETS)
+        self._encode_ms = deque(maxlen=1000)
+        self._wait_ms = deque(maxlen=1000)
+        self._started = time.time()
+        threading.Thread(target=self._loop, name="embed-batcher", daemon=True).start()
+
+    def submit(self, texts: List[str]) -> _Job:
+        segments = [texts[i:i + self.max_batch] for i in range(0, len(texts), self.max_batch)] or [[]]
+        job = _Job(len(segments))
+        priority = 0 if len(texts) <= QUERY_MAX_TEXTS else 1
+        with self._lock:
+            self._pending_texts += len(texts)
+            self._requests += 1
+        for i, segment in enumerate(segments):
+            self._queue.put((priority, next(self._seq), _Segment(job, i, segment)))
+        return job
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        job = self.submit(texts)
+        job.done.wait()
+        if job.error:
+            raise RuntimeError(job.error)
+        return np.concatenate(job.parts) if len(job.parts) > 1 else job.parts[0]
+
+    def _collect(self) -> List[_Segment]:
+        _, _, first = self._queue.get()
+        batch, size = [first], len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(item[2].texts) > self.max_batch:
+                self._queue.put(item)  # keeps its (priority, seq) place for the next batch
+                break
+            batch.append(item[2])
+            size += len(item[2].texts)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            texts = [t for segment in batch for t in segment.texts]
+            now = time.perf_counter()
+            error, vectors = None, None
+            try:
+                if texts:
+                    vectors = np.asarray(self.model.encode(texts, convert_to_numpy=True, batch_size=self.max_batch), dtype=np.float32)
+            except Exception as e:
+                error = f"Embedding failed: {e}"
+            encode_ms = (time.perf_counter() - now) * 1000
+
+            offset = 0
+            for segment in batch:
+                n = len(segment.texts)
+                job = segment.job
+                if error:
+                    job.error = error
+                else:
+                    job.parts[segment.index] = vectors[offset:offset + n] if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+                offset += n
+                job.remaining -= 1
+                if job.remaining == 0:
+                    job.done.set()
+
+            bucket = next((i for i, b in enumerate(BATCH_BUCKETS) if len(texts) <= b), len(BATCH_BUCKETS) - 1)
+            with self._lock:
+                self._pending_texts -= len(texts)
+                self._batches += 1
+                self._texts += len(texts)
+                self._histogram[bucket] += 1
+                self._encode_ms.append(encode_ms)
+                self._wait_ms.extend((now - s.job.enqueued_at) * 1000 for s in batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            encode_ms = sorted(self._encode_ms)
+            wait_ms = sorted(self._wait_ms)
+            return {
+                "model": self.model_id,
+                "runtime": RUNTIME,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth_segments": self._queue.qsize(),
+                "queue_depth_texts": self._pending_texts,
+                "requests": self._requests,
+                "batches": self._batches,
+                "texts": self._texts,
+                "mean_batch_size": round(self._texts / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": {f"<={b}": n for b, n in zip(BATCH_BUCKETS, self._histogram)},
+                "encode_ms_p50": round(encode_ms[len(encode_ms) // 2], 2) if encode_ms else 0.0,
+                "encode_ms_p95": round(encode_ms[int(len(encode_ms) * 0.95)], 2) if encode_ms else 0.0,
+                "queue_wait_ms_p95": round(wait_ms[int(len(wait_ms) * 0.95)], 2) if wait_ms else 0.0,
+                "uptime_s": round(time.time() - self._started, 1),
+            }
+
+
+# ----------------------
+# Service process
+# ----------------------
+def _handle(conn, batcher: BatchingEncoder):
+    try:
+        while True:
+            message = conn.recv()
+            op = message[0]
+            try:
+                if op == "encode":
+                    conn.send(("ok", batcher.encode(list(message[1]))))
+                elif op == "stats":
+                    conn.send(("ok", batcher.stats()))
+                elif op == "ping":
+                    conn.send(("ok", {"model": batcher.model_id, "runtime": RUNTIME, "pid": os.getpid()}))
+                else:
+                    conn.send(("error", f"Unknown operation {op!r}"))
+            except Exception as e:
+                conn.send(("error", str(e)))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve(model=None, address: str = ADDRESS):
+    """Load the model once and serve encode requests until killed"""
+    authkey = _authkey(address)
+    # Only one service per socket: the lock is held for the life of the process
+    lock_file = open(f"{address}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print(f"⚠️ Embedding service already running on {address}")
+        return
+    if os.path.exists(address):
+        os.remove(address)  # stale socket from a dead service
+
+    if model is None and RUNTIME == "onnx":
+        from services import onnx_embedder
+        model = onnx_embedder.load()
+    elif model is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(MODEL_NAME)
+    batcher = BatchingEncoder(model)
+
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    print(f"✅ Embedding service ({batcher.model_id}) listening on {address}")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"⚠️ Embedding service rejected a connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, batcher), name="embed-conn", daemon=True).start()
+    finally:
+        listener.close()
+
+
+# ----------------------
+# Client (API worker side)
+# ----------------------
+class EmbeddingClient:
+    """Drop-in for SentenceTransformer.encode() that delegates to the shared service"""
+
+    def __init__(self, address: str = ADDRESS):
+        self.address = address
+        self.model_id = None  # the service's model, from its ping reply
+        self._authkey = _authkey(address)
+        self._local = threading.local()  # one connection per thread so requests overlap
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=self._authkey)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, *message) -> Any:
+        for attempt in range(2):
+            try:
+                conn = self._conn()
+                conn.send(message)
+                status, payload = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Service restarted: reconnect once
+                self._local.conn = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
+
+    def encode(self, texts, convert_to_numpy: bool = True, batch_size: int = 32, **kwargs):
+        single = isinstance(texts, str)
+        vectors = self._call("encode", [texts] if single else list(texts))
+        return vectors[0] if single else vectors
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+    def ping(self) -> dict:
+        info = self._call("ping")
+        self.model_id = info.get("model")
+        return info
+
+
+def _spawn(address: str = ADDRESS) -> subprocess.Popen:
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(
+        [sys.executable, "-m", "services.embedding_service", "--socket", address],
+        cwd=backend_dir,
+        stdin=subprocess.DEVNULL,
+        start_new_session=True,  # outlives the worker that started it
+    )
+
+
+def connect(address: str = ADDRESS, spawn: bool = SPAWN) -> Optional[EmbeddingClient]:
+    """Client for the running service, starting it first if allowed. None when unreachable."""
+    try:
+        client = EmbeddingClient(address)
+    except (OSError, RuntimeError) as e:
+        print(f"⚠️ Embedding service socket unusable: {e}")
+        return None
+    try:
+        client.ping()
+        return client
+    except Exception:
+        if not spawn:
+            print(f"⚠️ Embedding service not reachable on {address}")
+            return None
+
+    # Several workers may race here; only one service wins the socket
+    process = _spawn(address)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.25)
+        try:
+            client.ping()
+            return client
+        except Exception:
+            # Exit code 0 means another worker's service holds the socket; keep waiting for it
+            if process.poll():
+                print(f"⚠️ Embedding service exited with code {process.returncode}")
+                return None
+    print(f"⚠️ Embedding service did not start within {START_TIMEOUT:.0f}s")
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared embedding service")
+    parser.add_argument("--socket", default=ADDRESS)
+    parser.add_argument("--hashing", action="store_true",
+                        help="serve the torch-free hashing encoder (benchmarks/offline runs)")
+    args = parser.parse_args()
+
+    if args.hashing:
+        from benchmarks.synthetic import HashingEncoder
+        MODEL_NAME = RUNTIME = "hashing"
+        serve(HashingEncoder(), args.socket)
+    else:
+        serve(address=args.socket)
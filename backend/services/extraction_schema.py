@@ -9,6 +9,7 @@ COMPREHENSIVE_SCHEMA = {
     "properties": {
         # === FINANCIAL METRICS ===
         "Company": {"type": "string", "description": "Legal company name"},
+        "FiscalPeriod": {"type": "string", "description": "Fiscal period the financials cover, e.g. Q3 2024 or FY 2023"},
         "Revenue": {"type": "string", "description": "Total revenue or sales"},
         "TotalDebt": {"type": "string", "description": "Total debt obligations"},
         "Equity": {"type": "string", "description": "Total shareholder equity"},
@@ -61,7 +62,7 @@ COMPREHENSIVE_SCHEMA = {
 # Categorized field groups for organized display
 FIELD_CATEGORIES = {
     "financial_metrics": [
-        "Company", "Revenue", "TotalDebt", "Equity", "CashFlow", "NetIncome",
+        "Company", "FiscalPeriod", "Revenue", "TotalDebt", "Equity", "CashFlow", "NetIncome",
         "EBITDA", "OperatingIncome", "GrossProfit", "WorkingCapital", "CapEx",
         "RevenueGrowthYoY", "EBITDAMargin", "GrossMargin"
     ],
@@ -82,6 +83,45 @@ FIELD_CATEGORIES = {
     ]
 }
 
+# Heading keywords (lowercase substrings of a section's heading trail) that
+# route each category's fields to that section in sectioned extraction
+CATEGORY_SECTION_KEYWORDS = {
+    "financial_metrics": [
+        "financial", "results of operations", "management's discussion", "md&a", "liquidity",
+        "capital resources", "income", "balance sheet", "cash flow", "indebtedness", "segment", "revenue", "ebitda"
+    ],
+    "company_info": [
+        "business", "overview", "company", "history", "employees", "human capital",
+        "properties", "corporate", "subsidiar", "organization"
+    ],
+    "deal_structure": [
+        "transaction", "valuation", "purchase price", "consideration", "deal", "earnout",
+        "earn-out", "closing", "merger", "acquisition", "offer"
+    ],
+    "risk_factors": [
+        "risk", "litigation", "legal proceedings", "contingen", "regulat", "material contracts",
+        "customer concentration", "supplier", "change of control", "commitments"
+    ],
+    "operational_kpis": [
+        "customer", "key performance", "kpi", "operating metrics", "key metrics",
+        "unit economics", "churn", "retention", "market", "sales and marketing"
+    ]
+}
+
+# Identity fields that are usually stated on the cover page, whatever else a category matches
+COVER_FIELDS = ["Company", "FiscalPeriod"]
+
+
+def subset_schema(fields: list, schema: dict = COMPREHENSIVE_SCHEMA) -> dict:
+    """COMPREHENSIVE_SCHEMA restricted to the given fields"""
+    properties = schema.get("properties", {})
+    return {
+        "type": "object",
+        "properties": {f: properties[f] for f in fields if f in properties},
+        "required": []
+    }
+
+
 def categorize_extraction(extraction_json: dict) -> dict:
     """Organize extracted fields by category"""
     categorized = {}
@@ -2,8 +2,10 @@ import os
 import requests
 import time
 
+from services import usage
+
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 def ask_gemini(messages: list, model="openai/gpt-4o-mini", max_retries=3):
     """
@@ -23,9 +25,19 @@ def ask_gemini(messages: list, model="openai/gpt-4o-mini", max_retries=3):
     
     for attempt in range(max_retries):
         try:
+            t0 = time.perf_counter()
             resp = requests.post(OPENROUTER_BASE_URL, headers=headers, json=payload, timeout=60)
             resp.raise_for_status()
-            return resp.json()["choices"][0]["message"]["content"]
+            body = resp.json()
+            tokens = body.get("usage") or {}
+            usage.record(
+                "llm", model=model,
+                prompt_tokens=tokens.get("prompt_tokens", 0),
+                completion_tokens=tokens.get("completion_tokens", 0),
+                bytes_in=len(resp.request.body or b""), bytes_out=len(resp.content),
+                wall_ms=round((time.perf_counter() - t0) * 1000, 2),
+            )
+            return body["choices"][0]["message"]["content"]
             
         except requests.exceptions.HTTPError as e:
             if resp.status_code == 429:  # Rate limit
@@ -1,23 +1,230 @@
-import os, json, requests
+import os, json, tempfile, time, uuid, requests
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from pypdf import PdfReader, PdfWriter
+
+from services import usage
 
 API_KEY = os.getenv("LANDINGAI_API_KEY")
-BASE_URL = "https://api.va.landing.ai/v1/ade"
+BASE_URL = os.getenv("LANDINGAI_BASE_URL", "https://api.va.landing.ai/v1/ade")
 
-def parse_pdf(file_path: str, model: str = "dpt-2-latest"):
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    with open(file_path, "rb") as f:
-        files = {"document": f}
-        data = {"model": model}
-        resp = requests.post(f"{BASE_URL}/parse", headers=headers, files=files, data=data)
-    resp.raise_for_status()
-    return resp.json()
+# Large PDFs are parsed as page ranges; the pool bounds concurrent ADE parse calls process-wide
+PAGES_PER_RANGE = int(os.getenv("LANDINGAI_PAGES_PER_RANGE", "20"))
+PARSE_CONCURRENCY = int(os.getenv("LANDINGAI_PARSE_CONCURRENCY", "4"))
+PARSE_ATTEMPTS = 2  # one retry per range on 5xx / connection errors
+RANGE_SEPARATOR = "\n\n"
+_parse_pool = ThreadPoolExecutor(max_workers=PARSE_CONCURRENCY, thread_name_prefix="ade-parse")
 
-def extract_from_markdown(markdown: str, schema: dict):
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    data = {
+
+class MultipartFileStream:
+    """
+    multipart/form-data body that streams the file from disk.
+    requests buffers `files=` uploads in memory; a readable object with a
+    length is sent with Content-Length and read in blocks instead.
+    """
+
+    def __init__(self, fields: dict, file_field: str, file_path: str, filename: str = None, content_type: str = "application/pdf"):
+        self.boundary = uuid.uuid4().hex
+        filename = filename or os.path.basename(file_path)
+        head = b"".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode()
+        self._parts = [head, file_path, f"\r\n--{self.boundary}--\r\n".encode()]
+        self._length = len(head) + os.path.getsize(file_path) + len(self._parts[2])
+        self._index = 0
+        self._offset = 0
+        self._file = None
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        out = []
+        while self._index < len(self._parts) and (size < 0 or size > 0):
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                chunk = part[self._offset:] if size < 0 else part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._index, self._offset = self._index + 1, 0
+            else:
+                if self._file is None:
+                    self._file = open(part, "rb")
+                chunk = self._file.read(size)
+                if not chunk or size < 0:
+                    self._file.close()
+                    self._index += 1
+            out.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(out)
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+
+# ----------------------
+# Parsing (page ranges in parallel for large PDFs)
+# ----------------------
+def _parse_file(file_path: str, model: str, filename: str = None) -> dict:
+    for attempt in range(PARSE_ATTEMPTS):
+        body = MultipartFileStream({"model": model}, "document", file_path, filename=filename)
+        headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": body.content_type}
+        t0 = time.perf_counter()
+        try:
+            resp = requests.post(f"{BASE_URL}/parse", headers=headers, data=body)
+        except requests.ConnectionError:
+            if attempt == PARSE_ATTEMPTS - 1:
+                raise
+            continue
+        finally:
+            body.close()
+        usage.record("ade_parse", model=model, bytes_in=len(body), bytes_out=len(resp.content),
+                     wall_ms=round((time.perf_counter() - t0) * 1000, 2))
+        if resp.status_code >= 500 and attempt < PARSE_ATTEMPTS - 1:
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+def _page_count(file_path: str) -> int:
+    """Pages in the PDF, or 0 when it cannot be read locally (ADE gets the file as-is)"""
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        return 0
+
+
+def _chunk_page(chunk: dict):
+    grounding = chunk.get("grounding")
+    if isinstance(grounding, list):
+        grounding = grounding[0] if grounding else None
+    return grounding.get("page") if isinstance(grounding, dict) else None
+
+
+def _shift_grounding(grounding, pages: int):
+    """The same grounding (one box or a list of boxes) with every 0-based page moved by `pages`"""
+    if isinstance(grounding, list):
+        return [_shift_grounding(g, pages) for g in grounding]
+    if isinstance(grounding, dict) and grounding.get("page") is not None:
+        return dict(grounding, page=pages + int(grounding["page"]))
+    return grounding
+
+
+def page_table(parsed: dict, first_page: int = 1) -> List[List[int]]:
+    """
+    [[markdown offset, page number], ...] ascending, from the ADE chunk groundings
+    (0-based pages, shifted so the range starts at first_page). Without groundings
+    the whole markdown maps to first_page.
+    """
+    markdown = parsed.get("markdown", "")
+    table = [[0, first_page]]
+    cursor = 0
+    for chunk in parsed.get("chunks") or []:
+        page, text = _chunk_page(chunk), (chunk.get("markdown") or "").strip()
+        if page is None or not text:
+            continue
+        pos = markdown.find(text[:200], cursor)
+        if pos < 0:
+            continue
+        cursor = pos
+        page = max(first_page + int(page), table[-1][1])
+        if page == table[-1][1]:
+            continue
+        if pos == table[-1][0]:
+            table[-1][1] = page
+        else:
+            table.append([pos, page])
+    return table
+
+
+def _write_range(reader: PdfReader, start: int, end: int, path: str):
+    writer = PdfWriter()
+    for i in range(start, end):
+        writer.add_page(reader.pages[i])
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def parse_pdf(file_path: str, model: str = "dpt-2-latest", filename: str = None):
+    """
+    Parse a PDF to markdown. PDFs longer than PAGES_PER_RANGE pages are split
+    into page ranges, parsed concurrently (at most PARSE_CONCURRENCY requests
+    at a time across all uploads) and stitched back in page order.
+    The result carries page_offsets ([[markdown offset, page], ...]) and page_count.
+    """
+    t0 = time.perf_counter()
+    pages = _page_count(file_path)
+    if pages <= PAGES_PER_RANGE:
+        parsed = _parse_file(file_path, model, filename)
+        parsed["page_offsets"] = page_table(parsed)
+        parsed["page_count"] = pages or (parsed.get("metadata") or {}).get("page_count")
+        return parsed
+
+    name, ext = os.path.splitext(filename or os.path.basename(file_path))
+    ranges = [(start, min(start + PAGES_PER_RANGE, pages)) for start in range(0, pages, PAGES_PER_RANGE)]
+    with tempfile.TemporaryDirectory(prefix="ade-ranges-") as tmp_dir:
+        reader = PdfReader(file_path)
+        futures = []
+        for start, end in ranges:
+            range_path = os.path.join(tmp_dir, f"pages_{start + 1}-{end}.pdf")
+            _write_range(reader, start, end, range_path)
+            futures.append(_parse_pool.submit(usage.bind(_parse_file), range_path, model, f"{name}_p{start + 1}-{end}{ext or '.pdf'}"))
+        parts = [f.result() for f in futures]
+
+    markdown_parts, chunks, offsets = [], [], []
+    base = 0
+    for (start, _), part in zip(ranges, parts):
+        part_markdown = part.get("markdown", "")
+        offsets.extend([offset + base, page] for offset, page in page_table(part, start + 1))
+        for chunk in part.get("chunks") or []:
+            chunk = dict(chunk)
+            if "grounding" in chunk:
+                chunk["grounding"] = _shift_grounding(chunk["grounding"], start)
+            chunks.append(chunk)
+        markdown_parts.append(part_markdown)
+        base += len(part_markdown) + len(RANGE_SEPARATOR)
+
+    print(f"✅ Parsed {pages} pages in {len(ranges)} ranges in {time.perf_counter() - t0:.1f}s")
+    return {
+        "markdown": RANGE_SEPARATOR.join(markdown_parts),
+        "chunks": chunks,
+        "metadata": {"page_count": pages, "page_ranges": [[s + 1, e] for s, e in ranges]},
+        "page_offsets": offsets,
+        "page_count": pages,
+    }
+
+
+def _extract_form(markdown: str, schema: dict) -> dict:
+    return {
         "schema": json.dumps(schema),
         "markdown": markdown
     }
+
+
+def extract_payload_bytes(markdown: str, schema: dict) -> int:
+    """Size of the form-encoded /extract request body"""
+    return len(urlencode(_extract_form(markdown, schema)))
+
+
+def extract_from_markdown(markdown: str, schema: dict):
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    data = _extract_form(markdown, schema)
+    t0 = time.perf_counter()
     resp = requests.post(f"{BASE_URL}/extract", headers=headers, data=data)
+    usage.record("ade_extract", bytes_in=len(resp.request.body or ""), bytes_out=len(resp.content),
+                 wall_ms=round((time.perf_counter() - t0) * 1000, 2))
     resp.raise_for_status()
     return resp.json()
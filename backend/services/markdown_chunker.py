@@ -0,0 +1,271 @@
+"""
+Section-Aware Markdown Chunker
+Splits LandingAI markdown into retrieval chunks that follow headings and keep
+tables whole. Chunks are produced lazily as (start, end, section_path) spans
+into the original string, so the full document is never copied.
+"""
+
+from bisect import bisect_right
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_OVERLAP = 200
+
+# Tables stay in one chunk up to this multiple of chunk_size before being split by rows
+TABLE_SIZE_FACTOR = 4
+
+Span = Tuple[int, int, Tuple[str, ...]]
+
+
+def _heading(text: str, start: int, end: int) -> Optional[Tuple[int, str]]:
+    """(level, title) if the line text[start:end] is an ATX heading."""
+    i = start
+    while i < end and i - start < 3 and text[i] == " ":
+        i += 1
+    level = 0
+    while i < end and text[i] == "#" and level < 7:
+        level += 1
+        i += 1
+    if level == 0 or level > 6 or (i < end and text[i] not in " \t"):
+        return None
+    title = text[i:end].strip().rstrip("#").strip().strip("*_ ")
+    return (level, title) if title else None
+
+
+def _is_table_line(text: str, start: int, end: int) -> bool:
+    i = start
+    while i < end and text[i] in " \t":
+        i += 1
+    return i < end and text[i] == "|"
+
+
+def _is_html_table(text: str, start: int, end: int) -> bool:
+    i = start
+    while i < end and text[i] in " \t":
+        i += 1
+    return text.startswith("<table", i)
+
+
+def iter_blocks(text: str) -> Iterator[Tuple[int, int, str, int, str]]:
+    """
+    Yield (start, end, kind, level, title) for each markdown block:
+    kind is "heading", "table" or "text"; blank lines separate text blocks.
+    Offsets index into `text`; end excludes the trailing newline.
+    """
+    n = len(text)
+    pos = 0
+    block_start = None
+    block_end = 0
+
+    while pos < n:
+        nl = text.find("\n", pos)
+        line_end = n if nl == -1 else nl
+        next_pos = line_end + 1
+
+        if text[pos:line_end].strip() == "":
+            if block_start is not None:
+                yield block_start, block_end, "text", 0, ""
+                block_start = None
+            pos = next_pos
+            continue
+
+        heading = _heading(text, pos, line_end)
+        if heading is not None:
+            if block_start is not None:
+                yield block_start, block_end, "text", 0, ""
+                block_start = None
+            yield pos, line_end, "heading", heading[0], heading[1]
+            pos = next_pos
+            continue
+
+        if _is_html_table(text, pos, line_end):
+            if block_start is not None:
+                yield block_start, block_end, "text", 0, ""
+                block_start = None
+            close = text.find("</table>", pos)
+            table_end = n if close == -1 else close + len("</table>")
+            yield pos, table_end, "table", 0, ""
+            nl = text.find("\n", table_end)
+            pos = n if nl == -1 else nl + 1
+            continue
+
+        if _is_table_line(text, pos, line_end):
+            if block_start is not None:
+                yield block_start, block_end, "text", 0, ""
+                block_start = None
+            table_start = pos
+            table_end = line_end
+            pos = next_pos
+            while pos < n:
+                nl = text.find("\n", pos)
+                line_end = n if nl == -1 else nl
+                if not _is_table_line(text, pos, line_end):
+                    break
+                table_end = line_end
+                pos = line_end + 1
+            yield table_start, table_end, "table", 0, ""
+            continue
+
+        if block_start is None:
+            block_start = pos
+        block_end = line_end
+        pos = next_pos
+
+    if block_start is not None:
+        yield block_start, block_end, "text", 0, ""
+
+
+def _trim(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _split_long(text: str, start: int, end: int, chunk_size: int, overlap: int, kind: str) -> Iterator[Tuple[int, int]]:
+    """Split one oversized block: tables at row boundaries, prose at sentence or line breaks."""
+    pos = start
+    while pos < end:
+        stop = min(pos + chunk_size, end)
+        if stop < end:
+            if kind == "table":
+                brk = text.rfind("\n", pos, stop)
+                if brk > pos:
+                    stop = brk + 1
+            else:
+                brk = max(text.rfind(".", pos, stop), text.rfind("\n", pos, stop))
+                if brk > pos + chunk_size * 0.5:
+                    stop = brk + 1
+        yield pos, stop
+        if stop >= end:
+            break
+        step_back = 0 if kind == "table" else overlap
+        pos = max(stop - step_back, pos + 1)
+
+
+def _overlap_start(text: str, chunk_start: int, chunk_end: int, overlap: int) -> int:
+    """Start of the overlap window carried into the next chunk, snapped to a word boundary."""
+    pos = max(chunk_start, chunk_end - overlap)
+    while pos < chunk_end and not text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def iter_chunk_spans(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> Iterator[Span]:
+    """
+    Yield (start, end, section_path) spans covering the markdown.
+
+    - A heading always starts a new chunk, and section_path is the heading trail
+      (e.g. ("Item 7. MD&A", "Liquidity and Capital Resources"))
+    - Consecutive blocks of a section are packed up to chunk_size characters
+    - Tables are never split unless larger than TABLE_SIZE_FACTOR * chunk_size
+    - Prose chunks within a section overlap by up to `overlap` characters
+    """
+    if not text:
+        return
+
+    overlap = max(0, min(overlap, chunk_size // 2))
+    table_limit = chunk_size * TABLE_SIZE_FACTOR
+    headings = []  # [(level, title)]
+    section = ()
+    cur_start = None
+    cur_end = 0
+    cur_last_kind = None
+
+    def emit(start, end):
+        start, end = _trim(text, start, end)
+        if end > start:
+            return start, end, section
+        return None
+
+    for start, end, kind, level, title in iter_blocks(text):
+        if kind == "heading":
+            if cur_start is not None and cur_last_kind != "heading":
+                span = emit(cur_start, cur_end)
+                if span:
+                    yield span
+                cur_start = None
+            headings = [h for h in headings if h[0] < level] + [(level, title)]
+            section = tuple(t for _, t in headings)
+            # Consecutive headings stay together with the content that follows them
+            if cur_start is None:
+                cur_start = start
+            cur_end, cur_last_kind = end, kind
+            continue
+
+        limit = table_limit if kind == "table" else chunk_size
+        if cur_start is not None and end - cur_start <= limit:
+            cur_end, cur_last_kind = end, kind
+            continue
+
+        # Block does not fit: close the current chunk
+        next_start = start
+        if cur_start is not None:
+            if cur_last_kind == "heading":
+                # Never emit a heading on its own; it leads the next chunk instead
+                next_start = cur_start
+            else:
+                span = emit(cur_start, cur_end)
+                if span:
+                    yield span
+                if overlap and kind == "text" and cur_last_kind == "text":
+                    carried = _overlap_start(text, cur_start, cur_end, overlap)
+                    if end - carried <= chunk_size:
+                        next_start = carried
+
+        if end - start > limit:
+            pieces = list(_split_long(text, start, end, chunk_size, overlap, kind))
+            pieces[0] = (min(next_start, pieces[0][0]), pieces[0][1])
+            for piece_start, piece_end in pieces[:-1]:
+                span = emit(piece_start, piece_end)
+                if span:
+                    yield span
+            next_start, end = pieces[-1]
+
+        cur_start, cur_end, cur_last_kind = next_start, end, kind
+
+    if cur_start is not None:
+        span = emit(cur_start, cur_end)
+        if span:
+            yield span
+
+
+def chunk_text(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> List[str]:
+    """Materialized chunk strings (convenience wrapper around iter_chunk_spans)."""
+    return [text[start:end] for start, end, _ in iter_chunk_spans(text, chunk_size, overlap)]
+
+
+def section_label(section_path) -> str:
+    """Human-readable section trail used in citations."""
+    return " › ".join(section_path) if section_path else ""
+
+
+def page_offsets_index(page_offsets: Optional[Sequence[Sequence[int]]]) -> List[int]:
+    """The offset column of a page table; build it once per document and pass it to page_range."""
+    return [offset for offset, _ in page_offsets or []]
+
+
+def page_range(start: int, end: int, page_offsets: Sequence[Sequence[int]],
+               offsets: Optional[Sequence[int]] = None) -> Tuple[Optional[int], Optional[int]]:
+    """
+    (first page, last page) of the span [start, end) given the parser's
+    ascending [[markdown offset, page], ...] table; (None, None) without one.
+    offsets is page_offsets_index(page_offsets), when the caller looks up many spans.
+    """
+    if not page_offsets:
+        return None, None
+    if offsets is None:
+        offsets = page_offsets_index(page_offsets)
+    first = page_offsets[max(0, bisect_right(offsets, start) - 1)][1]
+    last = page_offsets[max(0, bisect_right(offsets, max(start, end - 1)) - 1)][1]
+    return first, last
+
+
+def page_label(page_start: Optional[int], page_end: Optional[int] = None) -> str:
+    """"p. 7" / "pp. 7–8" for citations, "" when the page is unknown."""
+    if not page_start:
+        return ""
+    if page_end and page_end != page_start:
+        return f"pp. {page_start}–{page_end}"
+    return f"p. {page_start}"
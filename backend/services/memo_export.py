@@ -0,0 +1,177 @@
+"""
+Memo PDF Export
+Renders memos to PDF on a background worker. Artifacts are content-addressed
+by a hash of the memo, so exporting an unchanged memo returns the existing
+file immediately. Old artifacts are evicted by count, total size and
+versions kept per task (least recently served first).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+
+EXPORT_DIR = os.getenv("MEMO_EXPORT_DIR", "./exports")
+MAX_FILES = int(os.getenv("MEMO_EXPORT_MAX_FILES", "200"))
+MAX_BYTES = int(os.getenv("MEMO_EXPORT_MAX_MB", "200")) * 1024 * 1024
+VERSIONS_PER_TASK = int(os.getenv("MEMO_EXPORT_VERSIONS_PER_TASK", "3"))
+
+# Bump when the PDF layout changes so cached artifacts are re-rendered
+RENDER_VERSION = 1
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MEMO_EXPORT_WORKERS", "2")), thread_name_prefix="memo-export")
+_jobs: Dict[str, Future] = {}   # {content hash: render in progress}
+_errors: Dict[str, str] = {}    # {content hash: last render error}
+_lock = threading.Lock()
+
+
+def content_hash(task_id: str, summary: Optional[str], metrics_json: Optional[str]) -> str:
+    metrics = json.loads(metrics_json or "{}")
+    payload = json.dumps([RENDER_VERSION, task_id, summary or "", metrics], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def artifact_path(task_id: str, digest: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{task_id}_{digest}.pdf")
+
+
+def _render(task_id: str, summary: Optional[str], metrics_json: Optional[str], path: str):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # A private temp file per render: workers exporting the same memo never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".render-", suffix=".pdf")
+    os.close(fd)
+    try:
+        _build_pdf(task_id, summary, metrics_json, tmp_path)
+        # Readers never see a half-written file
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _build_pdf(task_id: str, summary: Optional[str], metrics_json: Optional[str], tmp_path: str):
+    doc = SimpleDocTemplate(tmp_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.append(Paragraph("Due Diligence Memo", styles["Title"]))
+    story.append(Spacer(1, 20))
+
+    story.append(Paragraph(f"<b>Task ID:</b> {task_id}", styles["Normal"]))
+    story.append(Spacer(1, 12))
+
+    story.append(Paragraph("<b>Executive Summary:</b>", styles["Heading2"]))
+    story.append(Paragraph(summary or "No summary available", styles["Normal"]))
+    story.append(Spacer(1, 20))
+
+    story.append(Paragraph("<b>Key Metrics:</b>", styles["Heading2"]))
+    metrics = json.loads(metrics_json or "{}")
+    for k, v in metrics.items():
+        story.append(Paragraph(f"- {k}: {v}", styles["Normal"]))
+    story.append(Spacer(1, 20))
+
+    doc.build(story)
+
+
+def _run(task_id: str, digest: str, summary: Optional[str], metrics_json: Optional[str]):
+    path = artifact_path(task_id, digest)
+    try:
+        t0 = time.perf_counter()
+        _render(task_id, summary, metrics_json, path)
+        print(f"✅ Rendered memo export {os.path.basename(path)} in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        with _lock:
+            _errors.pop(digest, None)
+        evict()
+    except Exception as e:
+        print(f"❌ Memo export failed for task {task_id}: {e}")
+        with _lock:
+            _errors[digest] = str(e)
+        raise
+    finally:
+        with _lock:
+            _jobs.pop(digest, None)
+
+
+def request_export(task_id: str, summary: Optional[str], metrics_json: Optional[str]) -> dict:
+    """
+    Ensure an artifact exists for this memo content.
+    Returns {hash, status: "ready" | "pending", future (when pending)}.
+    """
+    digest = content_hash(task_id, summary, metrics_json)
+    if os.path.exists(artifact_path(task_id, digest)):
+        return {"hash": digest, "status": "ready"}
+
+    with _lock:
+        future = _jobs.get(digest)
+        if future is None:
+            _errors.pop(digest, None)
+            future = _executor.submit(_run, task_id, digest, summary, metrics_json)
+            _jobs[digest] = future
+    return {"hash": digest, "status": "pending", "future": future}
+
+
+def export_status(task_id: str, digest: str) -> dict:
+    """{status: "ready" | "pending" | "failed" | "missing", path?, error?}"""
+    path = artifact_path(task_id, digest)
+    if os.path.exists(path):
+        return {"status": "ready", "path": path}
+    with _lock:
+        if digest in _jobs:
+            return {"status": "pending"}
+        if digest in _errors:
+            return {"status": "failed", "error": _errors[digest]}
+    return {"status": "missing"}
+
+
+def touch(path: str):
+    """Mark an artifact as recently used for LRU eviction"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict() -> int:
+    """Drop artifacts beyond the per-task, count and size budgets (least recently used first)"""
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+
+    artifacts = []
+    for name in os.listdir(EXPORT_DIR):
+        if not name.endswith(".pdf") or "_" not in name or name.startswith("."):  # renders in progress start with "."
+            continue
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        artifacts.append((stat.st_mtime, stat.st_size, name.rsplit("_", 1)[0], path))
+    artifacts.sort(reverse=True)  # most recently used first
+
+    keep, doomed = [], []
+    per_task: Dict[str, int] = {}
+    total_bytes = 0
+    for mtime, size, task_id, path in artifacts:
+        per_task[task_id] = per_task.get(task_id, 0) + 1
+        if per_task[task_id] > VERSIONS_PER_TASK or len(keep) >= MAX_FILES or total_bytes + size > MAX_BYTES:
+            doomed.append(path)
+            continue
+        keep.append(path)
+        total_bytes += size
+
+    for path in doomed:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if doomed:
+        print(f"🧹 Evicted {len(doomed)} memo export(s); {len(keep)} kept ({total_bytes / 1e6:.1f} MB)")
+    return len(doomed)
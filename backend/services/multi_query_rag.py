@@ -5,58 +5,81 @@ and synthesizes comprehensive answers with citations
 """
 
 import json
-from typing import List, Dict, Any
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from services import conversation_context
 from services import gemini_client
 from services import pathway_rag
+from services import query_decomposer
+from services import usage
+
+# Speculative and per-sub-query retrievals run here, overlapping decomposition
+_retrieval_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RAG_RETRIEVAL_THREADS", "4")),
+    thread_name_prefix="rag-retrieve",
+)
+
+# Sub-queries this similar to the question (or to each other) reuse its retrieval
+REUSE_JACCARD = 0.8
 
-def decompose_query(user_question: str) -> List[str]:
-    """
-    Use Gemini to break down complex question into specific sub-queries
-    """
-    prompt = f"""You are a financial analyst assistant. Break down this question into 3-5 specific sub-questions that would help answer it comprehensively for M&A due diligence.
 
-User Question: {user_question}
+def _query_terms(query: str) -> set:
+    return set(query_decomposer.normalize_question(query).split())
 
-Requirements:
-- Each sub-question should focus on a specific aspect (financial, operational, risk, etc.)
-- Sub-questions should be self-contained and specific
-- Return ONLY a JSON array of strings, nothing else
-- Example format: ["What is the revenue trend?", "What are the key risks?"]
 
-Sub-questions:"""
+def _same_query(a: set, b: set) -> bool:
+    if not a or not b:
+        return a == b
+    return len(a & b) / len(a | b) >= REUSE_JACCARD
 
+
+def _timed_context(task_id: str, query: str, working_set: conversation_context.WorkingSet = None) -> Tuple[Optional[Dict[str, Any]], float, bool]:
+    """(rag_result, ms, from_working_set): the conversation's working set is tried before the index"""
+    t0 = time.perf_counter()
     try:
-        response = gemini_client.ask_gemini([{
-            "role": "user",
-            "content": prompt
-        }])
-        
-        # Clean response and parse JSON
-        response_text = response.strip()
-        if response_text.startswith("```"):
-            # Remove code blocks if present
-            response_text = response_text.split("```")[1]
-            if response_text.startswith("json"):
-                response_text = response_text[4:]
-        
-        sub_queries = json.loads(response_text)
-        
-        # Validate it's a list
-        if not isinstance(sub_queries, list):
-            return [user_question]  # Fallback to original
-        
-        return sub_queries[:5]  # Limit to 5 max
-        
+        query_vec = pathway_rag.embed_query(query)
+        covered = working_set.lookup(query, query_vec, pathway_rag.index_params())[0] if working_set is not None else None
+        if covered is not None and not working_set.should_verify(query):
+            return covered, (time.perf_counter() - t0) * 1000, True
+        result = pathway_rag.get_rag_context(task_id, query, query_embedding=query_vec, with_vectors=True)
+        # Sampled check: the working-set answer stands only if the index agrees with it
+        if covered is not None and working_set.verify(covered, result):
+            return covered, (time.perf_counter() - t0) * 1000, True
     except Exception as e:
-        print(f"⚠️ Query decomposition failed: {e}")
-        return [user_question]  # Fallback to original question
+        print(f"⚠️ RAG failed for query '{query}': {e}")
+        result = None
+    return result, (time.perf_counter() - t0) * 1000, False
+
+
+def _format_context(sources: List[Dict[str, Any]], shown: Dict[Tuple, str], label: str) -> str:
+    """Numbered excerpts; one already given under another sub-question is referenced instead of repeated"""
+    parts = []
+    for idx, source in enumerate(sources, 1):
+        key = (source.get("doc_id"), source.get("chunk_index"))
+        if key in shown:
+            parts.append(f"[Source {idx}] (same excerpt as {shown[key]})")
+        else:
+            shown[key] = f"{label}, Source {idx}"
+            parts.append(f"[Source {idx}] {source['text']}")
+    return "\n\n".join(parts)
 
+def decompose_query(user_question: str) -> List[str]:
+    """
+    Break a complex question down into specific sub-queries
+    (cached LLM, templates or both, depending on DECOMPOSER_MODE)
+    """
+    sub_queries, _ = query_decomposer.decompose(user_question)
+    return sub_queries
 
-def multi_query_rag(user_question: str, task_id: str, structured_data: dict = None, metrics: dict = None, insights: list = None) -> Dict[str, Any]:
+
+def multi_query_rag(user_question: str, task_id: str, structured_data: dict = None, metrics: dict = None, insights: list = None, trends: str = "", conversation_id: str = None) -> Dict[str, Any]:
     """
     Multi-query RAG pipeline:
-    1. Decompose question into sub-queries
-    2. Retrieve context for each sub-query
+    1. Decompose question into sub-queries (while retrieving for the raw question)
+    2. Retrieve context for each sub-query not covered by that retrieval
+       or by the conversation's working set (chunks from recent turns)
     3. Synthesize comprehensive answer with all citations
     
     Args:
@@ -65,60 +88,126 @@ def multi_query_rag(user_question: str, task_id: str, structured_data: dict = No
         structured_data: Extracted financial fields (optional)
         metrics: Computed financial metrics (optional)
         insights: Generated insights (optional)
+        trends: Pre-computed period-over-period trends as text (optional)
+        conversation_id: Conversation whose recent turns and chunks are reused (optional)
     
     Returns:
-        dict with answer, sub_queries, citations, reasoning
+        dict with answer, sub_queries, citations, reasoning, timings
     """
     
-    # Step 1: Decompose into sub-queries
-    print(f"🔍 Decomposing query: {user_question}")
-    sub_queries = decompose_query(user_question)
-    print(f"📋 Generated {len(sub_queries)} sub-queries: {sub_queries}")
-    
-    # Step 2: Retrieve context for each sub-query
+    started = time.perf_counter()
+    # Without a conversation id there is no thread to follow: no history and no working set
+    working_set = conversation_context.get(task_id, conversation_id) if conversation_id else None
+    # A short follow-up ("and last quarter?") is retrieved and decomposed together with the previous question
+    retrieval_question = working_set.contextualize(user_question) if working_set else user_question
+    history = working_set.prompt_history() if working_set else ""
+    # Only a follow-up is answered from the working set; a new question always goes to the index
+    follow_up = retrieval_question != user_question
+    lookup_set = working_set if follow_up else None
+
+    # Step 1: Decompose into sub-queries, while retrieving for the raw question speculatively
+    speculative = _retrieval_pool.submit(usage.bind(_timed_context), task_id, retrieval_question, lookup_set)
+    print(f"🔍 Decomposing query: {retrieval_question}")
+    t0 = time.perf_counter()
+    sub_queries, decomposition_source = query_decomposer.decompose(retrieval_question)
+    decompose_ms = (time.perf_counter() - t0) * 1000
+    print(f"📋 Generated {len(sub_queries)} sub-queries ({decomposition_source}): {sub_queries}")
+
+    # Step 2: Retrieve context only for sub-queries not already covered
+    question_terms = _query_terms(retrieval_question)
+    plan = []  # per sub-query: "question", index of an earlier identical sub-query, or None (new)
+    for idx, sub_q in enumerate(sub_queries):
+        terms = _query_terms(sub_q)
+        if _same_query(terms, question_terms):
+            plan.append("question")
+            continue
+        earlier = next((j for j in range(idx) if _same_query(terms, _query_terms(sub_queries[j]))), None)
+        plan.append(earlier)
+
+    t0 = time.perf_counter()
+    new_futures = {
+        idx: _retrieval_pool.submit(usage.bind(_timed_context), task_id, sub_q, lookup_set)
+        for idx, sub_q in enumerate(sub_queries) if plan[idx] is None
+    }
+    speculative_result, speculative_ms, speculative_reused = speculative.result()
+    retrieved = {idx: future.result() for idx, future in new_futures.items()}
+    subquery_retrieval_ms = (time.perf_counter() - t0) * 1000
+    context_ready_ms = (time.perf_counter() - started) * 1000
+
+    # Index results join the working set only now, so this turn's lookups all saw the same set
+    fetched = [speculative_result] if not speculative_reused else []
+    fetched += [r for r, _, reused in retrieved.values() if not reused]
+    if working_set is not None:
+        working_set.add([s for r in fetched if r for s in r.get("sources", [])], pathway_rag.index_params())
+    working_set_hits = int(speculative_reused) + sum(1 for _, _, reused in retrieved.values() if reused)
+
+    results = []
+    for idx, step in enumerate(plan):
+        if step == "question":
+            results.append((speculative_result, speculative_ms, speculative_reused))
+        elif step is None:
+            results.append(retrieved[idx])
+        else:
+            results.append(results[step])
+
     all_contexts = []
     all_citations = []
     seen_sources = set()
-    
-    for idx, sub_q in enumerate(sub_queries):
-        try:
-            rag_result = pathway_rag.get_rag_context(task_id, sub_q)
-            
+    shown_excerpts = {}
+
+    def collect(sub_q, index, rag_result, label):
+        sources = rag_result.get("sources", [])
+        if sources and all(s.get("text") for s in sources):
+            context_text = _format_context(sources, shown_excerpts, label)
+        else:
             context_text = rag_result.get("context", "")
-            sources = rag_result.get("sources", [])
-            
-            if context_text:
-                all_contexts.append({
+
+        if context_text:
+            all_contexts.append({
+                "sub_query": sub_q,
+                "context": context_text,
+                "index": index,
+                "label": label
+            })
+
+        # Collect unique citations
+        # A deduplicated chunk is cited at every location it occurs
+        for source in sources:
+            for location in source.get("locations") or [source]:
+                source_key = f"{location.get('doc_id', location['filename'])}_{location.get('chunk_index', '')}"
+                if source_key in seen_sources:
+                    continue
+                section = location.get("section", "")
+                all_citations.append({
+                    "document": location["filename"],
+                    "page": location.get("page") or section or f"Chunk {location.get('chunk_index', 0)}",
+                    "section": section,
+                    "chunk_index": location.get("chunk_index"),
+                    "char_span": location.get("char_span"),
                     "sub_query": sub_q,
-                    "context": context_text,
-                    "index": idx + 1
+                    "sub_query_index": index
                 })
-            
-            # Collect unique citations
-            for source in sources:
-                source_key = f"{source['filename']}_{source.get('chunk_index', '')}"
-                if source_key not in seen_sources:
-                    all_citations.append({
-                        "document": source["filename"],
-                        "page": f"Chunk {source.get('chunk_index', 0)}",
-                        "sub_query": sub_q,
-                        "sub_query_index": idx + 1
-                    })
-                    seen_sources.add(source_key)
-            
-            print(f"✅ Sub-query {idx+1}: Found {len(sources)} sources")
-            
-        except Exception as e:
-            print(f"⚠️ RAG failed for sub-query '{sub_q}': {e}")
+                seen_sources.add(source_key)
+
+    for idx, (sub_q, (rag_result, _, _)) in enumerate(zip(sub_queries, results)):
+        if rag_result is None or (plan[idx] not in ("question", None)):
             continue
-    
+        collect(sub_q, idx + 1, rag_result, f"Sub-Question {idx + 1}")
+        print(f"✅ Sub-query {idx+1}: Found {len(rag_result.get('sources', []))} sources")
+
+    # The speculative results still count when no sub-query reused them, if they add new chunks
+    if speculative_result and "question" not in plan:
+        covered = {(s.get("doc_id"), s.get("chunk_index")) for r, _, _ in results if r for s in r.get("sources", [])}
+        if any((s.get("doc_id"), s.get("chunk_index")) not in covered for s in speculative_result.get("sources", [])):
+            collect(retrieval_question, 0, speculative_result, "Original Question")
+
     # If no contexts found, add placeholder
     if not all_contexts:
-        all_contexts = [{"sub_query": "No relevant documents", "context": "No relevant excerpts found.", "index": 0}]
+        all_contexts = [{"sub_query": "No relevant documents", "context": "No relevant excerpts found.", "index": 0, "label": "Sub-Question 0"}]
     
     # Step 3: Build comprehensive synthesis prompt
     contexts_formatted = "\n\n".join([
-        f"[Sub-Question {ctx['index']}]: {ctx['sub_query']}\n{ctx['context']}"
+        f"[{ctx['label']}]: {ctx['sub_query']}\n{ctx['context']}"
         for ctx in all_contexts
     ])
     
@@ -134,8 +223,17 @@ def multi_query_rag(user_question: str, task_id: str, structured_data: dict = No
     if insights and any(i for i in insights if i):
         insights_section = f"\n\nKey Insights:\n{json.dumps(insights, indent=2)}"
     
+    trends_section = ""
+    if trends:
+        trends_section = f"\n\nPeriod-over-Period Trends (pre-computed, use these figures rather than recalculating):\n{trends}"
+    
+    # Earlier turns go in as questions and abbreviated answers; their excerpts are already above when still relevant
+    history_section = ""
+    if history:
+        history_section = f"\nCONVERSATION SO FAR (earlier answers abbreviated):\n{history}\n"
+    
     synthesis_prompt = f"""You are a financial analyst. Answer the user's question comprehensively using all the provided context.
-
+{history_section}
 ORIGINAL QUESTION: {user_question}
 
 ANALYSIS FROM MULTIPLE PERSPECTIVES:
@@ -143,6 +241,7 @@ ANALYSIS FROM MULTIPLE PERSPECTIVES:
 {structured_section}
 {metrics_section}
 {insights_section}
+{trends_section}
 
 REQUIREMENTS:
 1. Synthesize a comprehensive answer that addresses all aspects
@@ -155,15 +254,39 @@ REQUIREMENTS:
 COMPREHENSIVE ANSWER:"""
     
     # Step 4: Generate final synthesis
+    t0 = time.perf_counter()
     try:
         final_answer = gemini_client.ask_gemini([{
             "role": "user",
             "content": synthesis_prompt
         }])
+        if working_set is not None:
+            working_set.record_turn(user_question, final_answer, sub_queries, follow_up)
     except Exception as e:
         print(f"❌ Synthesis failed: {e}")
         final_answer = "Unable to generate comprehensive answer. Please try again."
-    
+    synthesis_ms = (time.perf_counter() - t0) * 1000
+
+    # A strictly sequential pipeline would decompose, then run every retrieval back to back
+    sequential_ms = decompose_ms + sum(ms for _, ms, _ in results)
+    timings = {
+        "decomposition_source": decomposition_source,
+        "decompose_ms": round(decompose_ms, 1),
+        "speculative_retrieval_ms": round(speculative_ms, 1),
+        "subquery_retrieval_ms": round(subquery_retrieval_ms, 1),
+        "context_ready_ms": round(context_ready_ms, 1),
+        "synthesis_ms": round(synthesis_ms, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "sequential_estimate_ms": round(sequential_ms + synthesis_ms, 1),
+        "overlap_saved_ms": round(max(0.0, sequential_ms - context_ready_ms), 1),
+        "subqueries_retrieved": len(new_futures),
+        "subqueries_reused": len(sub_queries) - len(new_futures),
+        "working_set_hits": working_set_hits,
+        "working_set_chunks": working_set.stats()["chunks"] if working_set else 0,
+        "follow_up": follow_up,
+    }
+    print(f"⏱️ Context ready in {timings['context_ready_ms']} ms (saved {timings['overlap_saved_ms']} ms by overlapping retrieval)")
+
     # Step 5: Return complete result
     return {
         "answer": final_answer,
@@ -171,5 +294,6 @@ COMPREHENSIVE ANSWER:"""
         "citations": all_citations,
         "reasoning": [f"Analyzed: {sq}" for sq in sub_queries],
         "num_sub_queries": len(sub_queries),
-        "num_citations": len(all_citations)
+        "num_citations": len(all_citations),
+        "timings": timings
     }
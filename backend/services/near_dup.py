@@ -0,0 +1,127 @@
+"""
+Near-Duplicate Chunk Detection
+64-bit SimHash fingerprints over word shingles, with 8 x 8-bit LSH bands so
+any two fingerprints within Hamming distance 7 share at least one band.
+Used at index time to store repeated boilerplate once.
+
+Two chunks only count as near-duplicates when their numbers match exactly,
+so quarter-over-quarter prose that differs only in its figures is kept apart.
+"""
+
+import hashlib
+import re
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_BANDS = 8
+BAND_BITS = 64 // NUM_BANDS
+DEFAULT_MAX_DISTANCE = 6  # must stay below NUM_BANDS for the band lookup to be exhaustive
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_NUMBER_RE = re.compile(r"\d[\d,.]*")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def _normalize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def exact_key(text: str) -> str:
+    """Fingerprint for exact matching (whitespace/case/punctuation-insensitive)"""
+    return hashlib.blake2b(" ".join(_normalize(text)).encode(), digest_size=16).hexdigest()
+
+
+def numbers_key(text: str) -> str:
+    """Fingerprint of the figures in the text, in order"""
+    return hashlib.blake2b(" ".join(_NUMBER_RE.findall(text)).encode(), digest_size=8).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the text's word shingles"""
+    tokens = _normalize(text)
+    if not tokens:
+        return 0
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # (n, 64) matrix of bits -> +1/-1 votes per bit position
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int(((votes > 0).astype(np.uint64) << _BIT_SHIFTS).sum())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def bands(fingerprint: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(NUM_BANDS)]
+
+
+class DuplicateIndex:
+    """LSH lookup from fingerprints to row ids"""
+
+    def __init__(self):
+        self.bands: List[Dict[int, Set[int]]] = [{} for _ in range(NUM_BANDS)]
+        self.exact: Dict[str, int] = {}
+
+    def add(self, row_id: int, fingerprint: int, key: str, exact_only: bool = False):
+        if not exact_only:
+            for i, band in enumerate(bands(fingerprint)):
+                self.bands[i].setdefault(band, set()).add(row_id)
+        self.exact.setdefault(key, row_id)
+
+    def remove(self, row_id: int, fingerprint: int, key: str):
+        for i, band in enumerate(bands(fingerprint)):
+            bucket = self.bands[i].get(band)
+            if bucket is not None:
+                bucket.discard(row_id)
+                if not bucket:
+                    del self.bands[i][band]
+        if self.exact.get(key) == row_id:
+            del self.exact[key]
+
+    def find(self, fingerprint: int, key: str, fingerprint_of: Callable[[int], int], exact_only: bool = False, max_distance: int = DEFAULT_MAX_DISTANCE, compatible: Callable[[int], bool] = None) -> Optional[int]:
+        """
+        Row id of an existing duplicate, or None.
+        fingerprint_of(row_id) returns a candidate row's SimHash; compatible(row_id)
+        can veto near (non-exact) matches.
+        """
+        if key in self.exact:
+            return self.exact[key]
+        if exact_only or not fingerprint:
+            return None
+
+        max_distance = min(max_distance, NUM_BANDS - 1)
+        best, best_distance = None, max_distance + 1
+        checked = set()
+        for i, band in enumerate(bands(fingerprint)):
+            for row_id in self.bands[i].get(band, ()):
+                if row_id in checked:
+                    continue
+                checked.add(row_id)
+                if compatible is not None and not compatible(row_id):
+                    continue
+                distance = hamming(fingerprint, fingerprint_of(row_id))
+                if distance < best_distance:
+                    best, best_distance = row_id, distance
+        return best
+
+    def remap(self, mapping: Dict[int, int]):
+        """Renumber row ids after compaction (rows missing from mapping are dropped)"""
+        self.bands = [
+            {band: {mapping[r] for r in ids if r in mapping} for band, ids in table.items()}
+            for table in self.bands
+        ]
+        self.bands = [{band: ids for band, ids in table.items() if ids} for table in self.bands]
+        self.exact = {key: mapping[r] for key, r in self.exact.items() if r in mapping}
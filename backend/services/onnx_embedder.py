@@ -0,0 +1,235 @@
+"""
+ONNX Embedding Backend
+Runs all-MiniLM-L6-v2 exported to ONNX on onnxruntime, optionally with
+dynamic int8 weight quantization, producing the same mean-pooled,
+L2-normalized vectors as sentence-transformers without importing torch.
+
+Export once (needs torch + transformers, not needed afterwards):
+    python -m services.onnx_embedder export [--out DIR] [--quantize]
+    python -m services.onnx_embedder check
+
+The export records each variant's cosine agreement with the PyTorch model in
+manifest.json. load() refuses a variant below EMBEDDING_COMPAT_TOLERANCE, so
+its vectors can be searched against chunks indexed by the PyTorch backend.
+"""
+
+import json
+import os
+import time
+from typing import List
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(BACKEND_DIR, "models", "all-MiniLM-L6-v2-onnx"))
+ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "0") == "1"
+ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+COMPAT_TOLERANCE = float(os.getenv("EMBEDDING_COMPAT_TOLERANCE", "0.98"))  # min cosine vs PyTorch
+MAX_SEQ_LENGTH = 256  # sentence-transformers' limit for this model
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+MANIFEST_FILE = "manifest.json"
+
+# Fixed texts for the compatibility check: short queries plus filing-style prose and tables
+COMPAT_SAMPLES = [
+    "What is the debt-to-equity ratio?",
+    "customer concentration risk",
+    "change of control consent assignment",
+    "Revenue grew 12% year over year to $48.2 million, driven by subscription renewals.",
+    "Total debt was $120.5 million at quarter end, compared with $98.0 million a year earlier.",
+    "The credit agreement contains a maximum leverage covenant of 3.5x consolidated EBITDA.",
+    "We are party to pending litigation that, if decided adversely, could have a material effect.",
+    "Our ten largest customers accounted for 41% of revenue in fiscal 2024.",
+    "Cash and cash equivalents of $32.1 million plus the undrawn revolver fund operations for 12 months.",
+    "| Metric | Q3 2024 | Q3 2023 |\n|---|---|---|\n| Revenue | 48.2 | 43.0 |\n| Net income | 5.1 | 3.9 |",
+    "Gross margin declined to 61% due to higher hosting costs and a shift toward services revenue.",
+    "Any assignment of this Agreement, including by merger or change of control, requires prior written consent.",
+    "Operating cash flow was negative for the third consecutive quarter.",
+    "Going concern: substantial doubt exists about the Company's ability to continue as a going concern.",
+    "EBITDA",
+    "The Company leases its headquarters under a non-cancelable operating lease expiring in 2031. " * 8,
+]
+
+
+class OnnxEmbedder:
+    """Drop-in for SentenceTransformer.encode() backed by an onnxruntime session"""
+
+    def __init__(self, model_dir: str = ONNX_DIR, quantized: bool = ONNX_QUANTIZED, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_path = os.path.join(model_dir, QUANTIZED_FILE if quantized else MODEL_FILE)
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def model_id(self) -> str:
+        """Name of the vectors this model produces: fp32 matches the PyTorch model (checked at export), int8 only approximately"""
+        return SOURCE_MODEL.split("/", 1)[1] + ("-int8" if self.quantized else "")
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(texts), width), dtype=np.int64)
+        attention_mask = np.zeros((len(texts), width), dtype=np.int64)
+        for i, e in enumerate(encodings):
+            input_ids[i, :len(e.ids)] = e.ids
+            attention_mask[i, :len(e.ids)] = 1
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]  # (batch, seq, dim)
+
+        # Mean pooling over real tokens, then L2 normalize (sentence-transformers' pipeline)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, texts, convert_to_numpy: bool = True, batch_size: int = 32, **kwargs):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        if not batch:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Similar lengths per batch keep padding (and wasted compute) low
+        order = sorted(range(len(batch)), key=lambda i: -len(batch[i]))
+        parts = [self._encode_batch([batch[i] for i in order[s:s + batch_size]]) for s in range(0, len(order), batch_size)]
+        vectors = np.empty((len(batch), parts[0].shape[1]), dtype=np.float32)
+        vectors[order] = np.concatenate(parts)
+        return vectors[0] if single else vectors
+
+
+# ----------------------
+# Compatibility
+# ----------------------
+def check_compatibility(reference, candidate, texts: List[str] = None) -> dict:
+    """Row-wise cosine between two encoders' vectors for the same texts"""
+    texts = texts or COMPAT_SAMPLES
+    a = np.asarray(reference.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    b = np.asarray(candidate.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    if a.shape != b.shape:
+        return {"texts": len(texts), "min_cosine": 0.0, "mean_cosine": 0.0, "error": f"shape {b.shape} != {a.shape}"}
+    a /= np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b /= np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    cosines = (a * b).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+    }
+
+
+def _variant(quantized: bool) -> str:
+    return "int8" if quantized else "fp32"
+
+
+def _read_manifest(model_dir: str) -> dict:
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load(model_dir: str = ONNX_DIR, quantized: bool = ONNX_QUANTIZED, tolerance: float = COMPAT_TOLERANCE) -> OnnxEmbedder:
+    """Load an exported model, refusing variants that drift from the PyTorch vectors"""
+    compat = _read_manifest(model_dir).get("compatibility", {}).get(_variant(quantized))
+    if compat is None:
+        print(f"⚠️ No compatibility record for the {_variant(quantized)} ONNX model in {model_dir}; run `python -m services.onnx_embedder check`")
+    elif compat.get("min_cosine", 0.0) < tolerance:
+        raise ValueError(
+            f"ONNX {_variant(quantized)} model agrees with PyTorch only to cosine {compat.get('min_cosine')} "
+            f"(< {tolerance}); its vectors would not match existing indexes"
+        )
+    return OnnxEmbedder(model_dir, quantized)
+
+
+# ----------------------
+# Export (offline, needs torch)
+# ----------------------
+def _reference_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(SOURCE_MODEL.split("/", 1)[1])
+
+
+def check(model_dir: str = ONNX_DIR, variants: List[bool] = None, reference=None) -> dict:
+    """Recompute and store the compatibility record of each exported variant"""
+    reference = reference or _reference_model()
+    manifest = _read_manifest(model_dir)
+    manifest.setdefault("compatibility", {})
+    for quantized in variants if variants is not None else [False, True]:
+        if not os.path.exists(os.path.join(model_dir, QUANTIZED_FILE if quantized else MODEL_FILE)):
+            continue
+        result = check_compatibility(reference, OnnxEmbedder(model_dir, quantized))
+        result["tolerance"] = COMPAT_TOLERANCE
+        result["compatible"] = result["min_cosine"] >= COMPAT_TOLERANCE
+        manifest["compatibility"][_variant(quantized)] = result
+        print(f"{'✅' if result['compatible'] else '⚠️'} {_variant(quantized)}: min cosine {result['min_cosine']}, mean {result['mean_cosine']}")
+    with open(os.path.join(model_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def export(out_dir: str = ONNX_DIR, quantize: bool = False, opset: int = 17) -> dict:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(SOURCE_MODEL)
+    model = AutoModel.from_pretrained(SOURCE_MODEL).eval()
+
+    t0 = time.perf_counter()
+    sample = tokenizer(["An example sentence", "Another one"], padding=True, return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic = {"batch": 0, "sequence": 1}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in names),
+            os.path.join(out_dir, MODEL_FILE),
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={n: {v: k for k, v in dynamic.items()} for n in names + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+    print(f"✅ Exported {SOURCE_MODEL} to {out_dir} in {time.perf_counter() - t0:.1f}s")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(out_dir, MODEL_FILE), os.path.join(out_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+        print(f"✅ Wrote dynamic int8 model {QUANTIZED_FILE}")
+
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"source_model": SOURCE_MODEL, "max_seq_length": MAX_SEQ_LENGTH, "opset": opset}, f, indent=2)
+    return check(out_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export or verify the ONNX embedding model")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--out", default=ONNX_DIR)
+    parser.add_argument("--quantize", action="store_true", help="also write a dynamic int8 model")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args.out, args.quantize)
+    else:
+        check(args.out)
@@ -4,93 +4,376 @@ Combines sentence-transformers embeddings with keyword matching for optimal retr
 """
 
 import os
-import json
-from typing import List, Dict, Any
-
-# Try to import sentence transformers for embeddings
-try:
-    from sentence_transformers import SentenceTransformer
-    import numpy as np
-    EMBEDDINGS_AVAILABLE = True
-except ImportError:
+import heapq
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+from services.markdown_chunker import iter_chunk_spans, page_label, page_offsets_index, page_range, section_label
+from services.task_index import TaskIndex, tokenize
+from services import dataroom_events, usage
+
+# local: every worker loads its own PyTorch model; onnx: the exported model on
+# onnxruntime, no torch import (see services/onnx_embedder.py); service: workers
+# share one model process over a Unix socket (see services/embedding_service.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "local").lower()
+
+# Try to import sentence transformers for embeddings (not needed by onnx or service)
+if EMBEDDING_BACKEND in ("onnx", "service"):
     EMBEDDINGS_AVAILABLE = False
-    print("⚠️ sentence-transformers not available. Install with: pip install sentence-transformers")
+else:
+    try:
+        from sentence_transformers import SentenceTransformer
+        EMBEDDINGS_AVAILABLE = True
+    except ImportError:
+        EMBEDDINGS_AVAILABLE = False
+        print("⚠️ sentence-transformers not available. Install with: pip install sentence-transformers")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
 
 class PathwayRAG:
     """Hybrid RAG system with semantic + keyword search"""
     
-    def __init__(self):
-        self.index = {}  # {task_id: {doc_id: {chunks: [], metadata: {}}}}
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
+        global EMBEDDINGS_AVAILABLE
+        self.tasks: "OrderedDict[str, TaskIndex]" = OrderedDict()  # resident, least recently used first
+        self._tasks_lock = threading.RLock()
+        self._task_bytes = {}  # {task_id: approximate resident bytes}
+        
+        # Memory budget: least recently used task indexes are written to cold_dir
+        # and reloaded on their next use. Pinned tasks are never evicted.
+        self.memory_budget = int(float(os.getenv("RAG_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024)  # 0 = unbounded
+        # Each process (uvicorn worker) spills to its own subdirectory: its indexes are its own
+        self.cold_root = os.getenv("RAG_COLD_DIR", "./pathway_index/cold")
+        self.cold_dir = os.path.join(self.cold_root, str(os.getpid()))
+        self.pinned = set()
+        self.evictions = 0
+        self.reloads = 0
+        self._cold = set()
+        self._unloadable = {}  # {task_id: error} cold indexes that failed to reload, until rebuilt
+        self._clear_cold_dirs()
+        self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-compact")
+        self.search_threads = int(os.getenv("RAG_SEARCH_THREADS", str(min(8, os.cpu_count() or 4))))
+        self._shard_pool = ThreadPoolExecutor(max_workers=self.search_threads, thread_name_prefix="rag-shard")
         self.embedding_model = None
+        self.embedding_model_name = None  # recorded in each index's params; None = keyword-only
+        self._rebuilds = {}  # {task_id: [write ops since its rebuild started]} (see begin_rebuild)
+        self.chunk_size = chunk_size or int(os.getenv("RAG_CHUNK_SIZE", "1000"))
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else int(os.getenv("RAG_CHUNK_OVERLAP", "200"))
+        self.dedupe = os.getenv("RAG_DEDUPE", "1") != "0"
+        self.dedupe_max_distance = int(os.getenv("RAG_DEDUPE_MAX_DISTANCE", "6"))
+        self.fusion = os.getenv("RAG_FUSION", "weighted").lower()  # weighted | rrf
+        self.candidates = int(os.getenv("RAG_CANDIDATES", "100"))   # per signal; 0 = score every chunk
         
-        if EMBEDDINGS_AVAILABLE:
+        if EMBEDDING_BACKEND == "service":
+            from services import embedding_service
+            self.embedding_model = embedding_service.connect()
+            EMBEDDINGS_AVAILABLE = self.embedding_model is not None
+            if EMBEDDINGS_AVAILABLE:
+                # What the service actually loaded (runtime, quantization), not this process's settings
+                self.embedding_model_name = self.embedding_model.model_id
+                print(f"✅ Using shared embedding service at {embedding_service.ADDRESS} ({self.embedding_model_name})")
+        elif EMBEDDING_BACKEND == "onnx":
+            try:
+                from services import onnx_embedder
+                self.embedding_model = onnx_embedder.load()
+                EMBEDDINGS_AVAILABLE = True
+                self.embedding_model_name = self.embedding_model.model_id
+                print(f"✅ Loaded ONNX embedding model ({'int8' if self.embedding_model.quantized else 'fp32'})")
+            except Exception as e:
+                print(f"⚠️ Failed to load ONNX embedding model: {e}")
+        elif EMBEDDINGS_AVAILABLE:
             try:
                 self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+                self.embedding_model_name = 'all-MiniLM-L6-v2'
                 print("✅ Loaded embedding model: all-MiniLM-L6-v2")
             except Exception as e:
                 print(f"⚠️ Failed to load embedding model: {e}")
                 EMBEDDINGS_AVAILABLE = False
     
-    def _generate_embedding(self, text: str) -> List[float]:
+    def _generate_embedding(self, text: str) -> Optional[np.ndarray]:
         """Generate semantic embedding for text"""
         if not self.embedding_model or not EMBEDDINGS_AVAILABLE:
-            return []
+            return None
         
         try:
-            embedding = self.embedding_model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            with usage.measure("embedding", items=1, bytes_in=len(text)):
+                return self.embedding_model.encode(text, convert_to_numpy=True)
         except Exception as e:
             print(f"⚠️ Embedding generation failed: {e}")
-            return []
+            return None
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Compute cosine similarity between two vectors"""
-        if not vec1 or not vec2:
-            return 0.0
+    def _generate_embeddings(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Generate embeddings for many texts in one batched model call"""
+        if not texts or not self.embedding_model or not EMBEDDINGS_AVAILABLE:
+            return None
         
         try:
-            vec1_np = np.array(vec1)
-            vec2_np = np.array(vec2)
-            
-            dot_product = np.dot(vec1_np, vec2_np)
-            norm1 = np.linalg.norm(vec1_np)
-            norm2 = np.linalg.norm(vec2_np)
-            
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
-            
-            return float(dot_product / (norm1 * norm2))
+            with usage.measure("embedding", items=len(texts), bytes_in=sum(len(t) for t in texts)):
+                return self.embedding_model.encode(texts, convert_to_numpy=True, batch_size=32)
         except Exception as e:
-            print(f"⚠️ Similarity computation failed: {e}")
-            return 0.0
+            print(f"⚠️ Batch embedding failed: {e}")
+            return None
     
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks"""
-        if not text:
-            return []
+    def embedding_stats(self) -> Dict[str, Any]:
+        """Batching and queue stats of the shared service, or a summary of the in-process model"""
+        model = self.embedding_model
+        if model is not None and hasattr(model, "stats"):
+            try:
+                return {"backend": "service", **model.stats()}
+            except Exception as e:
+                return {"backend": "service", "error": str(e)}
+        return {"backend": "local", "model": type(model).__name__ if model is not None else None}
+    
+    def index_params(self) -> Dict[str, Any]:
+        """What an index's rows depend on; an index built with different params is stale"""
+        return {
+            "embedding_model": self.embedding_model_name if EMBEDDINGS_AVAILABLE else None,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "dedupe": self.dedupe,
+            "dedupe_max_distance": self.dedupe_max_distance if self.dedupe else None,
+        }
+    
+    def _chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+        """Split text into section-aware overlapping chunks"""
+        chunk_size = chunk_size or self.chunk_size
+        overlap = self.chunk_overlap if overlap is None else overlap
+        return [text[start:end] for start, end, _ in iter_chunk_spans(text, chunk_size, overlap)]
+    
+    # ----------------------
+    # Hot/cold tiering
+    # ----------------------
+    def _cold_path(self, task_id: str) -> str:
+        return os.path.join(self.cold_dir, quote(task_id, safe="") + ".npz")
+    
+    def _clear_cold_dirs(self):
+        """Drop this process's leftover cold dir (a reused pid) and those of processes that are gone"""
+        if not os.path.isdir(self.cold_root):
+            return
+        for name in os.listdir(self.cold_root):
+            path = os.path.join(self.cold_root, name)
+            if not name.isdigit() or not os.path.isdir(path):
+                continue
+            if int(name) != os.getpid() and _pid_alive(int(name)):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+    
+    def _task(self, task_id: str, create: bool = False) -> Optional[TaskIndex]:
+        """Resident index for a task, reloading it from the cold tier if it was evicted"""
+        with self._tasks_lock:
+            index = self.tasks.get(task_id)
+            if index is not None:
+                self.tasks.move_to_end(task_id)
+                return index
+            if task_id in self._cold:
+                index = self._reload(task_id)
+            if index is None and create:
+                # An empty index would silently stand in for the lost one; only a rebuild may replace it
+                if task_id in self._unloadable and task_id not in self._rebuilds:
+                    raise RuntimeError(
+                        f"Index for task {task_id} could not be reloaded ({self._unloadable[task_id]}); "
+                        "rebuild it with POST /rag/reindex"
+                    )
+                index = self.tasks[task_id] = TaskIndex()
+                index.params = self.index_params()
+                self._task_bytes[task_id] = 0
+            if index is None:
+                return None
+        self._enforce_budget(keep=task_id)
+        return index
+    
+    def _reload(self, task_id: str) -> Optional[TaskIndex]:
+        """Move a cold index back into memory (caller holds _tasks_lock)"""
+        path = self._cold_path(task_id)
+        self._cold.discard(task_id)
+        try:
+            index = TaskIndex.load(path)
+        except Exception as e:
+            # Kept aside for inspection; the task reads as missing until the re-indexer rebuilds it
+            self._unloadable[task_id] = str(e)
+            if os.path.exists(path):
+                os.replace(path, path + ".failed")
+            print(f"⚠️ Could not reload cold index for task {task_id}: {e}")
+            return None
+        # The resident copy is authoritative from here on
+        os.remove(path)
+        self.tasks[task_id] = index
+        self._task_bytes[task_id] = index.nbytes()
+        self.reloads += 1
+        return index
+    
+    def _peek(self, task_id: str) -> Optional[TaskIndex]:
+        """Resident index, or a transient read-only load of a cold one (not made resident)"""
+        with self._tasks_lock:
+            index = self.tasks.get(task_id)
+            if index is not None or task_id not in self._cold:
+                return index
+        try:
+            return TaskIndex.load(self._cold_path(task_id))
+        except FileNotFoundError:
+            # Reloaded meanwhile
+            with self._tasks_lock:
+                return self.tasks.get(task_id)
+    
+    def _enforce_budget(self, keep: str = None):
+        """Evict least recently used, unpinned, idle task indexes until under budget"""
+        if not self.memory_budget:
+            return
+        with self._tasks_lock:
+            total = sum(self._task_bytes.values())
+            for task_id in list(self.tasks):
+                if total <= self.memory_budget:
+                    break
+                if task_id == keep or task_id in self.pinned:
+                    continue
+                index = self.tasks[task_id]
+                # Skip indexes being written; they are evicted on a later pass
+                if not index.write_lock.acquire(blocking=False):
+                    continue
+                try:
+                    os.makedirs(self.cold_dir, exist_ok=True)
+                    index.save(self._cold_path(task_id))
+                    del self.tasks[task_id]
+                    self._cold.add(task_id)
+                    total -= self._task_bytes.pop(task_id, 0)
+                    self.evictions += 1
+                except Exception as e:
+                    print(f"⚠️ Could not evict index for task {task_id}: {e}")
+                finally:
+                    index.write_lock.release()
+    
+    def _update_bytes(self, task_id: str, index: TaskIndex):
+        with self._tasks_lock:
+            if self.tasks.get(task_id) is index:
+                self._task_bytes[task_id] = index.nbytes()
+    
+    @contextmanager
+    def _writable(self, task_id: str, create: bool = False):
+        """Yield the task's index with its write lock held, retrying if it was evicted while we waited"""
+        while True:
+            index = self._task(task_id, create)
+            if index is None:
+                yield None
+                return
+            with index.write_lock:
+                if self.tasks.get(task_id) is index:
+                    yield index
+                    return
+    
+    def pin(self, task_id: str):
+        """Keep a task resident regardless of the memory budget (reloading it if cold)"""
+        with self._tasks_lock:
+            self.pinned.add(task_id)
+        self._task(task_id)
+    
+    def unpin(self, task_id: str):
+        with self._tasks_lock:
+            self.pinned.discard(task_id)
+        self._enforce_budget()
+    
+    def memory_stats(self) -> Dict[str, Any]:
+        """Resident tasks (most recently used first), bytes per task, evictions and reloads"""
+        with self._tasks_lock:
+            resident = [
+                {"task_id": task_id, "bytes": self._task_bytes.get(task_id, 0), "pinned": task_id in self.pinned}
+                for task_id in reversed(self.tasks)
+            ]
+            return {
+                "budget_bytes": self.memory_budget,
+                "resident_bytes": sum(t["bytes"] for t in resident),
+                "resident_tasks": len(resident),
+                "cold_tasks": len(self._cold),
+                "pinned": sorted(self.pinned),
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "unloadable": sorted(self._unloadable),
+                "tasks": resident,
+            }
+    
+    def _prepare(self, markdown: str, extraction_json: dict, metadata: dict):
+        """Chunk rows (with page ranges) and structured fields for one document"""
+        metadata = dict(metadata or {})
+        page_offsets = metadata.pop("page_offsets", None)
+
+        # Chunk the markdown into (start, end, section_path) spans
+        markdown = markdown or ""
+        spans = list(iter_chunk_spans(markdown, self.chunk_size, self.chunk_overlap))
+        offsets = page_offsets_index(page_offsets)
+        rows = []
+        for idx, (start, end, section_path) in enumerate(spans):
+            page_start, page_end = page_range(start, end, page_offsets, offsets)
+            rows.append({
+                "text": markdown[start:end],
+                "chunk_index": idx,
+                "start": start,
+                "end": end,
+                "section_path": list(section_path),
+                "page_start": page_start,
+                "page_end": page_end
+            })
+        
+        # Keep structured extraction fields alongside the document
+        structured = [
+            {"text": f"{key}: {value}", "field": key, "value": value}
+            for key, value in (extraction_json or {}).items()
+            if value
+        ]
+        return rows, structured, metadata
+    
+    def _add(self, index: TaskIndex, doc_id: str, rows: List[Dict[str, Any]], structured: list, metadata: dict) -> int:
+        """Replace doc_id's rows in index (caller holds its write lock). Returns rows stored."""
+        # Drop a previous version first so it cannot absorb its own replacement as duplicates
+        index.remove_document(doc_id)
+        
+        # Near-duplicates of stored chunks are not embedded or stored again
+        plan = index.plan_duplicates(rows, self.dedupe_max_distance) if self.dedupe else None
+        unique_rows = [r for r, target in zip(rows, plan or [None] * len(rows)) if target is None]
         
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            
-            # Try to break at sentence boundary
-            if end < len(text):
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > chunk_size * 0.5:  # Only break if we're past halfway
-                    chunk = chunk[:break_point + 1]
-                    end = start + break_point + 1
-            
-            chunks.append(chunk.strip())
-            start = end - overlap
-        
-        return [c for c in chunks if c]  # Remove empty chunks
+        # Generate embeddings for all new chunks in one batch
+        embeddings = self._generate_embeddings([r["text"] for r in unique_rows])
+        index.add_document(doc_id, rows, embeddings, metadata, structured, duplicate_of=plan)
+        self._reembed_stale(index)
+        return len(unique_rows)
+    
+    def _remove(self, index: TaskIndex, doc_id: str) -> int:
+        """Remove doc_id's rows from index (caller holds its write lock). Returns rows tombstoned."""
+        removed = index.remove_document(doc_id)
+        self._reembed_stale(index)
+        return removed
+    
+    def _reembed_stale(self, index: TaskIndex):
+        """Embed rows that took over a near-duplicate's text when their original document was removed"""
+        if not index.stale_vectors:
+            return
+        with index.lock:
+            row_ids = sorted(index.stale_vectors)
+            texts = [index.rows[r]["text"] if index.rows[r] is not None else "" for r in row_ids]
+        embeddings = self._generate_embeddings(texts)
+        if embeddings is not None:
+            index.update_vectors(row_ids, embeddings)
+    
+    def _log_write(self, task_id: str, op: tuple):
+        """Remember a write made while the task is being rebuilt; swap_index replays it"""
+        with self._tasks_lock:
+            log = self._rebuilds.get(task_id)
+            if log is not None:
+                log.append(op)
     
     def index_document(self, task_id: str, doc_id: str, markdown: str, extraction_json: dict, metadata: dict):
         """
@@ -98,102 +381,244 @@ class PathwayRAG:
         - Chunks markdown into searchable pieces
         - Generates embeddings for semantic search
         - Stores structured extraction data
+        - Stores near-duplicate chunks once, recording every location
+        Re-indexing an existing doc_id replaces its previous rows.
+        metadata["page_offsets"] (the parser's offset → page table) becomes
+        per-chunk page_start/page_end and is not stored with the document.
         """
-        if task_id not in self.index:
-            self.index[task_id] = {}
-        
-        # Chunk the markdown
-        chunks = self._chunk_text(markdown)
-        
-        # Generate embeddings for each chunk
-        chunk_data = []
-        for idx, chunk in enumerate(chunks):
-            embedding = self._generate_embedding(chunk) if EMBEDDINGS_AVAILABLE else []
-            chunk_data.append({
-                "text": chunk,
-                "embedding": embedding,
-                "chunk_index": idx
-            })
+        rows, structured, stored_metadata = self._prepare(markdown, extraction_json, metadata)
         
-        # Also embed structured extraction keys
-        structured_chunks = []
-        for key, value in extraction_json.items():
-            if value:
-                text = f"{key}: {value}"
-                embedding = self._generate_embedding(text) if EMBEDDINGS_AVAILABLE else []
-                structured_chunks.append({
-                    "text": text,
-                    "embedding": embedding,
-                    "field": key,
-                    "value": value
-                })
-        
-        self.index[task_id][doc_id] = {
-            "chunks": chunk_data,
-            "structured": structured_chunks,
-            "metadata": metadata
-        }
+        with self._writable(task_id, create=True) as index:
+            bytes_before = index.nbytes()
+            unique = self._add(index, doc_id, rows, structured, stored_metadata)
+            usage.record("index", items=unique, bytes_in=len(markdown or ""),
+                         bytes_out=max(0, index.nbytes() - bytes_before))
+            self._log_write(task_id, ("index", doc_id, markdown, extraction_json, metadata))
         
-        print(f"✅ Indexed {len(chunk_data)} chunks + {len(structured_chunks)} structured fields for doc {doc_id}")
+        duplicates = len(rows) - unique
+        print(f"✅ Indexed {len(rows)} chunks ({duplicates} near-duplicates collapsed) + {len(structured)} structured fields for doc {doc_id}")
+        self._update_bytes(task_id, index)
+        self._enforce_budget(keep=task_id)
+        self._maybe_compact(task_id, index)
+    
+    def remove_document(self, task_id: str, doc_id: str) -> int:
+        """
+        Remove a document's rows from the task index.
+        Rows are tombstoned immediately; compaction runs in the background.
+        """
+        # While a rebuild runs there must be an index to lock, so the removal is logged for the swap
+        with self._writable(task_id, create=task_id in self._rebuilds) as index:
+            if index is None:
+                return 0
+            removed = self._remove(index, doc_id)
+            self._log_write(task_id, ("remove", doc_id))
+        print(f"🗑️ Removed {removed} chunks for doc {doc_id} (tombstones: {index.tombstones})")
+        self._update_bytes(task_id, index)
+        self._maybe_compact(task_id, index)
+        return removed
     
-    def search(self, task_id: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    # ----------------------
+    # Online rebuild (new model / chunking) with an atomic swap
+    # ----------------------
+    def index_info(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Params and document ids of the task's index (resident or cold), or None if it has none"""
+        with self._tasks_lock:
+            index = self.tasks.get(task_id)
+            if index is not None:
+                with index.lock:
+                    return {"params": dict(index.params), "doc_ids": list(index.documents), "resident": True}
+            if task_id not in self._cold:
+                return None
+        try:
+            return {**TaskIndex.read_header(self._cold_path(task_id)), "resident": False}
+        except FileNotFoundError:
+            return self.index_info(task_id)  # reloaded meanwhile
+    
+    def set_chunking(self, chunk_size: int = None, chunk_overlap: int = None):
+        """Change chunking for new writes; existing indexes become stale until rebuilt"""
+        if chunk_size:
+            self.chunk_size = chunk_size
+        if chunk_overlap is not None:
+            self.chunk_overlap = chunk_overlap
+    
+    def begin_rebuild(self, task_id: str):
+        """Start logging the task's writes; call before reading the documents to rebuild from"""
+        with self._tasks_lock:
+            self._rebuilds[task_id] = []
+    
+    def abort_rebuild(self, task_id: str):
+        with self._tasks_lock:
+            self._rebuilds.pop(task_id, None)
+    
+    def build_index(self, documents, progress=None) -> TaskIndex:
+        """
+        A fresh index from (doc_id, markdown, extraction_json, metadata) tuples with
+        the current params, built off to the side: searches keep using the live one.
+        progress(doc_id, rows, chars) is called after each document.
+        """
+        index = TaskIndex()
+        index.params = self.index_params()
+        with index.write_lock:
+            for doc_id, markdown, extraction_json, metadata in documents:
+                rows, structured, stored_metadata = self._prepare(markdown, extraction_json, metadata)
+                stored = self._add(index, doc_id, rows, structured, stored_metadata)
+                if progress is not None:
+                    progress(doc_id, stored, len(markdown or ""))
+        return index
+    
+    def swap_index(self, task_id: str, new_index: TaskIndex) -> int:
+        """
+        Replay writes made since begin_rebuild onto new_index and make it the task's
+        index in one step. Writers are held off by the live index's write lock while
+        this runs; searches already running finish on the old index, later ones see
+        the new one. Returns the number of writes replayed.
+        """
+        with self._writable(task_id, create=True) as old:
+            with self._tasks_lock:
+                log = self._rebuilds.pop(task_id, [])
+            with new_index.write_lock:
+                for op in log:
+                    if op[0] == "index":
+                        _, doc_id, markdown, extraction_json, metadata = op
+                        self._add(new_index, doc_id, *self._prepare(markdown, extraction_json, metadata))
+                    else:
+                        self._remove(new_index, op[1])
+            with self._tasks_lock:
+                self.tasks[task_id] = new_index
+                self.tasks.move_to_end(task_id)
+                self._task_bytes[task_id] = new_index.nbytes()
+                self._unloadable.pop(task_id, None)
+        print(f"♻️ Swapped in rebuilt index for task {task_id} ({new_index.live_rows} rows, {len(log)} writes replayed)")
+        # Chunk numbering, spans and vectors may all differ from what caches took from the old index
+        dataroom_events.notify_changed(task_id)
+        self._enforce_budget(keep=task_id)
+        self._maybe_compact(task_id, new_index)
+        return len(log)
+    
+    def _maybe_compact(self, task_id: str, index: TaskIndex):
+        if index.needs_compaction():
+            self._compactor.submit(self._compact, task_id)
+    
+    def _compact(self, task_id: str):
+        # Only resident indexes; an evicted one is compacted on its next write
+        with self._tasks_lock:
+            index = self.tasks.get(task_id)
+        if index is None:
+            return
+        try:
+            reclaimed = index.compact()
+            if reclaimed:
+                print(f"🧹 Compacted index for task {task_id}: reclaimed {reclaimed} rows")
+                self._update_bytes(task_id, index)
+        except Exception as e:
+            print(f"⚠️ Index compaction failed for task {task_id}: {e}")
+    
+    def _result(self, index: TaskIndex, row_id: int, score: float, semantic: float, keyword: float, score_type: str, with_vectors: bool = False) -> Dict[str, Any]:
+        row = index.rows[row_id]
+        metadata = index.documents.get(row["doc_id"], {}).get("metadata", {})
+        locations = [
+            {**{k: v for k, v in loc.items() if k != "text"},
+             "filename": index.documents.get(loc["doc_id"], {}).get("metadata", {}).get("filename", "unknown")}
+            for loc in row.get("locations", [])
+        ]
+        return {
+            "doc_id": row["doc_id"],
+            "text": row["text"],
+            "score": score,
+            "score_type": score_type,
+            "chunk_index": row["chunk_index"],
+            "section_path": row.get("section_path", []),
+            "start": row.get("start"),
+            "end": row.get("end"),
+            "page_start": row.get("page_start"),
+            "page_end": row.get("page_end"),
+            "filename": metadata.get("filename", "unknown"),
+            "semantic_score": semantic,
+            "keyword_score": keyword,
+            "locations": locations,
+            **({"embedding": index.vectors[row_id].copy() if index.has_embeddings else None} if with_vectors else {}),
+        }
+    
+    def _score_type(self, query_embedding: Optional[np.ndarray], index: TaskIndex) -> str:
+        if query_embedding is None or not index.has_embeddings:
+            return "keyword"
+        return "hybrid_rrf" if self.fusion == "rrf" else "hybrid"
+    
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Query embedding (None when running keyword-only), reusable across search calls"""
+        return self._generate_embedding(query) if EMBEDDINGS_AVAILABLE else None
+    
+    def search(self, task_id: str, query: str, top_k: int = 5, query_embedding: np.ndarray = None, with_vectors: bool = False) -> List[Dict[str, Any]]:
         """
         Hybrid search: semantic + keyword matching
-        Returns top_k most relevant chunks with scores
+        Returns top_k most relevant chunks with scores (and their unit
+        embeddings under "embedding" when with_vectors)
         """
-        if task_id not in self.index:
+        index = self._task(task_id)
+        if index is None:
             return []
         
-        query_embedding = self._generate_embedding(query) if EMBEDDINGS_AVAILABLE else []
-        query_lower = query.lower()
-        
-        all_results = []
-        
-        # Search across all documents in this task
-        for doc_id, doc_data in self.index[task_id].items():
-            # Search markdown chunks
-            for chunk_info in doc_data["chunks"]:
-                # Semantic score (if available)
-                semantic_score = 0.0
-                if query_embedding and chunk_info.get("embedding"):
-                    semantic_score = self._cosine_similarity(query_embedding, chunk_info["embedding"])
-                
-                # Keyword score (simple term overlap)
-                chunk_lower = chunk_info["text"].lower()
-                query_terms = set(query_lower.split())
-                chunk_terms = set(chunk_lower.split())
-                common_terms = query_terms.intersection(chunk_terms)
-                keyword_score = len(common_terms) / max(len(query_terms), 1)
-                
-                # Hybrid score: 70% semantic, 30% keyword
-                if EMBEDDINGS_AVAILABLE and query_embedding:
-                    final_score = (semantic_score * 0.7) + (keyword_score * 0.3)
-                    score_type = "hybrid"
-                else:
-                    final_score = keyword_score
-                    score_type = "keyword"
-                
-                all_results.append({
-                    "doc_id": doc_id,
-                    "text": chunk_info["text"],
-                    "score": final_score,
-                    "score_type": score_type,
-                    "chunk_index": chunk_info["chunk_index"],
-                    "filename": doc_data["metadata"].get("filename", "unknown"),
-                    "semantic_score": semantic_score,
-                    "keyword_score": keyword_score
-                })
-        
-        # Sort by score and return top_k
-        all_results.sort(key=lambda x: x["score"], reverse=True)
-        return all_results[:top_k]
-    
-    def get_rag_context(self, task_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        score_type = self._score_type(query_embedding, index)
+        
+        with index.lock:
+            hits = index.search(tokenize(query), query_embedding, top_k, self.fusion, self.candidates)
+            return [self._result(index, *hit, score_type, with_vectors) for hit in hits]
+    
+    def search_global(self, query: str, task_ids: List[str] = None, top_k: int = 20) -> List[Dict[str, Any]]:
+        """
+        Search many task indexes (shards) at once.
+        The query is embedded once, shards are scanned in parallel on a thread pool,
+        and each shard's local top_k is merged into a global top_k.
+        """
+        # Cold shards are scanned from disk without being made resident
+        with self._tasks_lock:
+            known = list(self.tasks) + sorted(self._cold - set(self.tasks))
+            wanted = set(task_ids) if task_ids else None
+            shards = [tid for tid in known if wanted is None or tid in wanted]
+        if not shards:
+            return []
+        
+        query_embedding = self._generate_embedding(query) if EMBEDDINGS_AVAILABLE else None
+        query_terms = tokenize(query)
+        
+        def scan(batch):
+            results = []
+            for task_id in batch:
+                index = self._peek(task_id)
+                if index is None:
+                    continue
+                score_type = self._score_type(query_embedding, index)
+                with index.lock:
+                    for hit in index.search(query_terms, query_embedding, top_k, self.fusion, self.candidates):
+                        if hit[1] <= 0:
+                            continue
+                        result = self._result(index, *hit, score_type)
+                        result["task_id"] = task_id
+                        results.append(result)
+            return heapq.nlargest(top_k, results, key=lambda r: r["score"])
+        
+        # One unit of work per pool thread keeps scheduling overhead off small shards
+        workers = min(len(shards), self.search_threads)
+        batches = [shards[i::workers] for i in range(workers)]
+        per_batch = self._shard_pool.map(usage.bind(scan), batches)
+        return heapq.nlargest(top_k, (r for results in per_batch for r in results), key=lambda r: r["score"])
+    
+    def dedupe_stats(self, task_id: str) -> Dict[str, Any]:
+        """Near-duplicate collapse report for a task"""
+        index = self._task(task_id)
+        if index is None:
+            return {"unique_chunks": 0, "chunk_occurrences": 0, "duplicates_collapsed": 0, "dedupe_ratio": 0.0, "per_document": {}}
+        return index.dedupe_stats()
+    
+    def get_rag_context(self, task_id: str, query: str, top_k: int = 5, query_embedding: np.ndarray = None, with_vectors: bool = False) -> Dict[str, Any]:
         """
         Get RAG context for a query (wrapper for backward compatibility)
-        Returns: {context: str, sources: List[dict]}
+        Returns: {context: str, sources: List[dict]}; each source carries its
+        chunk text, and its embedding when with_vectors
         """
-        results = self.search(task_id, query, top_k)
+        results = self.search(task_id, query, top_k, query_embedding, with_vectors)
         
         if not results:
             return {"context": "", "sources": []}
@@ -204,10 +629,27 @@ class PathwayRAG:
         for idx, result in enumerate(results, 1):
             context_parts.append(f"[Source {idx}] {result['text']}")
             sources.append({
+                "doc_id": result["doc_id"],
                 "filename": result["filename"],
                 "chunk_index": result["chunk_index"],
+                "section": section_label(result.get("section_path")),
+                "char_span": [result.get("start"), result.get("end")],
+                "page": page_label(result.get("page_start"), result.get("page_end")),
                 "score": result["score"],
-                "score_type": result["score_type"]
+                "score_type": result["score_type"],
+                "text": result["text"],
+                "locations": [
+                    {
+                        "doc_id": loc["doc_id"],
+                        "filename": loc["filename"],
+                        "chunk_index": loc["chunk_index"],
+                        "section": section_label(loc.get("section_path")),
+                        "char_span": [loc.get("start"), loc.get("end")],
+                        "page": page_label(loc.get("page_start"), loc.get("page_end"))
+                    }
+                    for loc in result.get("locations", [])
+                ],
+                **({"embedding": result["embedding"]} if with_vectors else {}),
             })
         
         context = "\n\n".join(context_parts)
@@ -236,13 +678,67 @@ def index_document(task_id: str, doc_id: str, markdown: str, extraction_json: di
     instance.index_document(task_id, doc_id, markdown, extraction_json, metadata)
 
 
+def remove_document(task_id: str, doc_id: str) -> int:
+    """Remove a document from the index"""
+    instance = get_instance()
+    return instance.remove_document(task_id, doc_id)
+
+
 def search(task_id: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     """Search for relevant chunks"""
     instance = get_instance()
     return instance.search(task_id, query, top_k)
 
 
-def get_rag_context(task_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
+def dedupe_stats(task_id: str) -> Dict[str, Any]:
+    """Near-duplicate report for a task"""
+    instance = get_instance()
+    return instance.dedupe_stats(task_id)
+
+
+def search_global(query: str, task_ids: List[str] = None, top_k: int = 20) -> List[Dict[str, Any]]:
+    """Search across all (or the given) tasks"""
+    instance = get_instance()
+    return instance.search_global(query, task_ids, top_k)
+
+
+def get_rag_context(task_id: str, query: str, top_k: int = 5, query_embedding: np.ndarray = None, with_vectors: bool = False) -> Dict[str, Any]:
     """Get RAG context for query"""
     instance = get_instance()
-    return instance.get_rag_context(task_id, query, top_k)
+    return instance.get_rag_context(task_id, query, top_k, query_embedding, with_vectors)
+
+
+def embed_query(query: str) -> Optional[np.ndarray]:
+    """Query embedding, or None without an embedding backend"""
+    instance = get_instance()
+    return instance.embed_query(query)
+
+
+def index_params() -> Dict[str, Any]:
+    """Embedding model and chunking new index rows (and query embeddings) are built with"""
+    instance = get_instance()
+    return instance.index_params()
+
+
+def embedding_stats() -> Dict[str, Any]:
+    """Embedding backend stats"""
+    instance = get_instance()
+    return instance.embedding_stats()
+
+
+def pin(task_id: str):
+    """Keep a task's index resident"""
+    instance = get_instance()
+    instance.pin(task_id)
+
+
+def unpin(task_id: str):
+    """Let a task's index be evicted again"""
+    instance = get_instance()
+    instance.unpin(task_id)
+
+
+def memory_stats() -> Dict[str, Any]:
+    """Resident/cold task index stats"""
+    instance = get_instance()
+    return instance.memory_stats()
@@ -0,0 +1,412 @@
+"""
+Sampling Profiler
+Opt-in, low-overhead stack sampling for one chat pipeline, upload or search.
+While a profile runs, a single sampler thread reads the stacks of the threads
+working for it (sys._current_frames) every PROFILER_INTERVAL_MS and counts
+them as folded stacks - the "frame;frame;frame count" format read by
+flamegraph.pl, speedscope and inferno. Each sample is also tagged on-cpu or
+waiting from the thread's CPU clock, so CPU time and time blocked on ADE /
+OpenRouter / locks can be told apart.
+
+A job is profiled when:
+- the request carries X-Profile (equal to PROFILER_TOKEN when one is set),
+- an admin armed the next matching jobs (POST /profiles/arm), or
+- it is picked by PROFILER_SAMPLE_RATE.
+
+Hard limits keep it safe to leave on: at most PROFILER_MAX_CONCURRENT
+profiles at a time, PROFILER_MAX_PER_MINUTE starts, PROFILER_MAX_SECONDS
+per profile (sampling stops, the job carries on), a stack depth cap and the
+newest PROFILER_KEEP profiles kept on disk. Nothing samples when no profile
+is running. Work handed to a thread pool through usage.bind is followed into
+the pool thread.
+"""
+
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+ENABLED = os.getenv("PROFILER_ENABLED", "1") == "1"
+TOKEN = os.getenv("PROFILER_TOKEN")
+SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "30"))
+MAX_CONCURRENT = int(os.getenv("PROFILER_MAX_CONCURRENT", "1"))
+MAX_PER_MINUTE = int(os.getenv("PROFILER_MAX_PER_MINUTE", "4"))
+MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", "96"))
+KEEP = int(os.getenv("PROFILER_KEEP", "100"))
+ARM_TTL_S = 600
+MAX_ARMED = 10
+PROFILE_DIR = os.getenv("PROFILER_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "profiles"))
+
+ON_CPU = "on-cpu"
+WAITING = "waiting"
+_KEY_RE = re.compile(r"^[A-Za-z0-9._-]{1,80}$")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("profile", default=None)
+
+
+def _thread_cpu(ident: int) -> Optional[float]:
+    """CPU seconds used so far by another thread, where the platform exposes per-thread clocks"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _thread_label(name: str) -> str:
+    """scheduler-2 / rag-retrieval_0 → scheduler / rag-retrieval: one root per kind of thread"""
+    return re.sub(r"[-_]\d+$", "", name or "thread").replace(";", ",")
+
+
+class Profile:
+    def __init__(self, key: str, kind: str, trigger: str, task_id: str = None):
+        self.key = key
+        self.kind = kind
+        self.trigger = trigger
+        self.task_id = task_id
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.deadline = self.started + MAX_SECONDS
+        self.threads: Dict[int, List] = {}  # {ident: [label, attach count, last cpu seconds]}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.cpu_samples = 0
+        self.truncated = False
+        self.sampler_ms = 0.0
+
+    def meta(self) -> dict:
+        return {
+            "key": self.key,
+            "kind": self.kind,
+            "trigger": self.trigger,
+            "task_id": self.task_id,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "interval_ms": INTERVAL_MS,
+            "samples": self.samples,
+            "on_cpu_samples": self.cpu_samples,
+            "unique_stacks": len(self.stacks),
+            "truncated": self.truncated,
+            "sampler_ms": round(self.sampler_ms, 1),
+        }
+
+
+class Profiler:
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self._active: Dict[str, Profile] = {}
+        self._armed: List[dict] = []
+        self._starts: deque = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._sampler = None
+        self.started = 0
+        self.skipped = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # ----------------------
+    # Triggers
+    # ----------------------
+    def arm(self, count: int = 1, kind: str = None, task_id: str = None) -> dict:
+        """Profile the next `count` matching jobs (kind / task_id None match anything)"""
+        entry = {"count": max(1, min(count, MAX_ARMED)), "kind": kind, "task_id": task_id,
+                 "expires": time.time() + ARM_TTL_S}
+        with self._lock:
+            self._armed = [a for a in self._armed if a["expires"] > time.time()] + [entry]
+            del self._armed[:-MAX_ARMED]
+        return {"count": entry["count"], "kind": kind, "task_id": task_id, "expires_in_s": ARM_TTL_S}
+
+    def _take_arm(self, kind: str, task_id: str) -> bool:
+        now = time.time()
+        for entry in self._armed:
+            if entry["expires"] > now and entry["kind"] in (None, kind) and entry["task_id"] in (None, task_id):
+                entry["count"] -= 1
+                if entry["count"] <= 0:
+                    self._armed.remove(entry)
+                return True
+        return False
+
+    def _trigger(self, kind: str, task_id: str, requested: bool) -> Optional[str]:
+        if requested:
+            return "header"
+        if self._armed and self._take_arm(kind, task_id):
+            return "armed"
+        if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    # ----------------------
+    # Lifecycle
+    # ----------------------
+    def start(self, key: str, kind: str, task_id: str = None, requested: bool = False) -> Optional[Profile]:
+        """Begin a profile for key if a trigger fires and the limits allow it"""
+        if not ENABLED or not _KEY_RE.match(key or ""):
+            return None
+        with self._lock:
+            trigger = self._trigger(kind, task_id, requested)
+            if trigger is None:
+                return None
+            now = time.perf_counter()
+            while self._starts and now - self._starts[0] > 60:
+                self._starts.popleft()
+            if len(self._active) >= MAX_CONCURRENT or len(self._starts) >= MAX_PER_MINUTE or key in self._active:
+                self.skipped += 1
+                print(f"⚠️ Profile for {kind} {key} skipped: profiler at its limit")
+                return None
+            self._starts.append(now)
+            profile = self._active[key] = Profile(key, kind, trigger, task_id)
+            self.started += 1
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._sampler.start()
+            self._wake.notify()
+        print(f"⏱️ Profiling {kind} {key} ({trigger})")
+        return profile
+
+    def attach(self, profile: Profile):
+        ident = threading.get_ident()
+        with self._lock:
+            entry = profile.threads.get(ident)
+            if entry is None:
+                profile.threads[ident] = [_thread_label(threading.current_thread().name), 1, _thread_cpu(ident)]
+            else:
+                entry[1] += 1
+
+    def detach(self, profile: Profile):
+        ident = threading.get_ident()
+        with self._lock:
+            entry = profile.threads.get(ident)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del profile.threads[ident]
+
+    def stop(self, profile: Profile):
+        with self._lock:
+            self._active.pop(profile.key, None)
+            profile.threads.clear()
+        try:
+            self._save(profile)
+        except Exception as e:
+            print(f"⚠️ Could not save profile {profile.key}: {e}")
+
+    # ----------------------
+    # Sampling
+    # ----------------------
+    def _sample_loop(self):
+        interval = INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+            time.sleep(interval)
+            t0 = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                sampled = []
+                for profile in self._active.values():
+                    if profile.truncated:
+                        continue
+                    if t0 > profile.deadline:
+                        profile.truncated = True
+                        profile.threads.clear()
+                        print(f"⚠️ Profile {profile.key} stopped sampling after {MAX_SECONDS:g}s")
+                        continue
+                    for ident, entry in profile.threads.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            self._count(profile, ident, entry, frame, interval)
+                    sampled.append(profile)
+                # The sampler's own cost, charged to every profile it served
+                cost_ms = (time.perf_counter() - t0) * 1000
+                for profile in sampled:
+                    profile.sampler_ms += cost_ms
+            del frames
+
+    def _count(self, profile: Profile, ident: int, entry: List, frame, interval: float):
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        if frame is not None:
+            stack.append("[truncated]")
+        cpu = _thread_cpu(ident)
+        state = WAITING
+        if cpu is not None and entry[2] is not None and cpu - entry[2] >= interval * 0.5:
+            state = ON_CPU
+            profile.cpu_samples += 1
+        entry[2] = cpu
+        stack.extend([entry[0], state])
+        profile.stacks[";".join(reversed(stack))] += 1
+        profile.samples += 1
+
+    # ----------------------
+    # Storage
+    # ----------------------
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _save(self, profile: Profile):
+        with open(self._path(profile.key, "folded"), "w") as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        meta = profile.meta()
+        with open(self._path(profile.key, "json"), "w") as f:
+            json.dump(meta, f)
+        print(f"⏱️ Saved profile {profile.key}: {meta['samples']} samples "
+              f"({meta['on_cpu_samples']} on CPU) over {meta['duration_ms']:.0f}ms")
+        self._prune()
+
+    def _prune(self):
+        metas = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")),
+            key=os.path.getmtime,
+        )
+        for path in metas[:-KEEP] if KEEP > 0 else metas:
+            for ext in ("json", "folded"):
+                try:
+                    os.remove(path[:-len("json")] + ext)
+                except OSError:
+                    pass
+
+    def list(self, kind: str = None, task_id: str = None, limit: int = 50) -> List[dict]:
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (kind is None or meta.get("kind") == kind) and (task_id is None or meta.get("task_id") == task_id):
+                profiles.append(meta)
+        profiles.sort(key=lambda m: m.get("started_at", ""), reverse=True)
+        return profiles[:limit]
+
+    def folded(self, key: str, state: str = None) -> Optional[str]:
+        """Folded stacks for key; state=on-cpu / waiting keeps only those samples"""
+        if not _KEY_RE.match(key or ""):
+            return None
+        try:
+            with open(self._path(key, "folded")) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        if state:
+            lines = [line for line in lines if line.split(";", 1)[0] == state]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def meta(self, key: str) -> Optional[dict]:
+        if not _KEY_RE.match(key or ""):
+            return None
+        try:
+            with open(self._path(key, "json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": ENABLED,
+                "sample_rate": SAMPLE_RATE,
+                "interval_ms": INTERVAL_MS,
+                "max_seconds": MAX_SECONDS,
+                "max_concurrent": MAX_CONCURRENT,
+                "max_per_minute": MAX_PER_MINUTE,
+                "started": self.started,
+                "skipped": self.skipped,
+                "active": [p.meta() for p in self._active.values()],
+                "armed": [{k: v for k, v in a.items() if k != "expires"} for a in self._armed],
+            }
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler()
+    return _profiler
+
+
+# ----------------------
+# Hooks for routes and pools
+# ----------------------
+def requested(header_value: Optional[str]) -> bool:
+    """Whether an X-Profile header asks for a profile (it must equal PROFILER_TOKEN when one is set)"""
+    if not header_value:
+        return False
+    if TOKEN:
+        return header_value == TOKEN
+    return header_value.lower() in ("1", "true", "yes")
+
+
+def authorized(token_header: Optional[str]) -> bool:
+    """Admin endpoints need X-Profile-Token when PROFILER_TOKEN is set"""
+    return not TOKEN or token_header == TOKEN
+
+
+@contextmanager
+def profiling(key: str, kind: str, task_id: str = None, requested: bool = False):
+    """Profile the block (and pool work bound from it) when a trigger fires; yields the Profile or None"""
+    profile = get_profiler().start(key, kind, task_id, requested)
+    if profile is None:
+        yield None
+        return
+    token = _current.set(profile)
+    get_profiler().attach(profile)
+    try:
+        yield profile
+    finally:
+        get_profiler().detach(profile)
+        _current.reset(token)
+        get_profiler().stop(profile)
+
+
+def job(fn: Callable, key: str, kind: str, task_id: str = None, requested: bool = False) -> Callable:
+    """Wrap a scheduler job so it runs under profiling(...)"""
+    def run(*args, **kwargs):
+        with profiling(key, kind, task_id, requested):
+            return fn(*args, **kwargs)
+    return run
+
+
+@contextmanager
+def attached():
+    """Sample the current thread for the caller's profile (if any) while the block runs"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    get_profiler().attach(profile)
+    try:
+        yield
+    finally:
+        get_profiler().detach(profile)
+
+
+def arm(count: int = 1, kind: str = None, task_id: str = None) -> dict:
+    return get_profiler().arm(count, kind, task_id)
+
+
+def stats() -> dict:
+    return get_profiler().stats()
@@ -0,0 +1,337 @@
+"""
+Query Decomposition
+Turns a user question into 3-5 retrieval sub-questions, either with the LLM,
+with local templates for the common due-diligence question families, or
+from a persistent LRU cache of earlier LLM decompositions.
+
+DECOMPOSER_MODE:
+  llm        cache, then LLM (default)
+  heuristic  templates only; the question itself when no family matches
+  auto       cache, then templates (the LLM refines the cache in the
+             background), then LLM bounded by DECOMPOSER_LLM_TIMEOUT
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Optional, Tuple
+
+from services import gemini_client
+from services import usage
+
+DECOMPOSER_MODE = os.getenv("DECOMPOSER_MODE", "llm").lower()
+DECOMPOSER_LLM_TIMEOUT = float(os.getenv("DECOMPOSER_LLM_TIMEOUT", "8"))
+CACHE_SIZE = int(os.getenv("DECOMPOSITION_CACHE_SIZE", "512"))
+CACHE_PATH = os.getenv(
+    "DECOMPOSITION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "decomposition_cache.json"),
+)
+# New entries are written out in the background, batched over this many seconds
+CACHE_SAVE_DELAY_S = float(os.getenv("DECOMPOSITION_CACHE_SAVE_DELAY_S", "2"))
+MAX_SUB_QUERIES = 5
+
+_PUNCT_RE = re.compile(r"[^\w\s%$&/-]")
+
+
+def normalize_question(question: str) -> str:
+    """Cache key: case, punctuation and whitespace-insensitive"""
+    return " ".join(_PUNCT_RE.sub(" ", question.lower()).split())
+
+
+# ----------------------
+# Persistent LRU cache
+# ----------------------
+class DecompositionCache:
+    """
+    In-memory LRU, saved off the request path: put() schedules a debounced
+    background save that merges with whatever other workers wrote to the file.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, capacity: int = CACHE_SIZE, save_delay_s: float = CACHE_SAVE_DELAY_S):
+        self.path = path
+        self.capacity = capacity
+        self.save_delay_s = save_delay_s
+        self.entries: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one save at a time in this process
+        self._save_timer: Optional[threading.Timer] = None
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def _read_file(self) -> list:
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return json.load(f).get("entries", [])
+
+    def _load(self):
+        self.loaded = True
+        try:
+            for key, sub_queries in self._read_file()[-self.capacity:]:
+                self.entries[key] = sub_queries
+            if self.entries:
+                print(f"✅ Loaded {len(self.entries)} cached query decompositions")
+        except Exception as e:
+            print(f"⚠️ Could not load decomposition cache {self.path}: {e}")
+
+    def _schedule_save(self):
+        """Caller holds self.lock"""
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay_s, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """
+        Write the cache out now: merged with the file's current entries (other
+        workers' saves) under an exclusive file lock, through a private temp file.
+        """
+        with self.lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            ours = list(self.entries.items())
+        if not self.path or not ours:
+            return
+        with self._save_lock:
+            try:
+                directory = os.path.dirname(self.path) or "."
+                os.makedirs(directory, exist_ok=True)
+                with open(f"{self.path}.lock", "w") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        merged = OrderedDict(self._read_file())
+                    except ValueError:
+                        merged = OrderedDict()  # unreadable file: ours replace it
+                    for key, sub_queries in ours:  # ours are the more recently used
+                        merged.pop(key, None)
+                        merged[key] = sub_queries
+                    entries = list(merged.items())[-self.capacity:]
+                    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".decomposition_cache.", suffix=".tmp")
+                    try:
+                        with os.fdopen(fd, "w") as f:
+                            json.dump({"version": 1, "entries": entries}, f)
+                        os.replace(tmp_path, self.path)
+                    except BaseException:
+                        os.remove(tmp_path)
+                        raise
+            except Exception as e:
+                print(f"⚠️ Could not save decomposition cache: {e}")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            sub_queries = self.entries.get(key)
+            if sub_queries is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(sub_queries)
+
+    def put(self, key: str, sub_queries: List[str]):
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            self.entries[key] = list(sub_queries)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            self._schedule_save()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+cache = DecompositionCache()
+# Entries put within the last save delay would otherwise be lost on shutdown
+atexit.register(cache.flush)
+
+
+# ----------------------
+# Template decomposer
+# ----------------------
+# family -> (trigger phrases, sub-questions in priority order)
+QUESTION_FAMILIES = {
+    "leverage": (
+        ["leverage", "debt", "borrow", "loan", "credit facility", "covenant", "debt-to-equity", "d/e", "indebtedness", "interest expense"],
+        [
+            "What is the total debt and the debt-to-equity ratio?",
+            "How has leverage changed across the reported periods?",
+            "What covenants or restrictions apply to the credit facilities?",
+            "When do the major debt obligations mature and at what interest rates?",
+        ],
+    ),
+    "liquidity": (
+        ["liquidity", "cash", "working capital", "runway", "burn", "current ratio", "solvency", "going concern"],
+        [
+            "What is the cash position and operating cash flow?",
+            "What is the working capital position?",
+            "What credit lines or other liquidity sources are available?",
+            "Are there going concern or liquidity risk disclosures?",
+        ],
+    ),
+    "profitability": (
+        ["profit", "margin", "ebitda", "earnings", "net income", "operating income", "gross profit", "profitability", "revenue", "growth"],
+        [
+            "What are revenue and revenue growth for the reported periods?",
+            "What are the gross, EBITDA and net margins?",
+            "How have margins trended across periods?",
+            "What are the main drivers of profitability changes?",
+        ],
+    ),
+    "risk_factors": (
+        ["risk", "litigation", "lawsuit", "regulatory", "compliance", "concentration", "exposure", "red flag", "contingenc"],
+        [
+            "What are the key risk factors disclosed?",
+            "Is there pending litigation or regulatory action?",
+            "Is there significant customer or supplier concentration?",
+            "What contingent liabilities or off-balance-sheet obligations exist?",
+        ],
+    ),
+    "change_of_control": (
+        ["change of control", "change-of-control", "assignment", "anti-assignment", "consent", "acquisition", "merger", "termination right"],
+        [
+            "Which contracts contain change of control provisions?",
+            "Which agreements restrict assignment or require counterparty consent?",
+            "What termination rights or payments are triggered by an acquisition?",
+            "Are there key customer or supplier contracts affected by a change of control?",
+        ],
+    ),
+}
+
+
+def heuristic_decompose(question: str) -> Optional[List[str]]:
+    """
+    Template sub-questions for the question families the question mentions,
+    or None when it matches none of them.
+    """
+    text = question.lower()
+    scores = {
+        family: sum(text.count(trigger) for trigger in triggers)
+        for family, (triggers, _) in QUESTION_FAMILIES.items()
+    }
+    matched = sorted((f for f, s in scores.items() if s > 0), key=lambda f: -scores[f])
+    if not matched:
+        return None
+
+    # Interleave families so a multi-topic question covers each topic
+    templates = [QUESTION_FAMILIES[f][1] for f in matched[:3]]
+    per_family = max(1, (MAX_SUB_QUERIES if len(templates) > 1 else 4) // len(templates))
+    sub_queries = []
+    for rank in range(per_family):
+        for family_templates in templates:
+            if rank < len(family_templates) and len(sub_queries) < MAX_SUB_QUERIES:
+                sub_queries.append(family_templates[rank])
+    return sub_queries
+
+
+# ----------------------
+# LLM decomposer
+# ----------------------
+def llm_decompose(user_question: str) -> List[str]:
+    """Ask the LLM for sub-questions. Raises on failure or unusable output."""
+    prompt = f"""You are a financial analyst assistant. Break down this question into 3-5 specific sub-questions that would help answer it comprehensively for M&A due diligence.
+
+User Question: {user_question}
+
+Requirements:
+- Each sub-question should focus on a specific aspect (financial, operational, risk, etc.)
+- Sub-questions should be self-contained and specific
+- Return ONLY a JSON array of strings, nothing else
+- Example format: ["What is the revenue trend?", "What are the key risks?"]
+
+Sub-questions:"""
+
+    response = gemini_client.ask_gemini([{
+        "role": "user",
+        "content": prompt
+    }])
+
+    # Clean response and parse JSON
+    response_text = response.strip()
+    if response_text.startswith("```"):
+        # Remove code blocks if present
+        response_text = response_text.split("```")[1]
+        if response_text.startswith("json"):
+            response_text = response_text[4:]
+
+    sub_queries = json.loads(response_text)
+    if not isinstance(sub_queries, list):
+        raise ValueError("LLM decomposition is not a JSON array")
+    sub_queries = [str(q).strip() for q in sub_queries if str(q).strip()]
+    if not sub_queries:
+        raise ValueError("LLM decomposition is empty")
+    return sub_queries[:MAX_SUB_QUERIES]
+
+
+_refiner = ThreadPoolExecutor(max_workers=2, thread_name_prefix="decompose")
+_inflight = {}  # {cache key: Future} so concurrent askers share one LLM call
+_inflight_lock = threading.Lock()
+
+
+def _llm_cached(key: str, user_question: str) -> List[str]:
+    sub_queries = llm_decompose(user_question)
+    cache.put(key, sub_queries)
+    return sub_queries
+
+
+def _submit_llm(key: str, user_question: str):
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _refiner.submit(usage.bind(_llm_cached), key, user_question)
+            _inflight[key] = future
+            future.add_done_callback(lambda _: _inflight.pop(key, None))
+        return future
+
+
+# ----------------------
+# Entry point
+# ----------------------
+def decompose(user_question: str, mode: str = None) -> Tuple[List[str], str]:
+    """
+    Returns (sub_queries, source), source being one of
+    "cache", "heuristic", "llm" or "fallback" (the question itself).
+    """
+    mode = (mode or DECOMPOSER_MODE).lower()
+    key = normalize_question(user_question)
+
+    if mode == "heuristic":
+        templates = heuristic_decompose(user_question)
+        return (templates, "heuristic") if templates else ([user_question], "fallback")
+
+    cached = cache.get(key)
+    if cached:
+        return cached, "cache"
+
+    if mode == "auto":
+        templates = heuristic_decompose(user_question)
+        if templates:
+            # Answer now from templates; the LLM result serves the next asker
+            _submit_llm(key, user_question)
+            return templates, "heuristic"
+        try:
+            return _submit_llm(key, user_question).result(timeout=DECOMPOSER_LLM_TIMEOUT), "llm"
+        except FutureTimeout:
+            print(f"⚠️ Query decomposition exceeded {DECOMPOSER_LLM_TIMEOUT}s, using the question as-is")
+            return [user_question], "fallback"
+        except Exception as e:
+            print(f"⚠️ Query decomposition failed: {e}")
+            return [user_question], "fallback"
+
+    try:
+        return _llm_cached(key, user_question), "llm"
+    except Exception as e:
+        print(f"⚠️ Query decomposition failed: {e}")
+        return [user_question], "fallback"
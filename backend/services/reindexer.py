@@ -0,0 +1,252 @@
+"""
+Background Re-Indexer
+Rebuilds task (dataroom) RAG indexes from Document.markdown when they are
+missing (resident indexes do not survive a restart) or stale (built with a
+different embedding model or chunking than the running process uses, as
+recorded in each index's params).
+
+Each task is rebuilt off to the side on the scheduler's bulk class, several
+tasks in parallel, while searches keep using the old index; writes that land
+meanwhile are replayed and the new index is swapped in atomically
+(PathwayRAG.swap_index). One run at a time; progress and throughput are in
+status().
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services import pathway_rag, scheduler, usage
+
+CONCURRENCY = int(os.getenv("REINDEX_CONCURRENCY", "2"))  # tasks rebuilt at once (bulk scheduler slots)
+ON_STARTUP = os.getenv("REINDEX_ON_STARTUP", "1") == "1"
+MAX_ERRORS_REPORTED = 20
+
+
+def index_metadata(doc) -> dict:
+    """Per-document metadata stored with its index rows (page_offsets becomes per-chunk pages)"""
+    return {
+        "filename": doc.filename,
+        "doc_id": doc.id,
+        "file_path": doc.path,
+        "page_offsets": json.loads(doc.meta_json or "{}").get("page_offsets"),
+    }
+
+
+def _documents(session, task_id: str = None):
+    from sqlmodel import select
+    from models import Document
+
+    statement = select(Document).where(Document.markdown != None)  # noqa: E711
+    if task_id is not None:
+        statement = statement.where(Document.task_id == task_id)
+    return session.exec(statement).all()
+
+
+def stale_reason(rag, task_id: str, doc_ids: set) -> Optional[str]:
+    """Why the task's index needs a rebuild, or None if it is current"""
+    info = rag.index_info(task_id)
+    if info is None:
+        return "missing"
+    if info["params"] != rag.index_params():
+        changed = sorted(k for k in set(info["params"]) | set(rag.index_params())
+                         if info["params"].get(k) != rag.index_params().get(k))
+        return "params: " + ", ".join(changed)
+    if set(info["doc_ids"]) != doc_ids:
+        return "documents"
+    return None
+
+
+class ReindexRun:
+    def __init__(self, reason: str, tasks: Dict[str, str]):
+        self.reason = reason
+        self.tasks = tasks                # {task_id: why it is being rebuilt}
+        self.state = {t: "queued" for t in tasks}
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.elapsed_s = None
+        self.docs_total = 0
+        self.docs_done = 0
+        self.rows_done = 0
+        self.chars_done = 0
+        self.replayed = 0
+        self.task_ms: Dict[str, float] = {}
+        self.errors: List[Dict[str, str]] = []
+        self.lock = threading.Lock()
+
+    def status(self) -> dict:
+        with self.lock:
+            elapsed = self.elapsed_s if self.elapsed_s is not None else time.perf_counter() - self.started
+            docs_per_s = self.docs_done / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.docs_total - self.docs_done)
+            counts = {}
+            for state in self.state.values():
+                counts[state] = counts.get(state, 0) + 1
+            return {
+                "reason": self.reason,
+                "running": self.finished_at is None,
+                "started_at": self.started_at.isoformat(),
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "elapsed_s": round(elapsed, 2),
+                "tasks_total": len(self.tasks),
+                "tasks": counts,
+                "rebuilding": sorted(t for t, s in self.state.items() if s == "building"),
+                "docs_total": self.docs_total,
+                "docs_done": self.docs_done,
+                "progress": round(self.docs_done / self.docs_total, 4) if self.docs_total else 1.0,
+                "rows_indexed": self.rows_done,
+                "writes_replayed": self.replayed,
+                "docs_per_s": round(docs_per_s, 2),
+                "rows_per_s": round(self.rows_done / elapsed, 1) if elapsed > 0 else 0.0,
+                "mb_per_s": round(self.chars_done / elapsed / 1e6, 3) if elapsed > 0 else 0.0,
+                "eta_s": round(remaining / docs_per_s, 1) if docs_per_s > 0 and remaining else None,
+                "task_ms_max": round(max(self.task_ms.values()), 1) if self.task_ms else None,
+                "reasons": self.tasks if len(self.tasks) <= 50 else None,
+                "errors": self.errors[:MAX_ERRORS_REPORTED],
+            }
+
+
+class Reindexer:
+    def __init__(self, concurrency: int = CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.run: Optional[ReindexRun] = None
+        self._lock = threading.Lock()
+
+    def plan(self, task_ids: List[str] = None, force: bool = False) -> Dict[str, str]:
+        """{task_id: reason} for tasks whose index is missing or stale (every task with documents when force)"""
+        from database import engine
+        from sqlmodel import Session
+
+        rag = pathway_rag.get_instance()
+        docs_by_task: Dict[str, set] = {}
+        with Session(engine) as session:
+            for doc in _documents(session):
+                docs_by_task.setdefault(doc.task_id, set()).add(doc.id)
+        if task_ids is not None:
+            docs_by_task = {t: docs_by_task.get(t, set()) for t in task_ids}
+        plan = {}
+        for task_id, doc_ids in docs_by_task.items():
+            reason = "forced" if force else stale_reason(rag, task_id, doc_ids)
+            if reason is not None and (doc_ids or rag.index_info(task_id) is not None):
+                plan[task_id] = reason
+        return plan
+
+    def start(self, reason: str, task_ids: List[str] = None, force: bool = False) -> dict:
+        """Start a run over the stale (or all, when force) tasks unless one is already running"""
+        with self._lock:
+            if self.run is not None and self.run.finished_at is None:
+                return {**self.run.status(), "already_running": True}
+            run = self.run = ReindexRun(reason, self.plan(task_ids, force))
+        if run.tasks:
+            print(f"♻️ Re-indexing {len(run.tasks)} tasks ({reason})")
+            threading.Thread(target=self._drive, args=(run,), name="reindexer", daemon=True).start()
+        else:
+            self._finish(run)
+        return run.status()
+
+    def status(self) -> dict:
+        rag = pathway_rag.get_instance()
+        current = self.run.status() if self.run is not None else None
+        return {"index_params": rag.index_params(), "concurrency": self.concurrency, "run": current}
+
+    # ----------------------
+    # Driving the run
+    # ----------------------
+    def _drive(self, run: ReindexRun):
+        """Keep up to `concurrency` task rebuilds on the bulk scheduler, backing off while it is saturated"""
+        pending = list(run.tasks)
+        in_flight: List[Future] = []
+        while pending or in_flight:
+            in_flight = [f for f in in_flight if not f.done()]
+            while pending and len(in_flight) < self.concurrency:
+                task_id = pending[0]
+                try:
+                    in_flight.append(scheduler.submit(scheduler.BULK, task_id, self._rebuild, run, task_id))
+                    pending.pop(0)
+                except scheduler.Saturated as e:
+                    time.sleep(min(e.retry_after, 10))
+                    break
+            time.sleep(0.05)
+        self._finish(run)
+
+    def _finish(self, run: ReindexRun):
+        with run.lock:
+            run.elapsed_s = time.perf_counter() - run.started
+            run.finished_at = datetime.utcnow()
+        status = run.status()
+        if run.tasks:
+            print(f"✅ Re-indexed {status['tasks'].get('done', 0)}/{len(run.tasks)} tasks, "
+                  f"{run.docs_done} docs in {status['elapsed_s']}s ({status['docs_per_s']} docs/s)")
+
+    def _rebuild(self, run: ReindexRun, task_id: str):
+        from database import engine
+        from sqlmodel import Session
+
+        rag = pathway_rag.get_instance()
+        t0 = time.perf_counter()
+        with run.lock:
+            run.state[task_id] = "building"
+        # Log writes from here on, so nothing that lands after the snapshot below is lost
+        rag.begin_rebuild(task_id)
+        try:
+            with usage.scope(task_id):
+                usage.mark("reindex.build")
+                with Session(engine) as session:
+                    documents = [
+                        (doc.id, doc.markdown, json.loads(doc.extraction_json or "{}"), index_metadata(doc))
+                        for doc in _documents(session, task_id)
+                    ]
+                with run.lock:
+                    run.docs_total += len(documents)
+
+                def progress(doc_id, rows, chars):
+                    with run.lock:
+                        run.docs_done += 1
+                        run.rows_done += rows
+                        run.chars_done += chars
+
+                new_index = rag.build_index(documents, progress)
+                usage.mark("reindex.swap")
+                replayed = rag.swap_index(task_id, new_index)
+
+            # A document deleted between the snapshot and its index removal would linger
+            with Session(engine) as session:
+                current = {doc.id for doc in _documents(session, task_id)}
+            for doc_id in set(new_index.documents) - current:
+                rag.remove_document(task_id, doc_id)
+            with run.lock:
+                run.replayed += replayed
+                run.state[task_id] = "done"
+                run.task_ms[task_id] = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            rag.abort_rebuild(task_id)
+            print(f"⚠️ Re-index of task {task_id} failed (old index kept): {e}")
+            with run.lock:
+                run.state[task_id] = "failed"
+                run.errors.append({"task_id": task_id, "error": str(e)})
+
+
+_reindexer = None
+_reindexer_lock = threading.Lock()
+
+
+def get_reindexer() -> Reindexer:
+    global _reindexer
+    if _reindexer is None:
+        with _reindexer_lock:
+            if _reindexer is None:
+                _reindexer = Reindexer()
+    return _reindexer
+
+
+def start(reason: str, task_ids: List[str] = None, force: bool = False) -> dict:
+    return get_reindexer().start(reason, task_ids, force)
+
+
+def status() -> dict:
+    return get_reindexer().status()
@@ -0,0 +1,220 @@
+"""
+Background Work Scheduler
+Runs chat pipelines and document ingestion on a fixed pool of worker threads
+instead of unbounded BackgroundTasks / request-blocking calls.
+
+- Two priority classes: interactive (chat) is always dispatched before bulk
+  (ingestion), and bulk may occupy at most SCHEDULER_BULK_MAX_RUNNING workers,
+  so a large upload batch cannot take every worker from chat.
+- Per-task fairness: within a class, tasks (datarooms) take turns, so one
+  dataroom's 300-document ingest doesn't queue ahead of another's single upload.
+- Bounded queues: submit() raises Saturated (with a Retry-After estimate) when
+  the class queue or the task's share of it is full; routes answer 429.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+CLASSES = (INTERACTIVE, BULK)  # dispatch order
+
+WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+BULK_MAX_RUNNING = int(os.getenv("SCHEDULER_BULK_MAX_RUNNING", str(max(1, WORKERS - 1))))
+MAX_QUEUED = {
+    INTERACTIVE: int(os.getenv("SCHEDULER_MAX_QUEUED_INTERACTIVE", "64")),
+    BULK: int(os.getenv("SCHEDULER_MAX_QUEUED_BULK", "128")),
+}
+MAX_QUEUED_PER_TASK = {
+    INTERACTIVE: int(os.getenv("SCHEDULER_MAX_QUEUED_INTERACTIVE_PER_TASK", "16")),
+    BULK: int(os.getenv("SCHEDULER_MAX_QUEUED_BULK_PER_TASK", "32")),
+}
+MIN_RETRY_AFTER_S = 1
+MAX_RETRY_AFTER_S = 300
+
+
+class Saturated(Exception):
+    def __init__(self, work_class: str, reason: str, retry_after: int):
+        super().__init__(f"Server busy: {reason}. Retry in {retry_after}s.")
+        self.work_class = work_class
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("work_class", "task_id", "fn", "args", "kwargs", "future", "enqueued_at")
+
+    def __init__(self, work_class: str, task_id: str, fn: Callable, args, kwargs):
+        self.work_class = work_class
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class _ClassStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.wait_ms: Deque[float] = deque(maxlen=1000)
+        self.run_ms: Deque[float] = deque(maxlen=1000)
+
+
+def _pct(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 1) if ordered else 0.0
+
+
+class Scheduler:
+    def __init__(self, workers: int = WORKERS, bulk_max_running: int = BULK_MAX_RUNNING):
+        self.workers = workers
+        self.limits = {INTERACTIVE: workers, BULK: min(workers, bulk_max_running)}
+        # {class: {task_id: deque[_Job]}}; the OrderedDict order is the round-robin turn
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Job]]"] = {c: OrderedDict() for c in CLASSES}
+        self._queued = {c: 0 for c in CLASSES}
+        self._stats = {c: _ClassStats() for c in CLASSES}
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True).start()
+
+    # ----------------------
+    # Admission
+    # ----------------------
+    def _retry_after(self, work_class: str) -> int:
+        """Roughly how long until the backlog ahead of a new job drains"""
+        stats = self._stats[work_class]
+        run_s = (sum(stats.run_ms) / len(stats.run_ms) / 1000) if stats.run_ms else 5.0
+        backlog = self._queued[work_class] + (self._queued[INTERACTIVE] if work_class == BULK else 0)
+        seconds = backlog * run_s / max(1, self.limits[work_class])
+        return int(min(MAX_RETRY_AFTER_S, max(MIN_RETRY_AFTER_S, round(seconds))))
+
+    def submit(self, work_class: str, task_id: str, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs). Raises Saturated instead of queueing past the bounds."""
+        with self._cond:
+            stats = self._stats[work_class]
+            task_queue = self._queues[work_class].get(task_id)
+            reason = None
+            if self._queued[work_class] >= MAX_QUEUED[work_class]:
+                reason = f"{self._queued[work_class]} {work_class} jobs queued"
+            elif task_queue is not None and len(task_queue) >= MAX_QUEUED_PER_TASK[work_class]:
+                reason = f"{len(task_queue)} {work_class} jobs queued for this task"
+            if reason:
+                stats.rejected += 1
+                raise Saturated(work_class, reason, self._retry_after(work_class))
+
+            job = _Job(work_class, task_id, fn, args, kwargs)
+            if task_queue is None:
+                task_queue = self._queues[work_class][task_id] = deque()
+            task_queue.append(job)
+            self._queued[work_class] += 1
+            stats.admitted += 1
+            self._cond.notify()
+            return job.future
+
+    async def run(self, work_class: str, task_id: str, fn: Callable, *args, **kwargs) -> Any:
+        """submit() and await the result from async routes without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(work_class, task_id, fn, *args, **kwargs))
+
+    # ----------------------
+    # Dispatch
+    # ----------------------
+    def _next_job(self):
+        for work_class in CLASSES:
+            queues = self._queues[work_class]
+            if not queues or self._stats[work_class].running >= self.limits[work_class]:
+                continue
+            task_id, task_queue = next(iter(queues.items()))
+            job = task_queue.popleft()
+            del queues[task_id]
+            if task_queue:
+                queues[task_id] = task_queue  # back of the line for this task's next job
+            self._queued[work_class] -= 1
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                stats = self._stats[job.work_class]
+                stats.running += 1
+                stats.wait_ms.append((time.perf_counter() - job.enqueued_at) * 1000)
+
+            started = time.perf_counter()
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+
+            with self._cond:
+                stats.running -= 1
+                stats.run_ms.append((time.perf_counter() - started) * 1000)
+                if job.future.exception() is None:
+                    stats.completed += 1
+                else:
+                    stats.failed += 1
+                self._cond.notify()  # a class limit may have just freed up
+
+    # ----------------------
+    # Stats
+    # ----------------------
+    def stats(self) -> dict:
+        with self._cond:
+            classes = {}
+            for work_class in CLASSES:
+                s = self._stats[work_class]
+                classes[work_class] = {
+                    "queued": self._queued[work_class],
+                    "running": s.running,
+                    "max_running": self.limits[work_class],
+                    "max_queued": MAX_QUEUED[work_class],
+                    "max_queued_per_task": MAX_QUEUED_PER_TASK[work_class],
+                    "admitted": s.admitted,
+                    "rejected": s.rejected,
+                    "completed": s.completed,
+                    "failed": s.failed,
+                    "wait_ms_p50": _pct(s.wait_ms, 0.5),
+                    "wait_ms_p95": _pct(s.wait_ms, 0.95),
+                    "run_ms_p50": _pct(s.run_ms, 0.5),
+                    "queued_by_task": {t: len(q) for t, q in self._queues[work_class].items()},
+                    "retry_after_s": self._retry_after(work_class),
+                }
+            return {"workers": self.workers, "classes": classes}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+    return _scheduler
+
+
+def submit(work_class: str, task_id: str, fn: Callable, *args, **kwargs) -> Future:
+    return get_scheduler().submit(work_class, task_id, fn, *args, **kwargs)
+
+
+async def run(work_class: str, task_id: str, fn: Callable, *args, **kwargs) -> Any:
+    return await get_scheduler().run(work_class, task_id, fn, *args, **kwargs)
+
+
+def stats() -> dict:
+    return get_scheduler().stats()
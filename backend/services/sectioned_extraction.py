@@ -0,0 +1,306 @@
+"""
+Sectioned (Map-Reduce) Extraction
+Long documents are not sent to ADE /extract whole with all 39 fields. The
+markdown is split at its headings, each FIELD_CATEGORIES group is routed to
+the sections whose heading trail matches CATEGORY_SECTION_KEYWORDS (risk
+factors to the risk sections, financial metrics to the statements and MD&A),
+and the matched sections are packed into calls of at most
+EXTRACT_MAX_CALL_CHARS. The calls run concurrently and their partial results
+are merged per field, keeping the section each value came from.
+
+Documents shorter than EXTRACT_SECTIONED_MIN_CHARS, or EXTRACTION_MODE=single,
+use the original single call.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from services import landing_ai, usage
+from services.extraction_schema import (
+    CATEGORY_SECTION_KEYWORDS,
+    COVER_FIELDS,
+    FIELD_CATEGORIES,
+    subset_schema,
+)
+from services.markdown_chunker import page_label, page_offsets_index, page_range, section_label
+
+MODE = os.getenv("EXTRACTION_MODE", "sections").lower()  # sections | single
+MIN_SECTIONED_CHARS = int(os.getenv("EXTRACT_SECTIONED_MIN_CHARS", "120000"))
+MAX_CALL_CHARS = int(os.getenv("EXTRACT_MAX_CALL_CHARS", "40000"))
+EXTRACT_CONCURRENCY = int(os.getenv("LANDINGAI_EXTRACT_CONCURRENCY", "4"))
+COVER_CHARS = 6000     # head of the document, sent with COVER_FIELDS and categories no heading matched
+CALL_ATTEMPTS = 2      # one retry per section call
+CALL_SEPARATOR = "\n\n"
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_NORMALIZE_RE = re.compile(r"[\s$,]+")
+_extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_CONCURRENCY, thread_name_prefix="ade-extract")
+
+
+# ----------------------
+# Map: sections → calls
+# ----------------------
+def split_sections(markdown: str) -> List[Dict[str, Any]]:
+    """
+    Leaf sections as {"trail", "start", "end"}, split at every heading.
+    A document with a single H1 treats it as the title and leaves it out of the trails.
+    """
+    matches = list(_HEADING_RE.finditer(markdown))
+    title_only = sum(1 for m in matches if len(m.group(1)) == 1) == 1
+    sections = []
+    if not matches or matches[0].start() > 0:
+        sections.append({"trail": [], "start": 0, "end": matches[0].start() if matches else len(markdown)})
+
+    stack = []  # [(level, title)]
+    for i, match in enumerate(matches):
+        level = len(match.group(1))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, match.group(2).strip()))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        trail = [t for lvl, t in stack if not (title_only and lvl == 1)]
+        sections.append({"trail": trail, "start": match.start(), "end": end})
+    return [s for s in sections if markdown[s["start"]:s["end"]].strip()]
+
+
+def route(trail: Sequence[str]) -> List[str]:
+    """
+    Categories whose keywords appear in the section's own heading, or, when it
+    matches none, in the closest parent heading that does.
+    """
+    for heading in reversed(trail):
+        text = heading.lower()
+        categories = [c for c, keywords in CATEGORY_SECTION_KEYWORDS.items() if any(k in text for k in keywords)]
+        if categories:
+            return categories
+    return []
+
+
+def _pieces(markdown: str, section: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The section, or paragraph-aligned pieces of it when it exceeds MAX_CALL_CHARS"""
+    start, end = section["start"], section["end"]
+    pieces = []
+    while end - start > MAX_CALL_CHARS:
+        cut = markdown.rfind("\n\n", start + MAX_CALL_CHARS // 2, start + MAX_CALL_CHARS)
+        cut = cut if cut > start else start + MAX_CALL_CHARS
+        pieces.append(dict(section, start=start, end=cut))
+        start = cut
+    pieces.append(dict(section, start=start, end=end))
+    return pieces
+
+
+def _pack(markdown: str, sections: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Sections in document order, grouped into calls of at most MAX_CALL_CHARS"""
+    groups, current, size = [], [], 0
+    for section in sections:
+        for piece in _pieces(markdown, section):
+            length = piece["end"] - piece["start"] + len(CALL_SEPARATOR)
+            if current and size + length > MAX_CALL_CHARS:
+                groups.append(current)
+                current, size = [], 0
+            current.append(piece)
+            size += length
+    if current:
+        groups.append(current)
+    return groups
+
+
+def plan_calls(markdown: str, fields: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    [{"category", "fields", "sections"}] covering every requested field.
+    Sections matching the same set of categories are packed together and get
+    the union of their fields, so no section is sent twice.
+    """
+    fields = list(fields)
+    sections = split_sections(markdown)
+    routed: Dict[tuple, List[Dict[str, Any]]] = {}
+    for section in sections:
+        categories = tuple(route(section["trail"]))
+        if categories:
+            routed.setdefault(categories, []).append(section)
+    matched = {category for categories in routed for category in categories}
+
+    categorized = {f for category_fields in FIELD_CATEGORIES.values() for f in category_fields}
+    cover_fields = [f for f in COVER_FIELDS if f in fields] + [f for f in fields if f not in categorized]
+    for category, category_fields in FIELD_CATEGORIES.items():
+        if category not in matched:
+            # No heading looks relevant: the cover/summary is the best remaining bet
+            cover_fields += [f for f in category_fields if f in fields and f not in cover_fields]
+
+    calls = []
+    for categories, routed_sections in routed.items():
+        wanted = [f for category in categories for f in FIELD_CATEGORIES[category] if f in fields]
+        if not wanted:
+            continue
+        for group in _pack(markdown, routed_sections):
+            calls.append({"category": "+".join(categories), "fields": wanted, "sections": group})
+
+    if cover_fields:
+        first_trail = sections[0]["trail"] if sections else []
+        cover = {"trail": first_trail, "start": 0, "end": min(len(markdown), COVER_CHARS), "cover": True}
+        calls.append({"category": "cover", "fields": cover_fields, "sections": [cover]})
+    return calls
+
+
+# ----------------------
+# Calls
+# ----------------------
+def _call_text(markdown: str, sections: List[Dict[str, Any]]):
+    """Markdown sent for a call, plus (offset in that text, section) for mapping values back"""
+    parts, layout, offset = [], [], 0
+    for section in sections:
+        layout.append((offset, section))
+        part = markdown[section["start"]:section["end"]]
+        parts.append(part)
+        offset += len(part) + len(CALL_SEPARATOR)
+    return CALL_SEPARATOR.join(parts), layout
+
+
+def _run_call(markdown: str, call: Dict[str, Any], schema: dict) -> Dict[str, Any]:
+    """One extraction call for the call's fields, described as in the caller's schema"""
+    text, layout = _call_text(markdown, call["sections"])
+    schema = subset_schema(call["fields"], schema)
+    payload = landing_ai.extract_payload_bytes(text, schema)
+    result = {"call": call, "text": text, "layout": layout, "request_bytes": payload, "payload_bytes": 0, "extraction": {}, "error": None}
+    for attempt in range(CALL_ATTEMPTS):
+        result["payload_bytes"] += payload
+        try:
+            result["extraction"] = landing_ai.extract_from_markdown(text, schema).get("extraction") or {}
+            result["error"] = None
+            return result
+        except Exception as e:
+            result["error"] = str(e)
+    return result
+
+
+def _locate(value: Any, result: Dict[str, Any]):
+    """(section, [start, end] in the document, grounded) for a value returned by a call"""
+    pos = result["text"].find(str(value)) if isinstance(value, (str, int, float)) else -1
+    layout = result["layout"]
+    if pos < 0:
+        section = layout[0][1]
+        return section, [section["start"], layout[-1][1]["end"]], False
+    offset, section = next((o, s) for o, s in reversed(layout) if o <= pos)
+    start = section["start"] + pos - offset
+    return section, [start, start + len(str(value))], True
+
+
+# ----------------------
+# Reduce: merge partial results
+# ----------------------
+def _normalize(value: Any) -> str:
+    return _NORMALIZE_RE.sub("", str(value).lower()).rstrip(".")
+
+
+def merge(results: List[Dict[str, Any]], page_offsets=None):
+    """
+    Pick one value per field from the section calls.
+    Preference: found verbatim in the section text, then from a routed section
+    (rather than the cover fallback), then the value most calls agree on, then
+    the earliest call. Disagreeing values are kept as conflicts.
+    """
+    candidates: Dict[str, List[Dict[str, Any]]] = {}
+    for order, result in enumerate(results):
+        for field, value in result["extraction"].items():
+            if field not in result["call"]["fields"] or value in (None, "", [], {}):
+                continue
+            section, span, grounded = _locate(value, result)
+            candidates.setdefault(field, []).append({
+                "value": value,
+                "section": section_label(section["trail"]) or ("Cover page" if section.get("cover") else "Preamble"),
+                "category": result["call"]["category"],
+                "char_span": span,
+                "grounded": grounded,
+                "routed": result["call"]["category"] != "cover",
+                "order": order,
+            })
+
+    extraction, provenance, conflicts = {}, {}, {}
+    offsets = page_offsets_index(page_offsets)
+    for field, found in candidates.items():
+        votes = {}
+        for c in found:
+            votes[_normalize(c["value"])] = votes.get(_normalize(c["value"]), 0) + 1
+        best = max(found, key=lambda c: (c["grounded"], c["routed"], votes[_normalize(c["value"])], -c["order"]))
+        extraction[field] = best["value"]
+        provenance[field] = {k: best[k] for k in ("section", "category", "char_span", "grounded")}
+        if page_offsets:
+            provenance[field]["page"] = page_label(*page_range(*best["char_span"], page_offsets, offsets))
+        alternatives = {}
+        for c in found:
+            if _normalize(c["value"]) != _normalize(best["value"]):
+                alternatives.setdefault(_normalize(c["value"]), {"value": c["value"], "section": c["section"]})
+        if alternatives:
+            conflicts[field] = [{"value": best["value"], "section": best["section"], "chosen": True}] + list(alternatives.values())
+    return extraction, provenance, conflicts
+
+
+# ----------------------
+# Entry point
+# ----------------------
+def extract(markdown: str, schema: dict, page_offsets=None, mode: Optional[str] = None) -> dict:
+    """
+    Drop-in for landing_ai.extract_from_markdown() that returns the same
+    "extraction" plus "provenance" (field → section/char_span/page),
+    "conflicts" and "metadata" (calls, payload_bytes, latency_ms).
+    """
+    t0 = time.perf_counter()
+    markdown = markdown or ""
+    fields = list(schema.get("properties", {}))
+    mode = (mode or MODE).lower()
+    if mode != "sections" or len(markdown) < MIN_SECTIONED_CHARS:
+        response = landing_ai.extract_from_markdown(markdown, schema)
+        response["metadata"] = dict(
+            response.get("metadata") or {},
+            mode="single",
+            calls=1,
+            payload_bytes=landing_ai.extract_payload_bytes(markdown, schema),
+            latency_ms=round((time.perf_counter() - t0) * 1000, 1),
+        )
+        return response
+
+    calls = plan_calls(markdown, fields)
+    results = list(_extract_pool.map(usage.bind(lambda call: _run_call(markdown, call, schema)), calls))
+    extraction, provenance, conflicts = merge([r for r in results if r["error"] is None], page_offsets)
+    payload_bytes = sum(r["payload_bytes"] for r in results)
+    failed = [r for r in results if r["error"] is not None]
+
+    # Fields whose only calls failed get one whole-document call (raises like the single path)
+    fallback_fields = sorted({
+        f for r in failed for f in r["call"]["fields"]
+        if f not in extraction and not any(o["error"] is None and f in o["call"]["fields"] for o in results)
+    })
+    if fallback_fields:
+        print(f"⚠️ {len(failed)} section extraction call(s) failed; re-extracting {len(fallback_fields)} fields from the whole document")
+        fallback_schema = subset_schema(fallback_fields, schema)
+        payload_bytes += landing_ai.extract_payload_bytes(markdown, fallback_schema)
+        found = landing_ai.extract_from_markdown(markdown, fallback_schema).get("extraction") or {}
+        for field in fallback_fields:
+            if found.get(field) not in (None, ""):
+                extraction[field] = found[field]
+                provenance[field] = {"section": "Whole document", "category": "fallback", "char_span": None, "grounded": False}
+
+    latency_ms = round((time.perf_counter() - t0) * 1000, 1)
+    print(f"⏱️ Sectioned extraction: {len(calls)} calls, {payload_bytes / 1024:.0f} KB sent, {latency_ms:.0f} ms, {len(conflicts)} conflicts")
+    return {
+        "extraction": extraction,
+        "extraction_metadata": {},
+        "provenance": provenance,
+        "conflicts": conflicts,
+        "metadata": {
+            "mode": "sections",
+            "calls": len(calls),
+            "failed_calls": len(failed),
+            "fallback_fields": fallback_fields,
+            "payload_bytes": payload_bytes,
+            "max_call_bytes": max((r["request_bytes"] for r in results), default=0),
+            "latency_ms": latency_ms,
+            "calls_by_category": {
+                category: sum(1 for c in calls if c["category"] == category)
+                for category in dict.fromkeys(c["category"] for c in calls)
+            },
+        },
+    }
@@ -0,0 +1,73 @@
+"""
+Single-Flight Coalescing
+Identical requests that arrive while one is already running attach to it
+instead of starting their own run. The first request (the leader) does the
+work; every attached member sees the leader's status updates and receives
+its result. Flights are per process and end when the leader finishes.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class Flight:
+    def __init__(self, key: Hashable, leader: str):
+        self.key = key
+        self.leader = leader
+        self.members: List[str] = [leader]
+        self.status: Optional[Tuple[Any, ...]] = None  # last published status, replayed to late joiners
+        self.started = time.time()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self.led = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable, member: str, on_join: Callable[[str, Tuple[Any, ...]], None] = None) -> Tuple[Flight, bool]:
+        """
+        Attach member to the flight for key, or start one with member as leader.
+        Returns (flight, is_leader). on_join(member, status) replays the current
+        status to a follower before any later update can reach it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight(key, member)
+                self.led += 1
+                return flight, True
+            flight.members.append(member)
+            self.coalesced += 1
+            if on_join is not None and flight.status is not None:
+                on_join(member, flight.status)
+            return flight, False
+
+    def publish(self, flight: Flight, callback: Callable[..., None], *status):
+        """Record status and call callback(member, *status) for every current member"""
+        with self._lock:
+            flight.status = status
+            for member in flight.members:
+                callback(member, *status)
+
+    def finish(self, flight: Flight) -> List[str]:
+        """Close the flight (later requests start a new one) and return all its members"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return list(flight.members)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "in_flight": len(self._flights),
+                "led": self.led,
+                "coalesced": self.coalesced,
+                "flights": [
+                    {"leader": f.leader, "members": len(f.members), "age_s": round(now - f.started, 1)}
+                    for f in self._flights.values()
+                ],
+            }
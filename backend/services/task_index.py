@@ -0,0 +1,511 @@
+"""
+Per-Task Retrieval Index
+Holds one dataroom's chunks as a contiguous embedding matrix plus keyword
+postings. Documents are added and removed incrementally: removal tombstones
+their rows immediately and compact() reclaims the space later.
+
+Near-duplicate chunks (repeated boilerplate across filings) are stored once;
+each row keeps the list of every (doc, chunk) location it was found at, with
+that location's own text when it differs, so the row can take it over if the
+document it was first stored for is removed.
+"""
+
+import heapq
+import json
+import os
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+import numpy as np
+
+from services import near_dup
+
+_TABLE_RE = re.compile(r"(?:^|\n)[ \t]*\||<table", re.I)
+
+# Retrieval: candidates per signal before exact fusion, fusion weights
+DEFAULT_CANDIDATES = 100
+SEMANTIC_WEIGHT = 0.7
+RRF_K = 60
+
+# Per-row and per-posting-entry Python overhead (dicts, sets, ints) for nbytes()
+ROW_OVERHEAD_BYTES = 1200
+POSTING_OVERHEAD_BYTES = 64
+
+# Entry of a duplicate plan: existing row id, ("new", i) for an earlier row of the same batch, or None
+DuplicateTarget = Union[int, Tuple[str, int], None]
+
+
+def _rrf(semantic: np.ndarray, keyword: np.ndarray) -> np.ndarray:
+    """Reciprocal rank fusion of two score lists; rows without a keyword match get no keyword term"""
+    fused = np.zeros(len(semantic), dtype=np.float32)
+    for scores, matched in ((semantic, np.ones(len(semantic), dtype=bool)), (keyword, keyword > 0)):
+        order = np.argsort(-scores, kind="stable")
+        ranks = np.empty(len(scores), dtype=np.float32)
+        ranks[order] = np.arange(1, len(scores) + 1)
+        fused += np.where(matched, 1.0 / (RRF_K + ranks), 0.0)
+    return fused
+
+
+def _top_n(scores: np.ndarray, rows: np.ndarray, n: int) -> np.ndarray:
+    """The n rows (of `rows`) with the highest scores, unordered"""
+    if len(rows) <= n:
+        return rows
+    return rows[np.argpartition(-scores[rows], n - 1)[:n]]
+
+
+def tokenize(text: str) -> set:
+    """Keyword terms (same whitespace term-overlap scoring the index always used)"""
+    return set(text.lower().split())
+
+
+class TaskIndex:
+    """Chunks of one task: row metadata, unit-norm embedding matrix, keyword postings"""
+
+    def __init__(self):
+        self.rows = []             # [row dict or None when tombstoned]
+        self.vectors = None        # np.ndarray (capacity, dim) float32, unit-norm rows
+        self.alive = np.zeros(0, dtype=bool)
+        self.postings = {}         # {term: set(row_id)}
+        self.doc_rows = {}         # {doc_id: [row_id]}
+        self.documents = {}        # {doc_id: {"metadata": {}, "structured": []}}
+        self.dedupe = near_dup.DuplicateIndex()
+        self.tombstones = 0
+        self.stale_vectors = set()  # rows whose text was replaced; the owner re-embeds them (update_vectors)
+        self.version = 0
+        self.params = {}           # embedding model + chunking the rows were built with (see PathwayRAG.index_params)
+        self.lock = threading.RLock()        # guards reads against concurrent mutation
+        self.write_lock = threading.Lock()   # serializes plan -> embed -> add sequences and compaction
+
+    # ----------------------
+    # Size
+    # ----------------------
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+    @property
+    def live_rows(self) -> int:
+        return self.size - self.tombstones
+
+    @property
+    def has_embeddings(self) -> bool:
+        return self.vectors is not None
+
+    def _ensure_capacity(self, extra: int, dim: int):
+        needed = self.size + extra
+        if self.vectors is None:
+            self.vectors = np.zeros((max(needed, 64), dim), dtype=np.float32)
+        elif needed > self.vectors.shape[0]:
+            grown = np.zeros((max(needed, self.vectors.shape[0] * 2), dim), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+
+        if needed > len(self.alive):
+            grown_alive = np.zeros(max(needed, len(self.alive) * 2, 64), dtype=bool)
+            grown_alive[:self.size] = self.alive[:self.size]
+            self.alive = grown_alive
+
+    # ----------------------
+    # Mutation
+    # ----------------------
+    @staticmethod
+    def _location(row: Dict[str, Any], doc_id: str) -> Dict[str, Any]:
+        return {
+            "doc_id": doc_id,
+            "chunk_index": row.get("chunk_index"),
+            "start": row.get("start"),
+            "end": row.get("end"),
+            "section_path": row.get("section_path", []),
+            "page_start": row.get("page_start"),
+            "page_end": row.get("page_end"),
+        }
+
+    def plan_duplicates(self, rows: List[Dict[str, Any]], max_distance: int = near_dup.DEFAULT_MAX_DISTANCE) -> List[DuplicateTarget]:
+        """
+        Fingerprint new rows and find which are near-duplicates of stored rows or
+        of earlier rows in the same batch. Tables only match exactly.
+        """
+        batch = near_dup.DuplicateIndex()
+        plan = []
+        with self.lock:
+            for i, row in enumerate(rows):
+                row["is_table"] = bool(_TABLE_RE.search(row["text"]))
+                row["simhash"] = near_dup.simhash(row["text"])
+                row["dup_key"] = near_dup.exact_key(row["text"])
+                row["num_key"] = near_dup.numbers_key(row["text"])
+
+                target = self.dedupe.find(
+                    row["simhash"], row["dup_key"], lambda r: self.rows[r]["simhash"],
+                    exact_only=row["is_table"], max_distance=max_distance,
+                    compatible=lambda r: self.rows[r].get("num_key") == row["num_key"],
+                )
+                if target is None:
+                    local = batch.find(
+                        row["simhash"], row["dup_key"], lambda j: rows[j]["simhash"],
+                        exact_only=row["is_table"], max_distance=max_distance,
+                        compatible=lambda j: rows[j]["num_key"] == row["num_key"],
+                    )
+                    target = ("new", local) if local is not None else None
+                if target is None:
+                    batch.add(i, row["simhash"], row["dup_key"], exact_only=row["is_table"])
+                plan.append(target)
+        return plan
+
+    def add_document(self, doc_id: str, rows: List[Dict[str, Any]], embeddings: Optional[np.ndarray], metadata: dict, structured: list = None, duplicate_of: List[DuplicateTarget] = None) -> List[int]:
+        """
+        Add a document's chunk rows (replacing any previous version of it).
+        duplicate_of comes from plan_duplicates(); embeddings cover only the rows
+        whose entry is None. Without a plan every row is stored.
+        """
+        with self.lock:
+            if doc_id in self.documents:
+                self.remove_document(doc_id)
+
+            if duplicate_of is None:
+                duplicate_of = [None] * len(rows)
+            new_positions = [i for i, target in enumerate(duplicate_of) if target is None]
+
+            dim = embeddings.shape[1] if embeddings is not None and len(embeddings) else (
+                self.vectors.shape[1] if self.vectors is not None else 0
+            )
+            if dim:
+                self._ensure_capacity(len(new_positions), dim)
+            elif self.size + len(new_positions) > len(self.alive):
+                grown_alive = np.zeros(max(self.size + len(new_positions), len(self.alive) * 2, 64), dtype=bool)
+                grown_alive[:self.size] = self.alive[:self.size]
+                self.alive = grown_alive
+
+            start = self.size
+            if embeddings is not None and len(embeddings):
+                vecs = np.asarray(embeddings, dtype=np.float32)
+                norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+                self.vectors[start:start + len(vecs)] = np.divide(vecs, norms, out=np.zeros_like(vecs), where=norms > 0)
+
+            # Store unique rows first so in-batch duplicates can point at them
+            row_of = {}  # {batch position: row_id}
+            for offset, i in enumerate(new_positions):
+                row = rows[i]
+                row_id = start + offset
+                row["doc_id"] = doc_id
+                row["locations"] = [self._location(row, doc_id)]
+                row.setdefault("simhash", 0)
+                row.setdefault("dup_key", near_dup.exact_key(row["text"]))
+                self.rows.append(row)
+                self.alive[row_id] = True
+                for term in tokenize(row["text"]):
+                    self.postings.setdefault(term, set()).add(row_id)
+                self.dedupe.add(row_id, row["simhash"], row["dup_key"], exact_only=row.get("is_table", False))
+                row_of[i] = row_id
+
+            # Duplicates only record where else the text occurs
+            doc_row_ids = list(row_of.values())
+            seen = set(doc_row_ids)
+            for i, target in enumerate(duplicate_of):
+                if target is None:
+                    continue
+                row_id = row_of[target[1]] if isinstance(target, tuple) else target
+                if row_id >= self.size or self.rows[row_id] is None:
+                    continue
+                location = self._location(rows[i], doc_id)
+                if rows[i]["text"] != self.rows[row_id]["text"]:
+                    location["text"] = rows[i]["text"]
+                self.rows[row_id]["locations"].append(location)
+                if row_id not in seen:
+                    seen.add(row_id)
+                    doc_row_ids.append(row_id)
+
+            self.doc_rows[doc_id] = doc_row_ids
+            self.documents[doc_id] = {
+                "metadata": metadata or {},
+                "structured": structured or [],
+                "num_chunks": len(rows),
+            }
+            self.version += 1
+            return doc_row_ids
+
+    def _unpost(self, row_id: int, terms: set):
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.discard(row_id)
+                if not posting:
+                    del self.postings[term]
+
+    def _retext(self, row_id: int, text: str):
+        """Give a row another location's text: postings and fingerprints follow, the vector is marked stale"""
+        row = self.rows[row_id]
+        old_terms, new_terms = tokenize(row["text"]), tokenize(text)
+        self._unpost(row_id, old_terms - new_terms)
+        for term in new_terms - old_terms:
+            self.postings.setdefault(term, set()).add(row_id)
+        self.dedupe.remove(row_id, row.get("simhash", 0), row.get("dup_key", ""))
+        row["text"] = text
+        row["is_table"] = bool(_TABLE_RE.search(text))
+        row["simhash"] = near_dup.simhash(text)
+        row["dup_key"] = near_dup.exact_key(text)
+        row["num_key"] = near_dup.numbers_key(text)
+        self.dedupe.add(row_id, row["simhash"], row["dup_key"], exact_only=row["is_table"])
+        for loc in row["locations"]:
+            if loc.get("text") == text:
+                del loc["text"]
+        if self.vectors is not None:
+            self.stale_vectors.add(row_id)
+
+    def update_vectors(self, row_ids: List[int], embeddings: np.ndarray):
+        """Store fresh embeddings for rows in stale_vectors"""
+        with self.lock:
+            vecs = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            vecs = np.divide(vecs, norms, out=np.zeros_like(vecs), where=norms > 0)
+            for row_id, vec in zip(row_ids, vecs):
+                if self.rows[row_id] is not None:
+                    self.vectors[row_id] = vec
+                self.stale_vectors.discard(row_id)
+
+    def remove_document(self, doc_id: str) -> int:
+        """
+        Drop a document's locations. Rows it shares with other documents are
+        handed to the next location, taking over its text when it differs
+        (see stale_vectors); rows only it used are tombstoned and leave the
+        postings. Returns the number of rows tombstoned.
+        """
+        with self.lock:
+            existed = doc_id in self.documents
+            removed = 0
+            for row_id in self.doc_rows.pop(doc_id, []):
+                row = self.rows[row_id]
+                if row is None:
+                    continue
+
+                remaining = [loc for loc in row["locations"] if loc["doc_id"] != doc_id]
+                if remaining:
+                    row["locations"] = remaining
+                    row.update({k: v for k, v in remaining[0].items() if k != "text"})
+                    if "text" in remaining[0]:
+                        self._retext(row_id, remaining[0]["text"])
+                    continue
+
+                self._unpost(row_id, tokenize(row["text"]))
+                self.stale_vectors.discard(row_id)
+                self.dedupe.remove(row_id, row.get("simhash", 0), row.get("dup_key", ""))
+                self.alive[row_id] = False
+                if self.vectors is not None:
+                    self.vectors[row_id] = 0.0
+                self.rows[row_id] = None
+                self.tombstones += 1
+                removed += 1
+
+            self.documents.pop(doc_id, None)
+            if existed:
+                self.version += 1
+            return removed
+
+    def dedupe_stats(self) -> Dict[str, Any]:
+        """How many chunk occurrences collapsed into shared rows, overall and per document"""
+        with self.lock:
+            unique = 0
+            occurrences = 0
+            per_doc = {doc_id: {"chunks": info.get("num_chunks", 0), "shared_rows": 0} for doc_id, info in self.documents.items()}
+            for row in self.rows:
+                if row is None:
+                    continue
+                unique += 1
+                occurrences += len(row["locations"])
+                if len(row["locations"]) > 1:
+                    for doc_id in {loc["doc_id"] for loc in row["locations"]}:
+                        if doc_id in per_doc:
+                            per_doc[doc_id]["shared_rows"] += 1
+
+            collapsed = occurrences - unique
+            return {
+                "unique_chunks": unique,
+                "chunk_occurrences": occurrences,
+                "duplicates_collapsed": collapsed,
+                "dedupe_ratio": round(collapsed / occurrences, 4) if occurrences else 0.0,
+                "per_document": per_doc,
+            }
+
+    def needs_compaction(self, max_ratio: float = 0.25, min_tombstones: int = 64) -> bool:
+        return self.tombstones >= min_tombstones or (
+            self.tombstones > 0 and self.tombstones > max_ratio * self.size
+        )
+
+    def compact(self) -> int:
+        """Physically drop tombstoned rows and renumber. Returns rows reclaimed."""
+        with self.write_lock, self.lock:
+            if not self.tombstones:
+                return 0
+
+            keep = np.flatnonzero(self.alive[:self.size])
+            remap = {int(old): new for new, old in enumerate(keep)}
+            reclaimed = self.tombstones
+
+            self.rows = [self.rows[i] for i in keep]
+            if self.vectors is not None:
+                vectors = np.zeros((max(len(keep), 64), self.vectors.shape[1]), dtype=np.float32)
+                vectors[:len(keep)] = self.vectors[keep]
+                self.vectors = vectors
+            alive = np.zeros(max(len(keep), 64), dtype=bool)
+            alive[:len(keep)] = True
+            self.alive = alive
+            self.postings = {term: {remap[r] for r in ids} for term, ids in self.postings.items()}
+            self.doc_rows = {doc_id: [remap[r] for r in ids] for doc_id, ids in self.doc_rows.items()}
+            self.dedupe.remap(remap)
+            self.stale_vectors = {remap[r] for r in self.stale_vectors if r in remap}
+            self.tombstones = 0
+            self.version += 1
+            return reclaimed
+
+    # ----------------------
+    # Scoring
+    # ----------------------
+    def semantic_scores(self, query_vec: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row against a query vector (0 for dead rows)"""
+        if self.vectors is None or query_vec is None or not len(query_vec):
+            return np.zeros(self.size, dtype=np.float32)
+        q = np.asarray(query_vec, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return np.zeros(self.size, dtype=np.float32)
+        return self.vectors[:self.size] @ (q / norm)
+
+    def keyword_scores(self, query_terms: set) -> np.ndarray:
+        """Fraction of query terms present in each row (scattered from postings)"""
+        counts = np.zeros(self.size, dtype=np.float32)
+        if not query_terms:
+            return counts
+        for term in query_terms:
+            posting = self.postings.get(term)
+            if posting:
+                counts[np.fromiter(posting, dtype=np.int64, count=len(posting))] += 1.0
+        return counts / len(query_terms)
+
+    def _padding(self, chosen: np.ndarray, needed: int) -> np.ndarray:
+        """Lowest live row ids not already chosen (the zero-score rows a full sort would return)"""
+        spare = np.flatnonzero(self.alive[:self.size])
+        return spare[~np.isin(spare, chosen)][:needed]
+
+    def search(self, query_terms: set, query_vec: Optional[np.ndarray], top_k: int,
+               fusion: str = "weighted", candidates: int = DEFAULT_CANDIDATES) -> List[Tuple[int, float, float, float]]:
+        """
+        Two-stage hybrid or keyword-only top_k as (row_id, score, semantic, keyword).
+
+        Candidates are the top `candidates` rows by cosine unioned with the top
+        `candidates` rows by keyword overlap (argpartition, no sort); only those
+        are fused and ranked with a heap. fusion is "weighted" (70% semantic,
+        30% keyword) or "rrf" (reciprocal rank fusion). candidates=0 fuses
+        every live row.
+        """
+        with self.lock:
+            if not self.live_rows:
+                return []
+
+            alive = self.alive[:self.size]
+            keyword_all = np.where(alive, self.keyword_scores(query_terms), 0.0)
+            use_semantic = self.has_embeddings and query_vec is not None and len(query_vec) > 0
+            limit = max(candidates, top_k) if candidates else self.size
+
+            # Stage 1: candidate generation
+            pools = [_top_n(keyword_all, np.flatnonzero(keyword_all), limit)]
+            semantic_all = None
+            if use_semantic:
+                semantic_all = self.semantic_scores(query_vec)
+                pools.append(_top_n(semantic_all, np.flatnonzero(alive), limit))
+            ids = np.unique(np.concatenate(pools))
+            if len(ids) < top_k:
+                ids = np.concatenate([ids, self._padding(ids, top_k - len(ids))])
+            if not len(ids):
+                return []
+
+            # Stage 2: exact fusion on the candidates only
+            keyword = keyword_all[ids].astype(np.float32)
+            semantic = semantic_all[ids].astype(np.float32) if use_semantic else np.zeros(len(ids), dtype=np.float32)
+            if not use_semantic:
+                scores = keyword
+            elif fusion == "rrf":
+                scores = _rrf(semantic, keyword)
+            else:
+                scores = semantic * SEMANTIC_WEIGHT + keyword * (1 - SEMANTIC_WEIGHT)
+
+            # Ties go to the lower row id among the candidates
+            best = heapq.nlargest(top_k, range(len(ids)), key=lambda i: (scores[i], -ids[i]))
+            return [(int(ids[i]), float(scores[i]), float(semantic[i]), float(keyword[i])) for i in best]
+
+    def nbytes(self) -> int:
+        """Approximate resident size of the index, including Python object overhead"""
+        total = 0
+        if self.vectors is not None:
+            total += self.vectors.nbytes
+        total += self.alive.nbytes
+        total += sum(len(r["text"]) + ROW_OVERHEAD_BYTES for r in self.rows if r is not None)
+        total += sum(len(t) + POSTING_OVERHEAD_BYTES * len(ids) for t, ids in self.postings.items())
+        return total
+
+    # ----------------------
+    # Persistence (cold tier)
+    # ----------------------
+    def save(self, path: str):
+        """Write the index to one .npz file (atomically). Postings and fingerprints are rebuilt on load."""
+        with self.lock:
+            meta = {
+                "format": 1,
+                "rows": self.rows,
+                "doc_rows": self.doc_rows,
+                "documents": self.documents,
+                "tombstones": self.tombstones,
+                "version": self.version,
+                "params": self.params,
+            }
+            # Small enough to read without loading the rows (see read_header)
+            header = {"params": self.params, "doc_ids": list(self.documents)}
+            arrays = {
+                "alive": self.alive[:self.size],
+                "meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                "header": np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+            }
+            if self.vectors is not None:
+                arrays["vectors"] = self.vectors[:self.size]
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TaskIndex":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            alive = data["alive"]
+            vectors = data["vectors"] if "vectors" in data.files else None
+
+        index = cls()
+        index.rows = meta["rows"]
+        index.doc_rows = meta["doc_rows"]
+        index.documents = meta["documents"]
+        index.tombstones = meta["tombstones"]
+        index.version = meta["version"]
+        index.params = meta.get("params", {})
+
+        n = len(index.rows)
+        index.alive = np.zeros(max(n, 64), dtype=bool)
+        index.alive[:n] = alive
+        if vectors is not None:
+            index.vectors = np.zeros((max(n, 64), vectors.shape[1]), dtype=np.float32)
+            index.vectors[:n] = vectors
+
+        for row_id, row in enumerate(index.rows):
+            if row is None:
+                continue
+            for term in tokenize(row["text"]):
+                index.postings.setdefault(term, set()).add(row_id)
+            index.dedupe.add(row_id, row.get("simhash", 0), row.get("dup_key", ""), exact_only=row.get("is_table", False))
+        return index
+
+    @staticmethod
+    def read_header(path: str) -> Dict[str, Any]:
+        """Build params and document ids of a saved index, without loading its rows"""
+        with np.load(path, allow_pickle=False) as data:
+            if "header" in data.files:
+                return json.loads(data["header"].tobytes().decode("utf-8"))
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        return {"params": meta.get("params", {}), "doc_ids": list(meta["documents"])}
@@ -0,0 +1,548 @@
+"""
+Multi-Period Financial Trends
+Stores extracted financials as a per-task time series keyed by fiscal period and
+source document, and computes period-over-period trends in vectorized form.
+
+Each upload writes one FinancialPeriod row. Reads go through a columnar table
+(one numpy array per metric, one row per fiscal period) from which YoY/QoQ
+deltas, CAGR, trailing-twelve-month margins and leverage trends are derived.
+Results are cached per task and recomputed whenever the task's periods change.
+"""
+
+import re
+import json
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from models import Document, FinancialPeriod
+from services import dataroom_events
+
+# Metric columns of the time series, mapped from ADE extraction field names
+METRIC_FIELDS = {
+    "revenue": ["revenue"],
+    "debt": ["totaldebt", "debt"],
+    "equity": ["equity"],
+    "cash_flow": ["cashflow", "cash_flow"],
+    "net_income": ["netincome", "net_income"],
+    "ebitda": ["ebitda"],
+    "operating_income": ["operatingincome", "operating_income"],
+    "gross_profit": ["grossprofit", "gross_profit"],
+}
+METRICS = list(METRIC_FIELDS.keys())
+
+# Flow metrics are summed over four quarters for trailing-twelve-month figures
+FLOW_METRICS = ["revenue", "cash_flow", "net_income", "ebitda", "operating_income", "gross_profit"]
+
+# --- Cache of computed trends (recomputed on update) ---
+_trend_cache = {}  # {task_id: trends dict}
+_cache_lock = threading.Lock()
+
+# Tasks whose pre-existing documents were already given period rows (once per process);
+# later uploads record their own period, so documents without one are not parsed again
+_backfilled = set()
+
+# Periods are detected from the filename, the extraction and the start of the markdown
+PERIOD_SCAN_CHARS = 5000
+
+
+# ----------------------
+# Parsing helpers
+# ----------------------
+_MONTH_QUARTER = {
+    "jan": 1, "feb": 1, "mar": 1, "apr": 2, "may": 2, "jun": 2,
+    "jul": 3, "aug": 3, "sep": 3, "oct": 4, "nov": 4, "dec": 4,
+}
+_ORDINAL_QUARTER = {"first": 1, "second": 2, "third": 3, "fourth": 4}
+
+_QUARTER_PATTERNS = [
+    # "Q3 2024", "Q3'24", "Q3 FY2024", "Q3-2024"
+    (re.compile(r"(?<![A-Za-z])Q([1-4])\s*[-_']?\s*(?:FY\s*)?'?(\d{4}|\d{2})(?!\d)", re.I), "q_year"),
+    # "2024 Q3", "FY2024 Q3"
+    (re.compile(r"(?<!\d)(?:FY\s*)?(\d{4})\s*[-_/ ]\s*Q([1-4])(?!\d)", re.I), "year_q"),
+    # "third quarter of fiscal 2024"
+    (re.compile(r"\b(first|second|third|fourth)\s+quarter\s+(?:of\s+)?(?:fiscal\s+)?(?:year\s+)?(\d{4})\b", re.I), "ordinal"),
+    # "three months ended September 30, 2024"
+    (re.compile(r"\b(?:three|3)\s+months\s+ended\s+([A-Za-z]{3})[a-z]*\.?\s+\d{1,2},?\s+(\d{4})\b", re.I), "month"),
+]
+_ANNUAL_PATTERNS = [
+    re.compile(r"(?<![A-Za-z])FY\s*[-_']?\s*(\d{4}|\d{2})(?!\d)", re.I),
+    re.compile(r"\b(?:fiscal\s+)?year\s+ended\s+[A-Za-z]+\.?\s+\d{1,2},?\s+(\d{4})\b", re.I),
+    re.compile(r"\btwelve\s+months\s+ended\s+[A-Za-z]+\.?\s+\d{1,2},?\s+(\d{4})\b", re.I),
+    re.compile(r"\b(?:fiscal|annual)\s+(?:year\s+)?(\d{4})\b", re.I),
+]
+
+
+def _full_year(year: str) -> int:
+    y = int(year)
+    return y + 2000 if y < 100 else y
+
+
+def parse_fiscal_period(*candidates: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Find a fiscal period in the given texts (tried in order).
+    Returns (fiscal_year, fiscal_quarter) with quarter 0 for a full year, or None.
+    """
+    for text in candidates:
+        if not text:
+            continue
+        text = str(text)
+
+        for pattern, kind in _QUARTER_PATTERNS:
+            m = pattern.search(text)
+            if not m:
+                continue
+            if kind == "q_year":
+                return _full_year(m.group(2)), int(m.group(1))
+            if kind == "year_q":
+                return _full_year(m.group(1)), int(m.group(2))
+            if kind == "ordinal":
+                return _full_year(m.group(2)), _ORDINAL_QUARTER[m.group(1).lower()]
+            if kind == "month":
+                quarter = _MONTH_QUARTER.get(m.group(1).lower()[:3])
+                if quarter:
+                    return _full_year(m.group(2)), quarter
+
+        for pattern in _ANNUAL_PATTERNS:
+            m = pattern.search(text)
+            if m:
+                return _full_year(m.group(1)), 0
+
+    return None
+
+
+def period_label(fiscal_year: int, fiscal_quarter: int) -> str:
+    return f"{fiscal_year}-FY" if fiscal_quarter == 0 else f"{fiscal_year}-Q{fiscal_quarter}"
+
+
+_SCALE_WORDS = {
+    "k": 1e3, "thousand": 1e3,
+    "m": 1e6, "mm": 1e6, "mn": 1e6, "million": 1e6,
+    "b": 1e9, "bn": 1e9, "billion": 1e9,
+    "t": 1e12, "trillion": 1e12,
+}
+_AMOUNT_RE = re.compile(r"(\(?)-?\s*\$?\s*(\d[\d,]*(?:\.\d+)?)\s*([a-zA-Z]+)?")
+
+
+def parse_amount(value) -> Optional[float]:
+    """Parse ADE amounts like '$2.5M', '1,200', '(350)' or '1.2 billion'. None if missing."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value).strip()
+    m = _AMOUNT_RE.search(text)
+    if not m:
+        return None
+    try:
+        amount = float(m.group(2).replace(",", ""))
+    except ValueError:
+        return None
+
+    suffix = (m.group(3) or "").lower()
+    amount *= _SCALE_WORDS.get(suffix, 1.0)
+    if m.group(1) == "(" or text.startswith("-"):
+        amount = -amount
+    return amount
+
+
+# ----------------------
+# Writing periods
+# ----------------------
+def _period_row(task_id: str, doc_id: str, filename: str, extraction_json: dict, markdown: str = "") -> Optional[FinancialPeriod]:
+    """Build a time-series row for one document, or None if no fiscal period is found."""
+    normalized = {k.lower(): v for k, v in (extraction_json or {}).items()}
+
+    period = parse_fiscal_period(
+        normalized.get("fiscalperiod"),
+        filename,
+        (markdown or "")[:PERIOD_SCAN_CHARS],
+    )
+    if period is None:
+        return None
+
+    fiscal_year, fiscal_quarter = period
+    values = {}
+    for metric, aliases in METRIC_FIELDS.items():
+        values[metric] = next(
+            (parse_amount(normalized[a]) for a in aliases if normalized.get(a) not in (None, "")),
+            None,
+        )
+
+    return FinancialPeriod(
+        task_id=task_id,
+        doc_id=doc_id,
+        period=period_label(fiscal_year, fiscal_quarter),
+        fiscal_year=fiscal_year,
+        fiscal_quarter=fiscal_quarter,
+        **values,
+    )
+
+
+def record_document_period(session: Session, task_id: str, doc: Document, extraction_json: dict, markdown: str = "") -> Optional[FinancialPeriod]:
+    """
+    Store one document's extracted financials as a time-series row.
+    Skipped when no fiscal period can be identified. Refreshes the task's trend cache.
+    """
+    row = _period_row(task_id, doc.id, doc.filename, extraction_json, markdown)
+    if row is None:
+        print(f"⚠️ No fiscal period found for {doc.filename}; not added to time series")
+        return None
+
+    session.add(row)
+    session.commit()
+    session.refresh(row)
+
+    refresh_trends(session, task_id)
+    print(f"📈 Recorded {row.period} financials for {doc.filename}")
+    return row
+
+
+def _backfill_missing_periods(session: Session, task_id: str):
+    """
+    Add time-series rows for documents ingested before period tracking existed.
+    Runs once per task per process; reads only the columns period detection uses.
+    """
+    with _cache_lock:
+        if task_id in _backfilled:
+            return
+        _backfilled.add(task_id)
+
+    try:
+        recorded = set(session.exec(
+            select(FinancialPeriod.doc_id).where(FinancialPeriod.task_id == task_id)
+        ).all())
+        docs = session.exec(
+            select(Document.id, Document.filename, Document.extraction_json,
+                   func.substr(Document.markdown, 1, PERIOD_SCAN_CHARS))
+            .where(Document.task_id == task_id, Document.extraction_json != None)  # noqa: E711
+        ).all()
+
+        added = 0
+        for doc_id, filename, extraction_json, markdown_head in docs:
+            if doc_id in recorded:
+                continue
+            try:
+                extraction = json.loads(extraction_json)
+            except Exception:
+                continue
+            row = _period_row(task_id, doc_id, filename, extraction, markdown_head)
+            if row is not None:
+                session.add(row)
+                added += 1
+        if added:
+            session.commit()
+    except Exception:
+        with _cache_lock:
+            _backfilled.discard(task_id)
+        raise
+
+
+# ----------------------
+# Columnar table
+# ----------------------
+def _build_table(rows: List[FinancialPeriod], filenames: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Collapse rows into one entry per fiscal period (later documents override
+    earlier ones field by field) and return a columnar table sorted by period.
+    """
+    by_period = {}  # {(year, quarter): {"values": {...}, "sources": [...]}}
+    for row in sorted(rows, key=lambda r: r.created_at):
+        entry = by_period.setdefault(
+            (row.fiscal_year, row.fiscal_quarter),
+            {"values": {}, "sources": []},
+        )
+        for metric in METRICS:
+            value = getattr(row, metric)
+            if value is not None:
+                entry["values"][metric] = value
+        entry["sources"].append({"doc_id": row.doc_id, "filename": filenames.get(row.doc_id, "unknown")})
+
+    keys = sorted(by_period.keys())
+    table = {
+        "period": [period_label(y, q) for y, q in keys],
+        "fiscal_year": np.array([y for y, _ in keys], dtype=np.int64),
+        "fiscal_quarter": np.array([q for _, q in keys], dtype=np.int64),
+        "sources": [by_period[k]["sources"] for k in keys],
+    }
+    for metric in METRICS:
+        table[metric] = np.array(
+            [by_period[k]["values"].get(metric, np.nan) for k in keys],
+            dtype=np.float64,
+        )
+    return table
+
+
+def _select(table: Dict[str, Any], mask: np.ndarray) -> Dict[str, Any]:
+    out = {}
+    for name, col in table.items():
+        if isinstance(col, np.ndarray):
+            out[name] = col[mask]
+        else:
+            out[name] = [v for v, keep in zip(col, mask) if keep]
+    return out
+
+
+def _lag_index(keys: np.ndarray, lag: int) -> np.ndarray:
+    """Row index of the period exactly `lag` steps earlier, or -1 if it is missing."""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    target = keys - lag
+    pos = np.clip(np.searchsorted(keys, target), 0, len(keys) - 1)
+    return np.where(keys[pos] == target, pos, -1)
+
+
+def _take(col: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    return np.where(idx >= 0, col[np.maximum(idx, 0)], np.nan)
+
+
+def _ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(np.isfinite(b) & (b != 0), a / b, np.nan)
+
+
+def _pct_change(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            np.isfinite(previous) & (previous != 0),
+            (current - previous) / np.abs(previous),
+            np.nan,
+        )
+
+
+def _cagr(values: np.ndarray, years: np.ndarray) -> Optional[float]:
+    """CAGR between the first and last positive observations at least a year apart."""
+    valid = np.isfinite(values) & (values > 0)
+    if valid.sum() < 2:
+        return None
+    v, t = values[valid], years[valid]
+    span = t[-1] - t[0]
+    if span < 1:
+        return None
+    return float((v[-1] / v[0]) ** (1.0 / span) - 1.0)
+
+
+def _slope(values: np.ndarray) -> Optional[float]:
+    """Least-squares slope per period over the finite observations."""
+    valid = np.isfinite(values)
+    if valid.sum() < 2:
+        return None
+    x = np.arange(len(values), dtype=np.float64)[valid]
+    return float(np.polyfit(x, values[valid], 1)[0])
+
+
+def _compute_series(table: Dict[str, Any], quarterly: bool) -> Dict[str, Any]:
+    """Add period-over-period deltas, margins and leverage columns to a table."""
+    years = table["fiscal_year"]
+    if quarterly:
+        keys = years * 4 + (table["fiscal_quarter"] - 1)
+        prev_idx = _lag_index(keys, 1)
+        yoy_idx = _lag_index(keys, 4)
+    else:
+        keys = years
+        prev_idx = yoy_idx = _lag_index(keys, 1)
+
+    out = dict(table)
+    for metric in METRICS:
+        col = table[metric]
+        out[f"{metric}_yoy"] = _pct_change(col, _take(col, yoy_idx))
+        if quarterly:
+            out[f"{metric}_qoq"] = _pct_change(col, _take(col, prev_idx))
+
+    revenue = table["revenue"]
+    out["net_margin"] = _ratio(table["net_income"], revenue)
+    out["ebitda_margin"] = _ratio(table["ebitda"], revenue)
+    out["operating_margin"] = _ratio(table["operating_income"], revenue)
+    out["gross_margin"] = _ratio(table["gross_profit"], revenue)
+    out["debt_to_equity"] = _ratio(table["debt"], table["equity"])
+
+    if quarterly:
+        # Trailing-twelve-month sums need four consecutive quarters
+        lags = [_lag_index(keys, lag) for lag in range(4)]
+        complete = np.all(np.stack(lags) >= 0, axis=0) if len(keys) else np.zeros(0, dtype=bool)
+        ttm = {}
+        for metric in FLOW_METRICS:
+            stacked = np.stack([_take(table[metric], idx) for idx in lags])
+            ttm[metric] = np.where(complete, stacked.sum(axis=0), np.nan)
+            out[f"{metric}_ttm"] = ttm[metric]
+        out["net_margin_ttm"] = _ratio(ttm["net_income"], ttm["revenue"])
+        out["ebitda_margin_ttm"] = _ratio(ttm["ebitda"], ttm["revenue"])
+        out["operating_margin_ttm"] = _ratio(ttm["operating_income"], ttm["revenue"])
+        # Annualize a single quarter's EBITDA where a full TTM window is missing
+        annual_ebitda = np.where(np.isfinite(ttm["ebitda"]), ttm["ebitda"], table["ebitda"] * 4)
+        out["debt_to_ebitda"] = _ratio(table["debt"], annual_ebitda)
+        elapsed_years = keys / 4.0
+    else:
+        out["debt_to_ebitda"] = _ratio(table["debt"], table["ebitda"])
+        elapsed_years = keys.astype(np.float64)
+
+    out["_elapsed_years"] = elapsed_years
+    return out
+
+
+def _jsonable_table(table: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for name, col in table.items():
+        if name.startswith("_"):
+            continue
+        if isinstance(col, np.ndarray):
+            if col.dtype.kind == "f":
+                out[name] = [round(float(v), 4) if np.isfinite(v) else None for v in col]
+            else:
+                out[name] = col.tolist()
+        else:
+            out[name] = col
+    return out
+
+
+def _summarize(quarterly: Dict[str, Any], annual: Dict[str, Any]) -> Dict[str, Any]:
+    """Headline trend figures, preferring annual data for CAGR when available."""
+    summary = {}
+    for metric in ["revenue", "ebitda", "net_income"]:
+        cagr = None
+        if len(annual["period"]) >= 2:
+            cagr = _cagr(annual[metric], annual["_elapsed_years"])
+        if cagr is None and len(quarterly["period"]) >= 2:
+            cagr = _cagr(quarterly[metric], quarterly["_elapsed_years"])
+        summary[f"{metric}_cagr"] = cagr
+
+    primary = quarterly if len(quarterly["period"]) >= len(annual["period"]) else annual
+    if primary["period"]:
+        summary["latest_period"] = primary["period"][-1]
+        for name in ["revenue_yoy", "revenue_qoq", "net_margin", "ebitda_margin", "net_margin_ttm", "debt_to_equity", "debt_to_ebitda"]:
+            if name in primary:
+                value = primary[name][-1]
+                summary[f"latest_{name}"] = float(value) if np.isfinite(value) else None
+
+    leverage = primary.get("debt_to_equity", np.zeros(0))
+    slope = _slope(leverage) if len(leverage) else None
+    summary["debt_to_equity_slope"] = slope
+    if slope is None:
+        summary["leverage_trend"] = "insufficient data"
+    elif slope > 0.05:
+        summary["leverage_trend"] = "rising"
+    elif slope < -0.05:
+        summary["leverage_trend"] = "falling"
+    else:
+        summary["leverage_trend"] = "stable"
+
+    return {k: (round(v, 4) if isinstance(v, float) else v) for k, v in summary.items()}
+
+
+# ----------------------
+# Public API
+# ----------------------
+def compute_trends(session: Session, task_id: str) -> Dict[str, Any]:
+    """Build the task's time series and compute all trend columns (uncached)."""
+    rows = session.exec(select(FinancialPeriod).where(FinancialPeriod.task_id == task_id)).all()
+    doc_ids = {r.doc_id for r in rows}
+    filenames = {}
+    if doc_ids:
+        for doc_id, filename in session.exec(
+            select(Document.id, Document.filename).where(Document.id.in_(doc_ids))
+        ).all():
+            filenames[doc_id] = filename
+
+    table = _build_table(rows, filenames)
+    is_annual = table["fiscal_quarter"] == 0
+    quarterly = _compute_series(_select(table, ~is_annual), quarterly=True)
+    annual = _compute_series(_select(table, is_annual), quarterly=False)
+
+    return {
+        "task_id": task_id,
+        "num_periods": len(table["period"]),
+        "quarterly": _jsonable_table(quarterly),
+        "annual": _jsonable_table(annual),
+        "summary": _summarize(quarterly, annual),
+    }
+
+
+def refresh_trends(session: Session, task_id: str) -> Dict[str, Any]:
+    """Recompute and cache the task's trends."""
+    trends = compute_trends(session, task_id)
+    with _cache_lock:
+        _trend_cache[task_id] = trends
+    return trends
+
+
+@dataroom_events.on_change
+def invalidate(task_id: str):
+    with _cache_lock:
+        _trend_cache.pop(task_id, None)
+
+
+def delete_document_periods(session: Session, doc_id: str):
+    """Drop a document's time-series rows (caller commits)"""
+    for row in session.exec(select(FinancialPeriod).where(FinancialPeriod.doc_id == doc_id)).all():
+        session.delete(row)
+
+
+def get_trends(session: Session, task_id: str) -> Dict[str, Any]:
+    """Cached trends for a task, computed on first access."""
+    with _cache_lock:
+        cached = _trend_cache.get(task_id)
+    if cached is not None:
+        return cached
+
+    _backfill_missing_periods(session, task_id)
+    return refresh_trends(session, task_id)
+
+
+def document_period_keys(session: Session, task_id: str) -> Dict[str, Tuple[int, int]]:
+    """{doc_id: (fiscal_year, quarter_rank)} used to merge documents oldest-first."""
+    rows = session.exec(
+        select(FinancialPeriod.doc_id, FinancialPeriod.fiscal_year, FinancialPeriod.fiscal_quarter)
+        .where(FinancialPeriod.task_id == task_id)
+    ).all()
+    # A full fiscal year sorts after its own fourth quarter
+    return {doc_id: (year, quarter or 5) for doc_id, year, quarter in rows}
+
+
+def format_trends_for_prompt(trends: Dict[str, Any], max_periods: int = 8) -> str:
+    """Compact text rendering of the time series for the synthesis prompt."""
+    if not trends or not trends.get("num_periods"):
+        return ""
+
+    def pct(v):
+        return "n/a" if v is None else f"{v * 100:+.1f}%"
+
+    def ratio(v):
+        return "n/a" if v is None else f"{v:.2f}"
+
+    def amount(v):
+        return "n/a" if v is None else f"{v:,.0f}"
+
+    lines = []
+    for label, series, delta in [("Quarterly", trends["quarterly"], "qoq"), ("Annual", trends["annual"], None)]:
+        periods = series.get("period", [])
+        if not periods:
+            continue
+        lines.append(f"{label} series (oldest to newest):")
+        start = max(0, len(periods) - max_periods)
+        for i in range(start, len(periods)):
+            parts = [
+                f"{periods[i]}: revenue {amount(series['revenue'][i])}",
+                f"YoY {pct(series['revenue_yoy'][i])}",
+            ]
+            if delta:
+                parts.append(f"QoQ {pct(series['revenue_' + delta][i])}")
+            parts.append(f"net margin {pct(series['net_margin'][i])}")
+            if "net_margin_ttm" in series:
+                parts.append(f"TTM net margin {pct(series['net_margin_ttm'][i])}")
+            parts.append(f"D/E {ratio(series['debt_to_equity'][i])}")
+            parts.append(f"debt/EBITDA {ratio(series['debt_to_ebitda'][i])}")
+            lines.append("  " + ", ".join(parts))
+
+    summary = trends.get("summary", {})
+    lines.append(
+        "Summary: "
+        f"revenue CAGR {pct(summary.get('revenue_cagr'))}, "
+        f"EBITDA CAGR {pct(summary.get('ebitda_cagr'))}, "
+        f"net income CAGR {pct(summary.get('net_income_cagr'))}, "
+        f"leverage trend {summary.get('leverage_trend')}"
+    )
+    return "\n".join(lines)
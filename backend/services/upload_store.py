@@ -0,0 +1,68 @@
+"""
+Content-Addressed Upload Storage
+Streams an upload to disk in one pass while computing its SHA-256 and size,
+and files it under uploads/blobs/<sha[:2]>/<sha><ext>. Identical files are
+stored once, and same-named files no longer overwrite each other.
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Tuple
+
+import aiofiles
+from fastapi import UploadFile
+
+UPLOAD_DIR = "./uploads"
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the {limit // (1024 * 1024)} MB upload limit")
+        self.limit = limit
+
+
+def blob_path(sha256: str, filename: str = "") -> str:
+    ext = os.path.splitext(filename or "")[1].lower()[:10]
+    return os.path.join(BLOB_DIR, sha256[:2], f"{sha256}{ext}")
+
+
+async def save_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str, int]:
+    """
+    Stream the upload into content-addressed storage.
+    Returns (path, sha256, size_bytes). Raises UploadTooLarge as soon as the limit is crossed.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    tmp_path = os.path.join(BLOB_DIR, f".incoming-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                await out.write(chunk)
+
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, file.filename)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return path, sha256, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
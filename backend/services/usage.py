@@ -0,0 +1,282 @@
+"""
+Usage Ledger
+Per-task cost and resource accounting. Pipeline code opens a ledger for the
+task (and chat / document) it is working on; the clients it calls (OpenRouter,
+LandingAI ADE, the embedder, the RAG index) record what they consumed into
+whichever ledger is current, with no ids threaded through their signatures.
+Records are buffered and written to the UsageRecord table in one transaction
+when the ledger ends, then aggregated per task, chat and day.
+
+    ledger = usage.begin(task_id, chat_id=chat_id)
+    try:
+        usage.mark("chat.searching_documents")    # stage wall / CPU time
+        ask_gemini(...)                           # records an "llm" row
+    finally:
+        usage.end(ledger)
+
+The ledger lives in a contextvar: work handed to a thread pool must be wrapped
+with usage.bind(fn) to keep recording into it.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+QUANTITIES = ("calls", "prompt_tokens", "completion_tokens", "bytes_in", "bytes_out", "items", "cpu_ms", "wall_ms")
+
+# Rough list prices used for the estimated_usd column of the aggregates
+PRICE_PROMPT_PER_1K = float(os.getenv("USAGE_PRICE_PROMPT_PER_1K", "0.00015"))
+PRICE_COMPLETION_PER_1K = float(os.getenv("USAGE_PRICE_COMPLETION_PER_1K", "0.0006"))
+PRICE_ADE_PARSE_PER_CALL = float(os.getenv("USAGE_PRICE_ADE_PARSE_PER_CALL", "0.03"))
+PRICE_ADE_EXTRACT_PER_CALL = float(os.getenv("USAGE_PRICE_ADE_EXTRACT_PER_CALL", "0.01"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("usage_ledger", default=None)
+
+
+class Ledger:
+    def __init__(self, task_id: str, chat_id: str = None, doc_id: str = None):
+        self.task_id = task_id
+        self.chat_id = chat_id
+        self.doc_id = doc_id
+        self.records: List[Dict[str, Any]] = []
+        self.closed = False
+        self.stage = ""
+        self._stage_wall = None
+        self._stage_cpu = None
+        self._lock = threading.Lock()
+        self._token = None
+
+    def _row(self, resource: str, stage: str, quantities: Dict[str, Any]) -> Dict[str, Any]:
+        row = {
+            "task_id": self.task_id,
+            "chat_id": self.chat_id,
+            "doc_id": self.doc_id,
+            "stage": stage,
+            "resource": resource,
+            "created_at": datetime.utcnow(),
+        }
+        row.update({k: v for k, v in quantities.items() if v is not None})
+        return row
+
+    def add(self, resource: str, stage: str = None, **quantities):
+        with self._lock:
+            row = self._row(resource, self.stage if stage is None else stage, quantities)
+            if not self.closed:
+                self.records.append(row)
+                return
+        # A pool thread finishing after the pipeline ended: write it on its own
+        _write([row])
+
+    def mark(self, stage: str):
+        """Close the running stage (recording its wall and CPU time) and start the next"""
+        now_wall, now_cpu = time.perf_counter(), time.thread_time()
+        with self._lock:
+            previous, self.stage = self.stage, stage
+            started_wall, started_cpu = self._stage_wall, self._stage_cpu
+            self._stage_wall, self._stage_cpu = now_wall, now_cpu
+        if started_wall is not None and previous:
+            self.add("stage", stage=previous,
+                     wall_ms=round((now_wall - started_wall) * 1000, 2),
+                     cpu_ms=round((now_cpu - started_cpu) * 1000, 2))
+
+
+def _write(rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    from database import engine
+    from models import UsageRecord
+    from sqlmodel import Session
+
+    try:
+        with Session(engine) as session:
+            session.add_all([UsageRecord(**row) for row in rows])
+            session.commit()
+    except Exception as e:
+        # Accounting must never fail the request it is accounting for
+        print(f"⚠️ Could not write {len(rows)} usage records: {e}")
+
+
+# ----------------------
+# Recording
+# ----------------------
+def current() -> Optional[Ledger]:
+    return _current.get()
+
+
+def begin(task_id: str, chat_id: str = None, doc_id: str = None) -> Ledger:
+    ledger = Ledger(task_id, chat_id=chat_id, doc_id=doc_id)
+    ledger._token = _current.set(ledger)
+    return ledger
+
+
+def end(ledger: Ledger):
+    """
+    Close the current stage and write the buffered records. A doc_id set on the
+    ledger mid-way (an upload only gets its id once saved) is applied to the
+    records made before it.
+    """
+    if ledger.stage:
+        ledger.mark("")
+    with ledger._lock:
+        ledger.closed = True
+        rows, ledger.records = ledger.records, []
+    for row in rows:
+        row["doc_id"] = row["doc_id"] or ledger.doc_id
+    if ledger._token is not None:
+        try:
+            _current.reset(ledger._token)
+        except ValueError:
+            _current.set(None)  # ended from a different context than it began in
+        ledger._token = None
+    _write(rows)
+
+
+@contextmanager
+def scope(task_id: str, chat_id: str = None, doc_id: str = None):
+    ledger = begin(task_id, chat_id=chat_id, doc_id=doc_id)
+    try:
+        yield ledger
+    finally:
+        end(ledger)
+
+
+def record(resource: str, **quantities):
+    """Add a usage row to the current ledger; a no-op outside one (scripts, benchmarks)"""
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.add(resource, **quantities)
+
+
+def mark(stage: str):
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.mark(stage)
+
+
+def _run_attached(fn: Callable, args, kwargs):
+    from services import profiler
+
+    with profiler.attached():
+        return fn(*args, **kwargs)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    Wrap fn so it records into the caller's ledger when run on another thread
+    (and is sampled by the caller's profile, if one is running)
+    """
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.copy().run(_run_attached, fn, args, kwargs)
+
+    return bound
+
+
+@contextmanager
+def measure(resource: str, **quantities):
+    """Record resource with the wall and CPU time of the block; the yielded dict can add quantities"""
+    extra: Dict[str, Any] = {}
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield extra
+    finally:
+        quantities.update(extra)
+        quantities.setdefault("wall_ms", round((time.perf_counter() - wall) * 1000, 2))
+        quantities.setdefault("cpu_ms", round((time.thread_time() - cpu) * 1000, 2))
+        record(resource, **quantities)
+
+
+# ----------------------
+# Aggregation
+# ----------------------
+def estimated_usd(row: Dict[str, Any]) -> float:
+    resource = row.get("resource")
+    cost = (row.get("prompt_tokens", 0) * PRICE_PROMPT_PER_1K + row.get("completion_tokens", 0) * PRICE_COMPLETION_PER_1K) / 1000
+    if resource == "ade_parse":
+        cost += row.get("calls", 0) * PRICE_ADE_PARSE_PER_CALL
+    elif resource == "ade_extract":
+        cost += row.get("calls", 0) * PRICE_ADE_EXTRACT_PER_CALL
+    return round(cost, 6)
+
+
+def aggregate(session, group_by: List[str], task_id: str = None, chat_id: str = None,
+              days: int = None, resources: List[str] = None, order_by: str = None, limit: int = None) -> List[Dict[str, Any]]:
+    """
+    Sum every quantity grouped by UsageRecord columns (or "day").
+    The stage-timing rows are left out unless resources asks for them, so
+    cpu_ms / wall_ms are not counted twice.
+    """
+    from sqlalchemy import func
+    from sqlmodel import select
+    from models import UsageRecord
+
+    keys = [func.date(UsageRecord.created_at).label("day") if g == "day" else getattr(UsageRecord, g) for g in group_by]
+    sums = [func.sum(getattr(UsageRecord, q)).label(q) for q in QUANTITIES]
+    statement = select(*keys, *sums)
+    if task_id:
+        statement = statement.where(UsageRecord.task_id == task_id)
+    if chat_id:
+        statement = statement.where(UsageRecord.chat_id == chat_id)
+    if days:
+        statement = statement.where(UsageRecord.created_at >= datetime.utcnow() - timedelta(days=days))
+    if resources:
+        statement = statement.where(UsageRecord.resource.in_(resources))
+    else:
+        statement = statement.where(UsageRecord.resource != "stage")
+    for g in group_by:
+        if g != "day":
+            statement = statement.where(getattr(UsageRecord, g).is_not(None))
+    statement = statement.group_by(*keys)
+    if order_by:
+        statement = statement.order_by(func.sum(getattr(UsageRecord, order_by)).desc())
+    else:
+        statement = statement.order_by(*keys)
+    if limit:
+        statement = statement.limit(limit)
+
+    rows = []
+    for values in session.exec(statement).all():
+        row = dict(zip(group_by + list(QUANTITIES), values))
+        for q in QUANTITIES:
+            row[q] = round(row[q] or 0, 2) if q.endswith("_ms") else int(row[q] or 0)
+        rows.append(row)
+    return rows
+
+
+def totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    total = {q: 0 for q in QUANTITIES}
+    for row in rows:
+        for q in QUANTITIES:
+            total[q] += row.get(q, 0)
+    total["cpu_ms"] = round(total["cpu_ms"], 2)
+    total["wall_ms"] = round(total["wall_ms"], 2)
+    total["estimated_usd"] = round(sum(row.get("estimated_usd", 0) for row in rows), 6)
+    return total
+
+
+def by_resource(session, **filters) -> List[Dict[str, Any]]:
+    rows = aggregate(session, ["resource"], **filters)
+    for row in rows:
+        row["estimated_usd"] = estimated_usd(row)
+    return rows
+
+
+def costed(session, group_by: List[str], **filters) -> List[Dict[str, Any]]:
+    """aggregate() with estimated_usd, priced per resource and then rolled up to group_by"""
+    rows = aggregate(session, group_by + ["resource"], **filters)
+    grouped: Dict[tuple, Dict[str, Any]] = {}
+    for row in rows:
+        key = tuple(row[g] for g in group_by)
+        out = grouped.setdefault(key, {**{g: row[g] for g in group_by}, **{q: 0 for q in QUANTITIES}, "estimated_usd": 0.0})
+        for q in QUANTITIES:
+            out[q] += row[q]
+        out["estimated_usd"] = round(out["estimated_usd"] + estimated_usd(row), 6)
+    for out in grouped.values():
+        out["cpu_ms"] = round(out["cpu_ms"], 2)
+        out["wall_ms"] = round(out["wall_ms"], 2)
+    return list(grouped.values())
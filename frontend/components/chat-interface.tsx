@@ -1,6 +1,6 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { Button } from "@/components/ui/button"
 import { Textarea } from "@/components/ui/textarea"
 import { ScrollArea } from "@/components/ui/scroll-area"
@@ -31,9 +31,12 @@ export function ChatInterface({ selectedDataroom, onShowDocuments, onShowUpload,
   const [isAnalyzing, setIsAnalyzing] = useState(false)
   const [progressStatus, setProgressStatus] = useState("")
   const [progressPercent, setProgressPercent] = useState(0)
+  // One conversation per open chat: its follow-ups share context on the backend, other analysts' do not
+  const conversationId = useRef<string>(crypto.randomUUID())
 
   // Load previous chats when dataroom changes
   useEffect(() => {
+    conversationId.current = crypto.randomUUID()
     if (!selectedDataroom) {
       setMessages([])
       return
@@ -80,7 +83,10 @@ export function ChatInterface({ selectedDataroom, onShowDocuments, onShowUpload,
 
     try {
       // Send chat message
-      const chatResponse = await chatApi.send(selectedDataroom.id, { message: userInput })
+      const chatResponse = await chatApi.send(selectedDataroom.id, {
+        message: userInput,
+        conversation_id: conversationId.current,
+      })
 
       // Poll for status updates
       await pollChatStatus(
@@ -53,14 +53,21 @@ export const documentsApi = {
   list: (taskId: string) => apiRequest<Document[]>(`/tasks/${taskId}/documents`),
 
   // POST /tasks/{task_id}/documents - Upload a document
-  upload: async (taskId: string, file: File): Promise<Document> => {
+  // Retries while the server answers 429 (ingestion queue full), waiting as long as Retry-After says
+  upload: async (taskId: string, file: File, maxAttempts: number = 5): Promise<Document> => {
     const formData = new FormData()
     formData.append("file", file)
 
-    const response = await fetch(`${API_BASE_URL}/tasks/${taskId}/documents`, {
-      method: "POST",
-      body: formData,
-    })
+    let response: Response
+    for (let attempt = 1; ; attempt++) {
+      response = await fetch(`${API_BASE_URL}/tasks/${taskId}/documents`, {
+        method: "POST",
+        body: formData,
+      })
+      if (response.status !== 429 || attempt >= maxAttempts) break
+      const retryAfter = Number(response.headers.get("Retry-After")) || 5
+      await new Promise((resolve) => setTimeout(resolve, Math.min(retryAfter, 60) * 1000))
+    }
 
     if (!response.ok) {
       throw new Error(`Upload failed: ${response.status} ${response.statusText}`)
@@ -72,8 +79,16 @@ export const documentsApi = {
 
 // Chat API
 export const chatApi = {
-  // GET /tasks/{task_id}/chat - Get all chats for a task
-  getAll: (taskId: string) => apiRequest<ChatAnswer[]>(`/tasks/${taskId}/chat`),
+  // GET /tasks/{task_id}/chat - Get chats for a task (all, or paged/incremental)
+  getAll: (taskId: string, params?: { limit?: number; before?: string; since?: string; includeDetails?: boolean }) => {
+    const query = new URLSearchParams()
+    if (params?.limit) query.set("limit", String(params.limit))
+    if (params?.before) query.set("before", params.before)
+    if (params?.since) query.set("since", params.since)
+    if (params?.includeDetails === false) query.set("include_details", "false")
+    const qs = query.toString()
+    return apiRequest<ChatAnswer[]>(`/tasks/${taskId}/chat${qs ? `?${qs}` : ""}`)
+  },
 
   // POST /tasks/{task_id}/chat - Send a message
   send: (taskId: string, data: ChatRequest) =>
@@ -95,9 +110,9 @@ export const memoApi = {
   // GET /tasks/{task_id}/memo - Get live memo
   get: (taskId: string) => apiRequest<Memo>(`/tasks/${taskId}/memo`),
 
-  // POST /tasks/{task_id}/memo/export - Export memo
+  // POST /tasks/{task_id}/memo/export - Export memo (waits for the background render)
   export: (taskId: string) =>
-    apiRequest<MemoExportResponse>(`/tasks/${taskId}/memo/export`, {
+    apiRequest<MemoExportResponse>(`/tasks/${taskId}/memo/export?wait=30`, {
       method: "POST",
     }),
 }
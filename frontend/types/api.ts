@@ -21,6 +21,8 @@ export interface Document {
 
 export interface ChatRequest {
   message: string
+  // Follow-ups in the same conversation reuse its earlier turns and retrieved excerpts
+  conversation_id?: string
 }
 
 export interface ChatResponse {
@@ -43,6 +45,7 @@ export interface ReasoningStep {
 export interface ReasoningData {
   sub_queries?: string[]
   insights?: string[]
+  timings?: Record<string, number | string>  // Optional: Per-stage RAG timings (ms) and decomposition source
 }
 
 export type ReasoningLog = string | ReasoningStep | ReasoningData
@@ -52,6 +55,9 @@ export interface Citation {
   page: string      // Changed from number to string to support "Chunk X" format
   sub_query?: string  // Optional: Which sub-query found this citation
   sub_query_index?: number  // Optional: Index of the sub-query
+  section?: string  // Optional: Heading trail of the cited chunk
+  chunk_index?: number  // Optional: Chunk position within the document
+  char_span?: [number, number]  // Optional: Character offsets into the document markdown
 }
 
 export interface ChatAnswer {
@@ -78,5 +84,8 @@ export interface Memo {
 
 export interface MemoExportResponse {
   task_id: string
-  file_url: string
+  status: "ready" | "pending"
+  hash: string
+  download_url: string  // GET to download the PDF (202 while still rendering)
+  file_url: string  // Same as download_url
 }